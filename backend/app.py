@@ -11,7 +11,19 @@ from datetime import datetime
 import uvicorn
 
 # Importar las rutas modularizadas
-from routes import auth, cfdis, utils
+from routes import auth, cfdis, jobs, utils
+from services.catalogs import close_catalog_engine
+from services.cfdi_store import get_cfdi_store
+from services.cfdi_generation import close_generator
+from services.compression import CompressionMiddleware
+from services.http_cache import EXPOSED_HEADERS
+from services.job_events import get_job_broadcaster
+from services.job_handlers import register_handlers
+from services.jobs import get_job_queue
+from services.passwords import get_hash_pool
+from services.quotas import QuotaMiddleware
+from services.rate_limit import get_rate_limiter
+from services.sat_validation import close_validation_engine
 
 # Crear la instancia de FastAPI
 app = FastAPI(
@@ -22,6 +34,9 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# Cuotas por tenant; se agrega antes que CORS para que los 429 lleven sus headers
+app.add_middleware(QuotaMiddleware)
+
 # Configurar CORS para permitir conexiones desde el frontend React
 app.add_middleware(
     CORSMiddleware,
@@ -33,11 +48,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=EXPOSED_HEADERS,
 )
 
+# gzip/brotli para respuestas grandes que no vienen ya comprimidas de la caché
+app.add_middleware(CompressionMiddleware)
+
 # Incluir las rutas modularizadas
 app.include_router(auth.router)    # Rutas de autenticación: /api/auth/*
 app.include_router(cfdis.router)   # Rutas de CFDIs: /api/cfdis/*  
+app.include_router(jobs.router)    # Rutas de trabajos: /api/jobs/*
 app.include_router(utils.router)   # Rutas de utilidad: /api/*
 
 # ==================== RUTA RAÍZ ====================
@@ -115,15 +135,27 @@ async def validation_error_handler(request, exc):
 
 @app.on_event("startup")
 async def startup_event():
+    register_handlers(get_job_queue())
+    get_job_broadcaster().attach(get_job_queue())
+    recovered = get_job_queue().recover()
     print("🚀 MVP CFDI Backend iniciado exitosamente")
     print("📊 Servidor: http://localhost:8000")
     print("📖 Documentación Swagger: http://localhost:8000/docs")
     print("📘 Documentación ReDoc: http://localhost:8000/redoc")
     print("🔄 CORS habilitado para: http://localhost:3000")
     print("✅ Todas las rutas cargadas correctamente")
+    if recovered:
+        print(f"♻️  {recovered} trabajos pendientes retomados")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await close_validation_engine()
+    get_job_queue().shutdown()
+    get_hash_pool().close()
+    get_rate_limiter().backend.close()
+    close_generator()
+    close_catalog_engine()
+    get_cfdi_store().close()
     print("🛑 MVP CFDI Backend detenido")
 
 # ==================== INICIALIZACIÓN ====================
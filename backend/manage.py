@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+MVP CFDI - Comandos de administración
+Uso: python manage.py <comando> [opciones]
+"""
+
+import argparse
+
+from services.catalogs import CATALOGOS_DB_PATH
+from services.ingest import DEFAULT_BATCH_SIZE, ingest
+from services.storage import DATA_FILE_PATH, SQLITE_PATH, migrate_json_to_sqlite
+
+
+def cmd_migrate_sqlite(args: argparse.Namespace) -> None:
+    print(f"📦 Migrando {args.source} -> {args.target}")
+    counts = migrate_json_to_sqlite(args.source, args.target)
+    for collection, total in counts.items():
+        print(f"✅ {collection}: {total} registros")
+    print("🔄 Usa CFDI_STORAGE=sqlite para iniciar el backend con SQLite")
+
+
+def cmd_ingest(args: argparse.Namespace) -> None:
+    from services.cfdi_store import get_cfdi_store
+
+    store = get_cfdi_store()
+    print(f"📥 Importando XMLs desde {args.path}")
+    report = ingest(
+        args.path,
+        lambda batch: store.insert_records("cfdis_descargados", batch)[0],
+        workers=args.workers,
+        batch_size=args.batch_size,
+        on_progress=lambda r: print(f"   {r.procesados} procesados, {r.insertados} insertados", end="\r")
+    )
+    store.close()
+    result = report.to_dict()
+    print(f"\n✅ {result['insertados']} CFDIs importados en {result['duracion_segundos']}s "
+          f"({result['archivos_por_segundo']} archivos/s), {result['duplicados']} duplicados omitidos")
+    for error in result["errores"]:
+        print(f"❌ {error['archivo']}: {error['error']}")
+
+
+def cmd_fake_sat(args: argparse.Namespace) -> None:
+    import uvicorn
+
+    from services.fake_sat import create_app
+
+    print(f"🧪 SAT local en http://{args.host}:{args.port}/ConsultaCFDIService.svc "
+          f"(latencia {args.latency_ms}ms, errores {args.error_rate:.0%})")
+    print(f"🔄 Usa CFDI_SAT_TRANSPORT=http CFDI_SAT_URL=http://{args.host}:{args.port}/ConsultaCFDIService.svc")
+    app = create_app(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+def cmd_load_catalogos(args: argparse.Namespace) -> None:
+    import time
+
+    from services.catalogs import CatalogEngine, CatalogError
+
+    engine = CatalogEngine(args.db)
+    only = [name.strip() for name in args.only.split(",") if name.strip()] if args.only else None
+    try:
+        for path in args.paths:
+            print(f"📚 Cargando catálogos desde {path}")
+            started = time.perf_counter()
+            try:
+                counts = engine.load_file(path, only)
+            except (CatalogError, OSError) as e:
+                print(f"❌ {path}: {e}")
+                continue
+            for name, total in counts.items():
+                print(f"✅ {name}: {total} claves")
+            if not counts:
+                print("⚠️  No se encontró ningún catálogo")
+            print(f"   {time.perf_counter() - started:.1f}s")
+    finally:
+        engine.close()
+    print(f"🔄 Los workers en marcha ven los catálogos nuevos sin reiniciar ({args.db})")
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def cmd_bench_login(args: argparse.Namespace) -> None:
+    """
+    Logins concurrentes contra un backend en marcha mientras otro hilo mide la
+    latencia de /api/health: si el hashing bloqueara el event loop, esa latencia
+    subiría al nivel de un bcrypt por petición en cola
+    """
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    import requests
+
+    login_url = f"{args.url}/api/auth/login"
+    health_url = f"{args.url}/api/health"
+    credentials = {"username": args.username, "password": args.password}
+    deadline = time.perf_counter() + args.duration
+    lock = threading.Lock()
+    latencies, probes = [], []
+    counts = {"ok": 0, "ocupado": 0, "limitado": 0, "otros": 0}
+    status_keys = {200: "ok", 503: "ocupado", 429: "limitado"}
+
+    def login_worker() -> None:
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = session.post(login_url, json=credentials, timeout=30)
+            elapsed = time.perf_counter() - start
+            key = status_keys.get(response.status_code, "otros")
+            with lock:
+                counts[key] += 1
+                if key == "ok":
+                    latencies.append(elapsed)
+            if key in ("ocupado", "limitado"):
+                # un cliente bien portado respeta Retry-After
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+
+    def probe_worker() -> None:
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            session.get(health_url, timeout=30)
+            probes.append(time.perf_counter() - start)
+            time.sleep(args.probe_interval_ms / 1000)
+
+    print(f"🔐 {args.concurrency} clientes haciendo login en {login_url} durante {args.duration}s")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency + 1) as executor:
+        futures = [executor.submit(login_worker) for _ in range(args.concurrency)]
+        futures.append(executor.submit(probe_worker))
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    print(f"✅ {counts['ok']} logins en {elapsed:.1f}s = {counts['ok'] / elapsed:.1f} logins/s")
+    print(f"   503 por saturación: {counts['ocupado']}, 429 por límite de intentos: {counts['limitado']}, "
+          f"otros errores: {counts['otros']}")
+    print(f"   latencia login p50 {percentile(latencies, 0.5) * 1000:.0f}ms, p95 {percentile(latencies, 0.95) * 1000:.0f}ms")
+    print(f"📈 /api/health durante la prueba ({len(probes)} muestras): "
+          f"p50 {percentile(probes, 0.5) * 1000:.1f}ms, p99 {percentile(probes, 0.99) * 1000:.1f}ms, "
+          f"max {max(probes, default=0) * 1000:.1f}ms")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Comandos de administración del MVP CFDI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate-sqlite", help="Importa el archivo JSON de datos a SQLite")
+    migrate.add_argument("--source", default=DATA_FILE_PATH, help="Archivo JSON de origen")
+    migrate.add_argument("--target", default=SQLITE_PATH, help="Base de datos SQLite destino")
+    migrate.set_defaults(handler=cmd_migrate_sqlite)
+
+    ingest_parser = commands.add_parser("ingest", help="Importa un directorio o ZIP de XMLs CFDI")
+    ingest_parser.add_argument("path", help="Directorio, ZIP o XML a importar")
+    ingest_parser.add_argument("--workers", type=int, default=None, help="Procesos para parsear (default: núcleos)")
+    ingest_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Registros por lote de inserción")
+    ingest_parser.set_defaults(handler=cmd_ingest)
+
+    fake_sat = commands.add_parser("fake-sat", help="Levanta un servicio de estatus del SAT local para pruebas")
+    fake_sat.add_argument("--host", default="127.0.0.1")
+    fake_sat.add_argument("--port", type=int, default=8081)
+    fake_sat.add_argument("--latency-ms", type=float, default=50, help="Latencia fija por consulta")
+    fake_sat.add_argument("--jitter-ms", type=float, default=0, help="Latencia aleatoria adicional máxima")
+    fake_sat.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas 503")
+    fake_sat.set_defaults(handler=cmd_fake_sat)
+
+    catalogos = commands.add_parser("load-catalogos", help="Carga catálogos del SAT (XLS oficial o CSV) a su base indexada")
+    catalogos.add_argument("paths", nargs="+", help="Archivos .xls (requiere xlrd) o .csv; uno por catálogo o el libro completo")
+    catalogos.add_argument("--only", help="Solo estos catálogos, separados por coma (p. ej. c_ClaveProdServ,c_ClaveUnidad)")
+    catalogos.add_argument("--db", default=CATALOGOS_DB_PATH, help="Base SQLite de catálogos")
+    catalogos.set_defaults(handler=cmd_load_catalogos)
+
+    bench_login = commands.add_parser("bench-login", help="Mide logins/s y la latencia del resto de la API mientras tanto")
+    bench_login.add_argument("--url", default="http://127.0.0.1:8000", help="Backend en marcha")
+    bench_login.add_argument("--username", default="admin")
+    bench_login.add_argument("--password", default="admin123")
+    bench_login.add_argument("--concurrency", type=int, default=16, help="Clientes haciendo login a la vez")
+    bench_login.add_argument("--duration", type=float, default=10, help="Segundos de prueba")
+    bench_login.add_argument("--probe-interval-ms", type=float, default=50, help="Pausa entre consultas a /api/health")
+    bench_login.set_defaults(handler=cmd_bench_login)
+
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = build_parser().parse_args()
+    arguments.handler(arguments)
@@ -1,50 +1,90 @@
 """
 MVP CFDI - Rutas de Autenticación
-Endpoints para login y manejo de sesiones básicas
+Endpoints para login y manejo de sesiones con tokens firmados (JWT)
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
-from typing import Dict, Any
-from datetime import datetime, timedelta
-import hashlib
+from typing import Dict, Any, Optional
+from datetime import datetime
+import os
+
+from services.auth_tokens import TokenError, get_token_manager
+from services.passwords import HashPoolBusy, get_hash_pool
+from services.rate_limit import RateLimited, get_rate_limiter
 
 router = APIRouter(prefix="/api/auth", tags=["Autenticación"])
 
+bearer_scheme = HTTPBearer(auto_error=False)
+
+# Acepta cualquier usuario/contraseña no vacíos (solo para demos)
+ALLOW_ANY_USER = os.getenv("CFDI_AUTH_DEMO_ANY_USER", "").lower() in ("1", "true", "si", "sí")
+# Con X-Forwarded-For solo si el backend está detrás de un proxy confiable
+TRUST_PROXY = os.getenv("CFDI_TRUST_PROXY", "").lower() in ("1", "true", "si", "sí")
+
+# Hash de una contraseña que nadie conoce: un usuario inexistente cuesta lo mismo
+# que uno existente y el tiempo de respuesta no revela qué usuarios existen
+DUMMY_PASSWORD_HASH = "$2b$12$fuGtvY2BexiWpxexxKR3muQuu5ZjuR.EzG.4yVhkO.zaSLhQuJttG"
+
 class LoginRequest(BaseModel):
     username: str
     password: str
 
+# Contraseñas con bcrypt (12 rondas); las de demo están en el README
 DEMO_USERS = {
     "admin": {
-        "password": "admin123",
+        "password_hash": "$2b$12$iN6qezZHON7BgautuetLgeDY4o962lAI89.F7dNfOENCij0RDUHbC",
         "nombre": "Administrador Demo",
         "rol": "admin",
         "email": "admin@mvp-cfdi.com"
     },
     "usuario": {
-        "password": "user123", 
+        "password_hash": "$2b$12$7quyc7wkFM4Bb5TxhzwiyOqSGzvJWVNZfiUK45kr6eFTp3d5ERX2q",
         "nombre": "Usuario Demo",
         "rol": "user",
         "email": "usuario@mvp-cfdi.com"
     },
     "demo": {
-        "password": "demo",
+        "password_hash": "$2b$12$yp.sreyvGkj2mn7ZUBw5k.K4Ob3qRi9v9LCpvBnqljlIjSbTZaMhW",
         "nombre": "Usuario Demostración",
         "rol": "demo",
         "email": "demo@mvp-cfdi.com"
     }
 }
 
-def generate_demo_token(username: str) -> str:
-    timestamp = datetime.now().isoformat()
-    raw_token = f"{username}:{timestamp}:mvp-cfdi-2024"
-    return hashlib.md5(raw_token.encode()).hexdigest()
+def verify_token(token: Optional[str]) -> Dict[str, Any]:
+    if not token:
+        raise HTTPException(
+            status_code=401,
+            detail="Token requerido",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    try:
+        return get_token_manager().verify(token)
+    except TokenError as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+
+async def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)
+) -> Dict[str, Any]:
+    """Dependencia de las rutas protegidas: claims del token `Authorization: Bearer`"""
+    return verify_token(credentials.credentials if credentials else None)
 
-def validate_credentials(username: str, password: str) -> Dict[str, Any]:
-    if username in DEMO_USERS:
-        user_data = DEMO_USERS[username]
-        if user_data["password"] == password:
+async def get_stream_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+    access_token: Optional[str] = Query(None)
+) -> Dict[str, Any]:
+    """Igual que get_current_user; EventSource no envía headers, así que acepta ?access_token="""
+    return verify_token(credentials.credentials if credentials else access_token)
+
+async def validate_credentials(username: str, password: str) -> Dict[str, Any]:
+    """La verificación bcrypt corre en el pool de hashing; lanza HashPoolBusy si está saturado"""
+    user_data = DEMO_USERS.get(username)
+    if user_data is None and not ALLOW_ANY_USER:
+        await get_hash_pool().verify(password, DUMMY_PASSWORD_HASH)
+    if user_data is not None:
+        if await get_hash_pool().verify(password, user_data["password_hash"]):
             return {
                 "valid": True,
                 "user": {
@@ -55,7 +95,7 @@ def validate_credentials(username: str, password: str) -> Dict[str, Any]:
                 }
             }
     
-    if username and password:
+    if ALLOW_ANY_USER and username and password:
         return {
             "valid": True,
             "user": {
@@ -68,8 +108,22 @@ def validate_credentials(username: str, password: str) -> Dict[str, Any]:
     
     return {"valid": False, "user": None}
 
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else ""
+
+def too_many_attempts(e: RateLimited) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=f"Demasiados intentos de inicio de sesión, intenta de nuevo en {e.retry_after} segundos",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
 @router.post("/login")
-async def login(credentials: LoginRequest):
+async def login(credentials: LoginRequest, request: Request):
     try:
         if not credentials.username or not credentials.password:
             raise HTTPException(
@@ -77,15 +131,32 @@ async def login(credentials: LoginRequest):
                 detail="Username y password son requeridos"
             )
         
-        validation = validate_credentials(credentials.username, credentials.password)
+        # Se rechaza antes de gastar un bcrypt: cada intento cuenta por IP y los
+        # fallidos también por usuario
+        limiter = get_rate_limiter()
+        username_key = credentials.username.strip().lower()
+        try:
+            limiter.hit("login", "ip", client_ip(request))
+            limiter.check("login", "user", username_key)
+        except RateLimited as e:
+            raise too_many_attempts(e)
+        
+        try:
+            validation = await validate_credentials(credentials.username, credentials.password)
+        except HashPoolBusy:
+            raise HTTPException(
+                status_code=503,
+                detail="Demasiados inicios de sesión en curso, intenta de nuevo",
+                headers={"Retry-After": "1"}
+            )
         
         if validation["valid"]:
-            token = generate_demo_token(credentials.username)
-            
             user_data = validation["user"]
+            token, claims = get_token_manager().issue(user_data)
+            
             user_data.update({
-                "login_time": datetime.now().isoformat(),
-                "session_expires": (datetime.now() + timedelta(hours=8)).isoformat()
+                "login_time": datetime.fromtimestamp(claims["iat"]).isoformat(),
+                "session_expires": datetime.fromtimestamp(claims["exp"]).isoformat()
             })
             
             return {
@@ -96,6 +167,10 @@ async def login(credentials: LoginRequest):
                 "timestamp": datetime.now().isoformat()
             }
         else:
+            try:
+                limiter.hit("login", "user", username_key)
+            except RateLimited:
+                pass
             raise HTTPException(
                 status_code=401,
                 detail="Credenciales inválidas"
@@ -110,11 +185,18 @@ async def login(credentials: LoginRequest):
         )
 
 @router.post("/logout")
-async def logout(token: Dict[str, str]):
+async def logout(
+    token: Optional[Dict[str, str]] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)
+):
     try:
-        user_token = token.get("token", "")
+        user_token = (token or {}).get("token", "") or (credentials.credentials if credentials else "")
         
         if user_token:
+            try:
+                get_token_manager().revoke(user_token)
+            except TokenError as e:
+                raise HTTPException(status_code=401, detail=str(e))
             return {
                 "success": True,
                 "message": "Logout exitoso",
@@ -3,105 +3,458 @@ MVP CFDI - Rutas de CFDIs
 Endpoints específicos para la gestión de CFDIs
 """
 
-from fastapi import APIRouter, HTTPException
-from typing import Dict, Any, List
-import json
-import os
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Dict, Any, List, Optional
 from datetime import datetime
+import asyncio
+import os
+import shutil
+import tempfile
 
-router = APIRouter(prefix="/api/cfdis", tags=["CFDIs"])
+from routes.auth import get_current_user
+from services.amounts import format_centavos
+from services.cfdi_crypto import merge_result, validate_batch
+from services.cfdi_generation import MAX_BATCH, active_generator
+from services.cfdi_index import CFDICollection, serie_folio
+from services.cfdi_store import get_cfdi_store, resolve_collection
+from services.export import EXPORT_FORMATS, export_chunks
+from services.folios import audit_series
+from services.http_cache import conditional_snapshot
+from services.ingest import ingest, iter_tasks
+from services.jobs import get_job_queue
+from services.pagination import DEFAULT_LIMIT, MAX_LIMIT, CursorError, parse_fields
+from services.sat_validation import get_validation_engine, records_to_validate, validate_records
 
-DATA_FILE_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "dummy_cfdis.json")
+router = APIRouter(prefix="/api/cfdis", tags=["CFDIs"], dependencies=[Depends(get_current_user)])
 
-def load_cfdi_data() -> Dict[str, Any]:
-    try:
-        with open(DATA_FILE_PATH, 'r', encoding='utf-8') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        raise HTTPException(status_code=500, detail="Archivo de datos no encontrado")
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Error al leer el archivo de datos")
-
-def save_cfdi_data(data: Dict[str, Any]) -> bool:
+class ValidationRunRequest(BaseModel):
+    ids: Optional[List[str]] = None
+
+class ConceptoPayload(BaseModel):
+    clave_prod_serv: str = "01010101"
+    cantidad: str
+    clave_unidad: str = "H87"
+    descripcion: str
+    valor_unitario: str
+    objeto_imp: str = "02"
+    tasa_iva: str = "0.160000"
+
+class ComprobantePayload(BaseModel):
+    serie: str = ""
+    emisor_rfc: str
+    emisor_nombre: str
+    regimen_fiscal: str = "601"
+    receptor_rfc: str
+    receptor_nombre: str
+    domicilio_fiscal_receptor: str
+    regimen_fiscal_receptor: str = "616"
+    uso_cfdi: str = "G03"
+    forma_pago: str
+    metodo_pago: str = "PUE"
+    moneda: str = "MXN"
+    tipo_comprobante: str = "I"
+    exportacion: str = "01"
+    lugar_expedicion: str
+    conceptos: List[ConceptoPayload]
+
+class GenerationBatchRequest(BaseModel):
+    comprobantes: List[ComprobantePayload]
+
+def get_page(cfdis: CFDICollection, cursor: Optional[str], limit: int, fields: Optional[str], keys=None):
     try:
-        with open(DATA_FILE_PATH, 'w', encoding='utf-8') as file:
-            json.dump(data, file, indent=2, ensure_ascii=False)
-        return True
-    except Exception:
-        return False
+        return cfdis.page(keys, cursor, limit, parse_fields(fields))
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/download")
-async def get_downloaded_cfdis():
+async def get_downloaded_cfdis(
+    request: Request,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
     try:
-        data = load_cfdi_data()
-        cfdis = data.get("cfdis_descargados", [])
+        cache = await conditional_snapshot(request, "cfdis")
+        if cache.hit is not None:
+            return cache.hit
+        cfdis = cache.snapshot.collection("cfdis_descargados")
+        page, next_cursor = get_page(cfdis, cursor, limit, fields)
         
-        return {
+        return await cache.respond({
             "success": True,
             "action": "download",
             "total_cfdis": len(cfdis),
             "message": f"Se obtuvieron {len(cfdis)} CFDIs descargados",
-            "data": cfdis,
+            "data": page,
+            "limit": limit,
+            "next_cursor": next_cursor
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener CFDIs descargados: {str(e)}")
+
+def save_upload(upload: UploadFile, suffix: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, 'wb') as file:
+        shutil.copyfileobj(upload.file, file)
+    return path
+
+@router.post("/download/ingest")
+async def ingest_cfdis(file: UploadFile = File(...)):
+    """
+    Ingesta masiva: recibe un ZIP con XMLs (o un solo XML) y agrega los CFDIs a cfdis_descargados
+    """
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    if suffix not in (".zip", ".xml"):
+        raise HTTPException(status_code=400, detail="Se esperaba un archivo .zip o .xml")
+    
+    path = await asyncio.to_thread(save_upload, file, suffix)
+    try:
+        store = get_cfdi_store()
+        report = await asyncio.to_thread(
+            ingest,
+            path,
+            lambda batch: store.insert_records("cfdis_descargados", batch)[0]
+        )
+        return {
+            "success": True,
+            "action": "ingest",
+            "message": f"Se importaron {report.insertados} CFDIs",
+            "resultado": report.to_dict(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener CFDIs descargados: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error al importar CFDIs: {str(e)}")
+    finally:
+        os.unlink(path)
 
 @router.get("/validate")
-async def get_validated_cfdis():
+async def get_validated_cfdis(
+    request: Request,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
     try:
-        data = load_cfdi_data()
-        cfdis = data.get("cfdis_validacion", [])
+        cache = await conditional_snapshot(request, "cfdis")
+        if cache.hit is not None:
+            return cache.hit
+        cfdis = cache.snapshot.collection("cfdis_validacion")
+        page, next_cursor = get_page(cfdis, cursor, limit, fields)
         
-        stats = {
-            "validos": 0,
-            "cancelados": 0,
-            "errores": 0
-        }
+        return await cache.respond({
+            "success": True,
+            "action": "validate",
+            "total_cfdis": len(cfdis),
+            "message": f"Se validaron {len(cfdis)} CFDIs",
+            "estadisticas": cfdis.stats.totales(),
+            "data": page,
+            "limit": limit,
+            "next_cursor": next_cursor
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al validar CFDIs: {str(e)}")
+
+@router.post("/validate/run")
+async def run_validation(request: Optional[ValidationRunRequest] = None):
+    """
+    Consulta el estatus en el SAT de los CFDIs descargados (todos o los `ids` indicados)
+    y guarda el resultado en cfdis_validacion
+    """
+    try:
+        store = get_cfdi_store()
+        snapshot = await store.asnapshot()
+        records = records_to_validate(
+            snapshot.collection("cfdis_descargados"),
+            snapshot.collection("cfdis_validacion"),
+            request.ids if request else None
+        )
+        omitidos = sum(1 for record in records if not record.get("uuid"))
         
-        for cfdi in cfdis:
-            estado = cfdi.get("estado", "").lower()
-            if estado == "válido":
-                stats["validos"] += 1
-            elif estado == "cancelado":
-                stats["cancelados"] += 1
-            else:
-                stats["errores"] += 1
+        engine = get_validation_engine()
+        counts, results = await validate_records(
+            records,
+            lambda batch: store.upsert_records("cfdis_validacion", batch),
+            engine
+        )
+        simulado = engine.transport.simulated
         
         return {
             "success": True,
             "action": "validate",
-            "total_cfdis": len(cfdis),
-            "message": f"Se validaron {len(cfdis)} CFDIs",
-            "estadisticas": stats,
-            "data": cfdis,
+            "message": f"Se consultaron {len(results)} CFDIs en el SAT"
+                       + (" (transporte local de demostración: estatus simulados)" if simulado else ""),
+            "simulado": simulado,
+            "resultado": {
+                "consultados": len(results),
+                "desde_cache": sum(1 for result in results if result.cached),
+                "omitidos_sin_uuid": omitidos,
+                "reintentos": sum(max(result.attempts - 1, 0) for result in results),
+                "por_estado": counts
+            },
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al validar CFDIs: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error al validar CFDIs en el SAT: {str(e)}")
 
-@router.get("/generate")
-async def get_generated_cfdis():
+@router.post("/validate/crypto")
+async def validate_crypto(file: UploadFile = File(...)):
+    """
+    Validación local de sello y certificado para un ZIP de XMLs (o un solo XML);
+    actualiza sello_valido / certificado_valido en cfdis_validacion
+    """
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    if suffix not in (".zip", ".xml"):
+        raise HTTPException(status_code=400, detail="Se esperaba un archivo .zip o .xml")
+    
+    path = await asyncio.to_thread(save_upload, file, suffix)
     try:
-        data = load_cfdi_data()
-        cfdis = data.get("cfdis_generados", [])
+        results = await asyncio.to_thread(lambda: validate_batch(iter_tasks(path)))
         
-        total_amount = 0
-        for cfdi in cfdis:
-            total_str = cfdi.get("total", "$0.00").replace("$", "").replace(",", "")
-            try:
-                total_amount += float(total_str)
-            except ValueError:
-                pass
+        store = get_cfdi_store()
+        snapshot = await store.asnapshot()
+        validacion = snapshot.collection("cfdis_validacion")
+        descargados = snapshot.collection("cfdis_descargados")
+        updates = []
+        for result in results:
+            if not result.get("uuid"):
+                continue
+            ids = validacion.lookup("uuid", result["uuid"]) or descargados.lookup("uuid", result["uuid"])
+            for record_id in ids:
+                record = validacion.get(record_id) or descargados.get(record_id)
+                updates.append(merge_result(record, result))
+        if updates:
+            await asyncio.to_thread(store.upsert_records, "cfdis_validacion", updates)
         
         return {
+            "success": True,
+            "action": "validate",
+            "message": f"Se validaron localmente {len(results)} CFDIs",
+            "resultado": {
+                "procesados": len(results),
+                "sellos_validos": sum(1 for result in results if result["sello_valido"]),
+                "certificados_validos": sum(1 for result in results if result["certificado_valido"]),
+                "actualizados": len(updates),
+                "data": results[:MAX_LIMIT]
+            },
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en la validación local de CFDIs: {str(e)}")
+    finally:
+        os.unlink(path)
+
+@router.get("/validate/cache")
+async def get_status_cache_stats():
+    cache = get_validation_engine().cache
+    return {
+        "success": True,
+        "action": "validate",
+        "habilitada": cache is not None,
+        "estadisticas": cache.stats() if cache is not None else None,
+        "message": "Estadísticas de la caché de estatus SAT",
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/validate/stats")
+async def get_validation_stats(request: Request):
+    try:
+        cache = await conditional_snapshot(request, "cfdis")
+        if cache.hit is not None:
+            return cache.hit
+        cfdis = cache.snapshot.collection("cfdis_validacion")
+        
+        return await cache.respond({
+            "success": True,
+            "action": "validate",
+            "total_cfdis": len(cfdis),
+            "estadisticas": cfdis.stats.totales(),
+            "por_emisor": cfdis.stats.por_emisor(),
+            "por_mes": cfdis.stats.por_mes(),
+            "message": "Estadísticas de validación obtenidas correctamente"
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener estadísticas de validación: {str(e)}")
+
+@router.get("/generate")
+async def get_generated_cfdis(
+    request: Request,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    try:
+        cache = await conditional_snapshot(request, "cfdis")
+        if cache.hit is not None:
+            return cache.hit
+        cfdis = cache.snapshot.collection("cfdis_generados")
+        page, next_cursor = get_page(cfdis, cursor, limit, fields)
+        
+        return await cache.respond({
             "success": True,
             "action": "generate",
             "total_cfdis": len(cfdis),
-            "total_amount": f"${total_amount:,.2f}",
+            "total_amount": format_centavos(cfdis.total_centavos),
+            "totales_por_moneda": {
+                moneda: format_centavos(centavos)
+                for moneda, centavos in cfdis.totales_por_moneda().items()
+            },
             "message": f"Se generaron {len(cfdis)} facturas exitosamente",
-            "data": cfdis,
+            "data": page,
+            "limit": limit,
+            "next_cursor": next_cursor
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener CFDIs generados: {str(e)}")
+
+@router.post("/generate/batch", status_code=202)
+async def generate_batch(request: GenerationBatchRequest):
+    """
+    Genera, sella y timbra un lote de comprobantes como trabajo en segundo plano;
+    el avance se consulta en GET /api/cfdis/generate/batch/{job_id} o /api/jobs/{job_id}
+    """
+    if not request.comprobantes:
+        raise HTTPException(status_code=400, detail="El lote no tiene comprobantes")
+    if len(request.comprobantes) > MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"El lote excede el máximo de {MAX_BATCH} comprobantes")
+    try:
+        payloads = jsonable_encoder(request.comprobantes)
+        job = await asyncio.to_thread(get_job_queue().submit, "generate", {"comprobantes": payloads}, len(payloads))
+        return {
+            "success": True,
+            "action": "generate",
+            "job_id": job.id,
+            "estado": job.estado,
+            "message": f"Se recibieron {len(payloads)} comprobantes para timbrar",
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener CFDIs generados: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error al iniciar la generación de CFDIs: {str(e)}")
+
+@router.get("/generate/batch/{job_id}")
+async def get_generation_job(job_id: str):
+    job = await asyncio.to_thread(get_job_queue().get, job_id)
+    if job is None or job.tipo != "generate":
+        raise HTTPException(status_code=404, detail=f"Trabajo no encontrado: {job_id}")
+    return {
+        "success": True,
+        "action": "generate",
+        "job": job.to_dict(),
+        "message": f"Trabajo {job.estado}",
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/generate/folios")
+async def audit_folios(emisor_rfc: str, serie: str = ""):
+    """Bloques de folios reservados para la serie y huecos contra los CFDIs emitidos"""
+    try:
+        snapshot = await get_cfdi_store().asnapshot()
+        cfdis = snapshot.collection("cfdis_generados")
+        emitidos = [
+            record.get("folio")
+            for record in map(cfdis.get, cfdis.lookup("emisor_rfc", emisor_rfc))
+            if (record.get("serie") or "").upper() == serie.upper()
+        ]
+        generator = active_generator()
+        if generator is not None:
+            auditoria = await asyncio.to_thread(generator.folios.audit, emisor_rfc, serie, emitidos)
+        else:
+            auditoria = await asyncio.to_thread(audit_series, emisor_rfc, serie, emitidos)
+        
+        return {
+            "success": True,
+            "action": "generate",
+            "auditoria": auditoria,
+            "message": f"{len(auditoria['huecos'])} huecos de folios en la serie",
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al auditar folios: {str(e)}")
+
+@router.get("/{action}/search")
+async def search_cfdis(
+    request: Request,
+    action: str,
+    uuid: Optional[str] = None,
+    emisor_rfc: Optional[str] = None,
+    receptor_rfc: Optional[str] = None,
+    estado: Optional[str] = None,
+    tipo_comprobante: Optional[str] = None,
+    moneda: Optional[str] = None,
+    serie: Optional[str] = None,
+    folio: Optional[str] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    collection = resolve_collection(action)
+    if collection is None:
+        raise HTTPException(status_code=404, detail=f"Colección no encontrada: {action}")
+    if folio and not serie:
+        raise HTTPException(status_code=400, detail="El filtro folio requiere serie")
+    try:
+        cache = await conditional_snapshot(request, "cfdis")
+        if cache.hit is not None:
+            return cache.hit
+        cfdis = cache.snapshot.collection(collection)
+        
+        filters = {
+            "uuid": uuid,
+            "emisor_rfc": emisor_rfc,
+            "receptor_rfc": receptor_rfc,
+            "estado": estado,
+            "tipo_comprobante": tipo_comprobante,
+            "moneda": moneda
+        }
+        if serie and folio:
+            filters["serie_folio"] = serie_folio(serie, folio)
+        else:
+            filters["serie"] = serie
+        
+        keys = cfdis.query(filters, fecha_desde, fecha_hasta)
+        page, next_cursor = get_page(cfdis, cursor, limit, fields, keys)
+        
+        return await cache.respond({
+            "success": True,
+            "action": action,
+            "total_resultados": len(keys),
+            "message": f"Se encontraron {len(keys)} CFDIs",
+            "data": page,
+            "limit": limit,
+            "next_cursor": next_cursor
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al buscar CFDIs: {str(e)}")
+
+@router.get("/{collection}/export")
+async def export_cfdis(
+    collection: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    fields: Optional[str] = None
+):
+    name = resolve_collection(collection)
+    if name is None:
+        raise HTTPException(status_code=404, detail=f"Colección no encontrada: {collection}")
+    try:
+        snapshot = await get_cfdi_store().asnapshot()
+        cfdis = snapshot.collection(name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al exportar CFDIs: {str(e)}")
+    
+    return StreamingResponse(
+        export_chunks(cfdis, format, parse_fields(fields)),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'}
+    )
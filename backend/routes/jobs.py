@@ -0,0 +1,155 @@
+"""
+MVP CFDI - Rutas de trabajos en segundo plano
+Descarga, validación y generación masiva sin bloquear a los workers de uvicorn
+"""
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ValidationError
+from typing import Dict, Any, Optional
+from datetime import datetime
+import asyncio
+
+from routes.auth import get_current_user, get_stream_user
+from routes.cfdis import GenerationBatchRequest
+from services.job_events import KEEPALIVE_SECONDS, event_data, format_event, get_job_broadcaster
+from services.ingest import ImportPathError, resolve_import_path
+from services.jobs import ESTADOS, TERMINALES, get_job_queue
+
+router = APIRouter(prefix="/api/jobs", tags=["Trabajos"])
+
+class JobRequest(BaseModel):
+    tipo: str
+    payload: Dict[str, Any] = {}
+
+def job_total(tipo: str, payload: Dict[str, Any]) -> int:
+    if tipo == "generate":
+        return len(payload.get("comprobantes") or [])
+    if tipo == "validate":
+        return len(payload.get("ids") or [])
+    return 0
+
+@router.post("", status_code=202)
+async def create_job(request: JobRequest, user: Dict[str, Any] = Depends(get_current_user)):
+    queue = get_job_queue()
+    if request.tipo not in queue.tipos():
+        raise HTTPException(status_code=400, detail=f"Tipo de trabajo no soportado: {request.tipo}")
+    payload = request.payload
+    if request.tipo == "download":
+        # lee archivos del servidor: solo administradores y dentro de CFDI_IMPORT_DIR
+        if user.get("rol") != "admin":
+            raise HTTPException(status_code=403, detail="Solo un administrador puede importar desde el servidor")
+        if not payload.get("path"):
+            raise HTTPException(status_code=400, detail="El trabajo download requiere payload.path")
+        try:
+            payload = {**payload, "path": resolve_import_path(str(payload["path"]))}
+        except ImportPathError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if request.tipo == "generate":
+        if not payload.get("comprobantes"):
+            raise HTTPException(status_code=400, detail="El trabajo generate requiere payload.comprobantes")
+        try:
+            # mismos valores por omisión que POST /api/cfdis/generate/batch
+            payload = jsonable_encoder(GenerationBatchRequest(**payload))
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+    try:
+        job = await asyncio.to_thread(queue.submit, request.tipo, payload, job_total(request.tipo, payload))
+        return {
+            "success": True,
+            "job": job.to_dict(),
+            "message": f"Trabajo {request.tipo} en cola",
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al crear el trabajo: {str(e)}")
+
+@router.get("", dependencies=[Depends(get_current_user)])
+async def list_jobs(
+    tipo: Optional[str] = None,
+    estado: Optional[str] = Query(None, pattern=f"^({'|'.join(ESTADOS)})$"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    jobs = await asyncio.to_thread(get_job_queue().list, tipo, estado, limit)
+    return {
+        "success": True,
+        "total": len(jobs),
+        "data": [job.to_dict(max_errores=0) for job in jobs],
+        "limites": get_job_queue().limits,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/{job_id}", dependencies=[Depends(get_current_user)])
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo no encontrado: {job_id}")
+    return {
+        "success": True,
+        "job": job.to_dict(),
+        "message": f"Trabajo {job.estado}",
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/{job_id}/events", dependencies=[Depends(get_stream_user)])
+async def job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events: estado inicial, progress (contadores), batch (resultados
+    por lote) y done (totales finales); todos los clientes comparten una sola
+    difusión desde el hilo del trabajo en lugar de consultar la base
+    """
+    queue = get_job_queue()
+    job = await asyncio.to_thread(queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo no encontrado: {job_id}")
+    broadcaster = get_job_broadcaster()
+
+    async def stream():
+        yield format_event("estado", event_data(job, "estado"))
+        if job.estado in TERMINALES:
+            yield format_event("done", event_data(job, "done"))
+            return
+        subscriber = broadcaster.subscribe(job_id)
+        try:
+            # pudo terminar entre la lectura inicial y la suscripción
+            current = await asyncio.to_thread(queue.get, job_id)
+            if current is not None and current.estado in TERMINALES:
+                yield format_event("done", event_data(current, "done"))
+                return
+            while True:
+                try:
+                    message, final = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    # el trabajo puede correr en otro worker de uvicorn
+                    current = await asyncio.to_thread(queue.get, job_id)
+                    if current is not None and current.estado in TERMINALES:
+                        yield format_event("done", event_data(current, "done"))
+                        return
+                    yield b": ping\n\n"
+                    continue
+                yield message
+                if final:
+                    return
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/{job_id}/cancel", dependencies=[Depends(get_current_user)])
+async def cancel_job(job_id: str):
+    job = await asyncio.to_thread(get_job_queue().cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo no encontrado: {job_id}")
+    return {
+        "success": True,
+        "job": job.to_dict(),
+        "message": "Cancelación solicitada" if job.estado == "en_proceso" else f"Trabajo {job.estado}",
+        "timestamp": datetime.now().isoformat()
+    }
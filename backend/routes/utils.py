@@ -3,36 +3,36 @@ MVP CFDI - Rutas de Utilidad
 Endpoints para health check, catálogos y funciones auxiliares
 """
 
-from fastapi import APIRouter, HTTPException
-from typing import Dict, Any
-import json
-import os
-from datetime import datetime
+import asyncio
 
-router = APIRouter(prefix="/api", tags=["Utilidades"])
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from typing import Dict, Any, Optional
+from datetime import datetime
 
-DATA_FILE_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "dummy_cfdis.json")
+from routes.auth import get_current_user
+from services.catalogs import JSON_ALIASES, dict_page, get_catalog_engine
+from services.cfdi_store import get_cfdi_store
+from services.http_cache import conditional_snapshot, not_modified_response, versioned_response
+from services.pagination import DEFAULT_LIMIT, MAX_LIMIT, CursorError, decode_cursor, encode_cursor
+from services.quotas import get_tenant_quotas
+from services.response_cache import get_response_cache
 
-def load_cfdi_data() -> Dict[str, Any]:
-    try:
-        with open(DATA_FILE_PATH, 'r', encoding='utf-8') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        raise HTTPException(status_code=500, detail="Archivo de datos no encontrado")
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Error al leer el archivo de datos")
+router = APIRouter(prefix="/api", tags=["Utilidades"])
 
 @router.get("/health")
 async def health_check():
     try:
-        data = load_cfdi_data()
-        data_status = "OK" if data else "ERROR"
+        snapshot = await get_cfdi_store().asnapshot()
+        cache = get_response_cache()
+        data_status = "OK" if snapshot.data else "ERROR"
         
         return {
             "status": "healthy",
             "message": "MVP CFDI API funcionando correctamente",
             "version": "1.0.0",
             "data_file_status": data_status,
+            "cache_respuestas": cache.stats() if cache is not None else None,
+            "catalogos_sat": get_catalog_engine().stats(),
             "endpoints_available": [
                 "/api/health",
                 "/api/auth/login",
@@ -40,6 +40,8 @@ async def health_check():
                 "/api/cfdis/validate", 
                 "/api/cfdis/generate",
                 "/api/catalogos",
+                "/api/catalogos/{nombre}",
+                "/api/catalogos/{nombre}/{clave}",
                 "/docs"
             ],
             "timestamp": datetime.now().isoformat()
@@ -51,20 +53,150 @@ async def health_check():
         )
 
 @router.get("/catalogos")
-async def get_sat_catalogs():
+async def get_sat_catalogs(request: Request):
     try:
-        data = load_cfdi_data()
-        catalogos = data.get("catalogos_sat", {})
+        cache = await conditional_snapshot(request, "catalogos")
+        if cache.hit is not None:
+            return cache.hit
+        catalogos = cache.snapshot.data.get("catalogos_sat", {})
         
-        return {
+        return await cache.respond({
             "success": True,
             "catalogos": catalogos,
             "total_catalogos": len(catalogos),
-            "message": "Catálogos del SAT obtenidos correctamente",
-            "timestamp": datetime.now().isoformat()
-        }
+            "message": "Catálogos del SAT obtenidos correctamente"
+        })
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error al obtener catálogos: {str(e)}"
         )
+
+def json_catalog(snapshot, nombre: str) -> Optional[Dict[str, str]]:
+    """Catálogo del archivo de datos por su nombre o por el oficial (c_FormaPago -> formas_pago)"""
+    catalogos = snapshot.data.get("catalogos_sat", {})
+    if nombre in catalogos:
+        return catalogos[nombre]
+    for alias, oficial in JSON_ALIASES.items():
+        if oficial == nombre and alias in catalogos:
+            return catalogos[alias]
+    return None
+
+def catalog_etag(nombre: str, info: Dict[str, Any]) -> str:
+    # la revisión cambia con cada carga de manage.py load-catalogos
+    return f'"{nombre}-{info["revision"]}"'
+
+def catalog_not_found(nombre: str) -> HTTPException:
+    return HTTPException(status_code=404, detail=f"Catálogo no encontrado: {nombre}")
+
+def decode_catalog_cursor(nombre: str, cursor: Optional[str]) -> Optional[str]:
+    if not cursor:
+        return None
+    try:
+        cursor_catalog, clave = decode_cursor(cursor)
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if cursor_catalog != nombre:
+        raise HTTPException(status_code=400, detail="El cursor es de otro catálogo")
+    return clave
+
+@router.get("/catalogos/{nombre}")
+async def list_sat_catalog(
+    request: Request,
+    nombre: str,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    q: Optional[str] = None
+):
+    """Listado por clave con cursor; `q` filtra por prefijo de clave o texto de la descripción"""
+    try:
+        after = decode_catalog_cursor(nombre, cursor)
+        engine = get_catalog_engine()
+        info = engine.info(nombre)
+        if info is not None:
+            etag = catalog_etag(nombre, info)
+            not_modified = not_modified_response(request, "catalogos", etag)
+            if not_modified is not None:
+                return not_modified
+            # la búsqueda por texto recorre el catálogo: fuera del event loop
+            page, last = await asyncio.to_thread(engine.page, nombre, after, limit, q)
+            total = info["total"]
+        else:
+            cache = await conditional_snapshot(request, "catalogos")
+            if cache.hit is not None:
+                return cache.hit
+            catalogo = json_catalog(cache.snapshot, nombre)
+            if catalogo is None:
+                raise catalog_not_found(nombre)
+            page, last = dict_page(catalogo, after, limit, q)
+            total = len(catalogo)
+
+        content = {
+            "success": True,
+            "catalogo": nombre,
+            "total": total,
+            "message": f"Catálogo {nombre}: {len(page)} de {total} claves",
+            "data": page,
+            "limit": limit,
+            "next_cursor": encode_cursor((nombre, last)) if last is not None else None
+        }
+        if info is not None:
+            return versioned_response("catalogos", etag, content)
+        return await cache.respond(content)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener el catálogo {nombre}: {str(e)}")
+
+@router.get("/catalogos/{nombre}/{clave}")
+async def get_sat_catalog_entry(request: Request, nombre: str, clave: str):
+    try:
+        engine = get_catalog_engine()
+        info = engine.info(nombre)
+        if info is not None:
+            etag = catalog_etag(nombre, info)
+            not_modified = not_modified_response(request, "catalogos", etag)
+            if not_modified is not None:
+                return not_modified
+            # un fallo de la caché LRU consulta SQLite: fuera del event loop
+            entry = await asyncio.to_thread(engine.lookup, nombre, clave)
+            if entry is None:
+                raise HTTPException(status_code=404, detail=f"Clave {clave} no encontrada en {nombre}")
+            return versioned_response("catalogos", etag, {
+                "success": True,
+                "catalogo": nombre,
+                "data": entry,
+                "message": f"{nombre} {clave}: {entry['descripcion']}"
+            })
+
+        cache = await conditional_snapshot(request, "catalogos")
+        if cache.hit is not None:
+            return cache.hit
+        catalogo = json_catalog(cache.snapshot, nombre)
+        if catalogo is None:
+            raise catalog_not_found(nombre)
+        if clave not in catalogo:
+            raise HTTPException(status_code=404, detail=f"Clave {clave} no encontrada en {nombre}")
+        return await cache.respond({
+            "success": True,
+            "catalogo": nombre,
+            "data": {"clave": clave, "descripcion": catalogo[clave]},
+            "message": f"{nombre} {clave}: {catalogo[clave]}"
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al consultar el catálogo {nombre}: {str(e)}")
+
+@router.get("/cuotas")
+async def get_quota_usage(user: Dict[str, Any] = Depends(get_current_user)):
+    """Consumo de cuotas del usuario; el rol admin ve todos los tenants"""
+    quotas = get_tenant_quotas()
+    tenant = f"user:{user.get('tenant') or user['sub']}"
+    return {
+        "success": True,
+        "cuotas": {kind: {"tasa_por_segundo": rate, "rafaga": burst} for kind, (rate, burst) in quotas.quotas.items()},
+        "uso": quotas.usage(None if user.get("rol") == "admin" else tenant),
+        "message": "Consumo de cuotas por tenant",
+        "timestamp": datetime.now().isoformat()
+    }
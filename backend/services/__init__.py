@@ -0,0 +1,4 @@
+"""
+MVP CFDI - Servicios compartidos
+Lógica de datos reutilizada por los routers (almacén de CFDIs, índices, etc.)
+"""
@@ -0,0 +1,32 @@
+"""
+MVP CFDI - Importes en centavos
+Los totales se normalizan a enteros (centavos) al cargar; el texto "$1,250.00" solo se genera al responder
+"""
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any
+
+DEFAULT_MONEDA = "MXN"
+
+_CENTAVO = Decimal("0.01")
+
+
+def parse_centavos(value: Any) -> int:
+    """Convierte "$1,250.00", "1250.5" o 1250.5 a centavos; valores inválidos cuentan como 0"""
+    if value is None:
+        return 0
+    text = str(value).replace("$", "").replace(",", "").strip()
+    try:
+        amount = Decimal(text).quantize(_CENTAVO, rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        return 0
+    if not amount.is_finite():
+        return 0
+    return int(amount * 100)
+
+
+def format_centavos(centavos: int) -> str:
+    sign = "-" if centavos < 0 else ""
+    pesos, cents = divmod(abs(centavos), 100)
+    return f"{sign}${pesos:,}.{cents:02d}"
+
@@ -0,0 +1,193 @@
+"""
+MVP CFDI - Tokens de sesión
+JWT HS256 (python-jose) con usuario, rol y expiración. La verificación no
+consulta usuarios: valida la firma y, para no repetirla en cada petición, guarda
+los tokens ya verificados en un LRU pequeño. El logout agrega el `jti` a una
+lista de revocados en memoria que se depura sola cuando los tokens expiran.
+"""
+
+import heapq
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from jose import ExpiredSignatureError, JWTError, jwt
+
+from services.storage import DATA_DIR
+
+ALGORITHM = "HS256"
+SECRET_PATH = os.getenv("CFDI_AUTH_SECRET_FILE", os.path.join(DATA_DIR, ".auth_secret"))
+TOKEN_TTL = float(os.getenv("CFDI_AUTH_TOKEN_HOURS", 8)) * 3600
+CACHE_SIZE = int(os.getenv("CFDI_AUTH_TOKEN_CACHE", 1024))
+
+
+class TokenError(Exception):
+    """Token ausente, inválido, expirado o revocado"""
+
+
+class TokenExpiredError(TokenError):
+    pass
+
+
+def load_secret(path: str = SECRET_PATH) -> str:
+    """
+    CFDI_AUTH_SECRET o, si no existe, un secreto aleatorio guardado en `path`
+    (lo crea el primer worker con O_EXCL; los demás lo leen)
+    """
+    secret = os.getenv("CFDI_AUTH_SECRET")
+    if secret:
+        return secret
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            with open(path, encoding="utf-8") as file:
+                secret = file.read().strip()
+            if secret:
+                return secret
+            # otro worker lo está escribiendo
+            time.sleep(0.01)
+        raise TokenError(f"Secreto de tokens vacío: {path}")
+    secret = secrets.token_urlsafe(48)
+    with os.fdopen(fd, "w", encoding="utf-8") as file:
+        file.write(secret)
+    return secret
+
+
+class Denylist:
+    """jti revocado -> expiración; una entrada solo vive lo que le queda al token"""
+
+    def __init__(self):
+        self._entries: Dict[str, float] = {}
+        self._expirations: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _purge(self, now: float) -> None:
+        while self._expirations and self._expirations[0][0] <= now:
+            _, jti = heapq.heappop(self._expirations)
+            self._entries.pop(jti, None)
+
+    def add(self, jti: str, expires: float) -> None:
+        now = time.time()
+        if expires <= now:
+            return
+        with self._lock:
+            self._purge(now)
+            self._entries[jti] = expires
+            heapq.heappush(self._expirations, (expires, jti))
+
+    def __contains__(self, jti: str) -> bool:
+        # lectura sin candado: la depuración ocurre al agregar
+        return jti in self._entries
+
+
+class TokenManager:
+
+    def __init__(self, secret: str, ttl: float = TOKEN_TTL, cache_size: int = CACHE_SIZE):
+        self._secret = secret
+        self.ttl = ttl
+        self.cache_size = cache_size
+        # token -> claims ya verificados
+        self._verified: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.denylist = Denylist()
+        self.hits = 0
+        self.misses = 0
+
+    def issue(self, user: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        now = int(time.time())
+        claims = {
+            "sub": user["username"],
+            "rol": user["rol"],
+            "nombre": user.get("nombre"),
+            "iat": now,
+            "exp": now + int(self.ttl),
+            "jti": secrets.token_hex(8)
+        }
+        return jwt.encode(claims, self._secret, algorithm=ALGORITHM), claims
+
+    def _decode(self, token: str) -> Dict[str, Any]:
+        try:
+            return jwt.decode(token, self._secret, algorithms=[ALGORITHM])
+        except ExpiredSignatureError:
+            raise TokenExpiredError("Token expirado")
+        except JWTError:
+            raise TokenError("Token inválido")
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        with self._lock:
+            claims = self._verified.get(token)
+            if claims is not None:
+                self._verified.move_to_end(token)
+        if claims is not None:
+            self.hits += 1
+            if claims["exp"] <= time.time():
+                self._forget(token)
+                raise TokenExpiredError("Token expirado")
+        else:
+            self.misses += 1
+            claims = self._decode(token)
+            with self._lock:
+                self._verified[token] = claims
+                if len(self._verified) > self.cache_size:
+                    self._verified.popitem(last=False)
+        if claims["jti"] in self.denylist:
+            raise TokenError("Token revocado")
+        return claims
+
+    def peek(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Claims de un token vigente sin tomar el candado ni tocar la caché ni los
+        contadores (lo usa el middleware de cuotas en cada petición); None si no es válido
+        """
+        # lectura sin candado, igual que la denylist
+        claims = self._verified.get(token)
+        if claims is None:
+            try:
+                claims = self._decode(token)
+            except TokenError:
+                return None
+        if claims["exp"] <= time.time() or claims["jti"] in self.denylist:
+            return None
+        return claims
+
+    def _forget(self, token: str) -> None:
+        with self._lock:
+            self._verified.pop(token, None)
+
+    def revoke(self, token: str) -> Optional[Dict[str, Any]]:
+        """Revoca un token vigente; uno expirado ya no sirve y no se registra"""
+        try:
+            claims = self._decode(token)
+        except TokenExpiredError:
+            return None
+        self.denylist.add(claims["jti"], claims["exp"])
+        self._forget(token)
+        return claims
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "verificados_en_cache": len(self._verified),
+            "aciertos": self.hits,
+            "fallos": self.misses,
+            "revocados": len(self.denylist)
+        }
+
+
+_token_manager: Optional[TokenManager] = None
+_token_manager_lock = threading.Lock()
+
+
+def get_token_manager() -> TokenManager:
+    global _token_manager
+    if _token_manager is None:
+        with _token_manager_lock:
+            if _token_manager is None:
+                _token_manager = TokenManager(load_secret())
+    return _token_manager
@@ -0,0 +1,443 @@
+"""
+MVP CFDI - Catálogos del SAT
+Los catálogos completos (c_ClaveProdServ, c_CodigoPostal, c_ClaveUnidad, ...) se
+cargan desde el XLS oficial o desde CSV a una base SQLite aparte, fuera del
+archivo de datos. Cada entrada es una fila de una tabla WITHOUT ROWID con llave
+(catálogo, clave): buscar una clave es una búsqueda en el índice primario y el
+listado pagina por cursor sobre el mismo índice. Las claves consultadas se
+guardan en un LRU que se vacía cuando otro proceso (manage.py) recarga la base.
+"""
+
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from itertools import chain
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from services.storage import DATA_DIR
+
+try:
+    import xlrd
+except ImportError:  # xlrd es opcional: sin él solo se cargan CSV
+    xlrd = None
+
+CATALOGOS_DB_PATH = os.getenv("CFDI_CATALOGOS_DB", os.path.join(DATA_DIR, "catalogos.db"))
+LOOKUP_CACHE_SIZE = int(os.getenv("CFDI_CATALOGOS_CACHE", 4096))
+LOAD_BATCH_SIZE = 5000
+# filas que se revisan buscando el encabezado (el XLS oficial trae títulos antes)
+HEADER_SCAN_ROWS = 10
+
+# Catálogos del archivo de datos -> catálogo oficial equivalente
+JSON_ALIASES = {
+    "formas_pago": "c_FormaPago",
+    "monedas": "c_Moneda",
+    "tipos_comprobante": "c_TipoDeComprobante"
+}
+
+# El XLS oficial parte los catálogos grandes en varias hojas
+PART_SUFFIX = re.compile(r"_Parte_\d+$", re.IGNORECASE)
+
+Entry = Dict[str, Any]
+
+
+class CatalogError(Exception):
+    """Archivo de catálogo ilegible o sin encabezado"""
+
+
+def normalize_text(value: str) -> str:
+    """Minúsculas y sin acentos, para búsquedas"""
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def column_name(header: str) -> str:
+    """'Fecha inicio de vigencia' -> 'fecha_inicio_de_vigencia'"""
+    return re.sub(r"[^a-z0-9]+", "_", normalize_text(header)).strip("_")
+
+
+def _cell(value: Any) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip() if value is not None else ""
+
+
+# ==================== LECTURA DE ARCHIVOS ====================
+
+def parse_sheet(default_name: str, rows: Iterable[Sequence[Any]]) -> Tuple[str, List[str], Iterator[List[str]]]:
+    """
+    Regresa (catálogo, columnas, filas). El encabezado es la primera fila cuya
+    primera celda es el nombre oficial (c_...); si no hay, la primera fila y el
+    catálogo se llama como el archivo o la hoja
+    """
+    rows = iter(rows)
+    scanned = []
+    for row in rows:
+        cells = [_cell(value) for value in row]
+        scanned.append(cells)
+        if cells and cells[0].startswith("c_"):
+            name, header = cells[0], cells
+            break
+        if len(scanned) >= HEADER_SCAN_ROWS:
+            rows = chain(scanned[1:], rows)
+            name, header = default_name, scanned[0]
+            break
+    else:
+        if not scanned:
+            raise CatalogError(f"Catálogo vacío: {default_name}")
+        rows = iter(scanned[1:])
+        name, header = default_name, scanned[0]
+
+    columns = [column_name(cell) or f"columna_{index}" for index, cell in enumerate(header)]
+    data = ([_cell(value) for value in row] for row in rows)
+    # las filas sin clave son subencabezados o notas al pie
+    return PART_SUFFIX.sub("", name), columns, (row for row in data if row and row[0])
+
+
+def _read_text(path: str) -> str:
+    with open(path, "rb") as file:
+        raw = file.read()
+    try:
+        return raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        # los CSV exportados de Excel en español suelen venir en cp1252
+        return raw.decode("cp1252")
+
+
+def read_csv(path: str) -> List[Tuple[str, List[str], Iterator[List[str]]]]:
+    text = _read_text(path)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;|\t")
+    except csv.Error:
+        dialect = csv.excel
+    name = os.path.splitext(os.path.basename(path))[0]
+    return [parse_sheet(name, csv.reader(io.StringIO(text), dialect))]
+
+
+def read_xls(path: str) -> List[Tuple[str, List[str], Iterator[List[str]]]]:
+    if xlrd is None:
+        raise CatalogError("Para leer XLS instala xlrd (pip install xlrd) o exporta el catálogo a CSV")
+    book = xlrd.open_workbook(path, on_demand=True)
+
+    def sheet_rows(sheet):
+        for index in range(sheet.nrows):
+            row = []
+            for cell in sheet.row(index):
+                if cell.ctype == xlrd.XL_CELL_DATE:
+                    row.append(xlrd.xldate_as_datetime(cell.value, book.datemode).date().isoformat())
+                else:
+                    row.append(cell.value)
+            yield row
+
+    sheets = []
+    for sheet in book.sheets():
+        try:
+            sheets.append(parse_sheet(sheet.name, sheet_rows(sheet)))
+        except CatalogError:
+            continue
+    return sheets
+
+
+def read_catalog_file(path: str) -> List[Tuple[str, List[str], Iterator[List[str]]]]:
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".xls":
+        return read_xls(path)
+    if extension == ".xlsx":
+        raise CatalogError("xlrd solo lee .xls: guarda el libro como .xls o exporta el catálogo a CSV")
+    if extension in (".csv", ".txt"):
+        return read_csv(path)
+    raise CatalogError(f"Formato de catálogo no soportado: {extension}")
+
+
+# ==================== MOTOR ====================
+
+class CatalogEngine:
+
+    def __init__(self, path: str = CATALOGOS_DB_PATH, cache_size: int = LOOKUP_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._create_schema()
+        # (catálogo, clave) -> entrada o None si no existe
+        self._lookups: "OrderedDict[Tuple[str, str], Optional[Entry]]" = OrderedDict()
+        self._catalogs: Dict[str, Dict[str, Any]] = {}
+        self._data_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def _create_schema(self) -> None:
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS catalogos (
+                id INTEGER PRIMARY KEY,
+                nombre TEXT NOT NULL UNIQUE,
+                columnas TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                revision INTEGER NOT NULL,
+                origen TEXT,
+                cargado TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entradas (
+                catalogo INTEGER NOT NULL,
+                clave TEXT NOT NULL,
+                descripcion TEXT,
+                busqueda TEXT NOT NULL,
+                datos TEXT,
+                PRIMARY KEY (catalogo, clave)
+            ) WITHOUT ROWID;
+        """)
+
+    def _refresh(self) -> None:
+        """Con el candado tomado; recarga el índice de catálogos si otra conexión hizo commit"""
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._catalogs = {
+            nombre: {"id": catalog_id, "columnas": json.loads(columnas), "total": total,
+                     "revision": revision, "origen": origen, "cargado": cargado}
+            for catalog_id, nombre, columnas, total, revision, origen, cargado in self._conn.execute(
+                "SELECT id, nombre, columnas, total, revision, origen, cargado FROM catalogos"
+            )
+        }
+        self._lookups.clear()
+        self._data_version = data_version
+
+    # -------------------- carga --------------------
+
+    def _entries(self, catalog_id: int, columns: List[str], rows: Iterable[List[str]]):
+        description = columns.index("descripcion") if "descripcion" in columns else 1
+        for row in rows:
+            clave = row[0]
+            descripcion = row[description] if description < len(row) else ""
+            extra = {
+                column: value for index, (column, value) in enumerate(zip(columns, row))
+                if index not in (0, description) and value
+            }
+            yield (
+                catalog_id,
+                clave,
+                descripcion or None,
+                normalize_text(f"{clave} {descripcion}"),
+                json.dumps(extra, ensure_ascii=False, separators=(",", ":")) if extra else None
+            )
+
+    def load(self, name: str, columns: List[str], rows: Iterable[List[str]], origen: Optional[str] = None) -> int:
+        """Reemplaza el catálogo completo en una sola transacción; regresa las entradas cargadas"""
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                revision = conn.execute("SELECT COALESCE(MAX(revision), 0) + 1 FROM catalogos").fetchone()[0]
+                conn.execute(
+                    "INSERT INTO catalogos (nombre, columnas, total, revision, origen, cargado) VALUES (?, ?, 0, ?, ?, ?) "
+                    "ON CONFLICT (nombre) DO UPDATE SET columnas = excluded.columnas, revision = excluded.revision, "
+                    "origen = excluded.origen, cargado = excluded.cargado",
+                    (name, json.dumps(columns, ensure_ascii=False), revision, origen, datetime.now().isoformat())
+                )
+                catalog_id = conn.execute("SELECT id FROM catalogos WHERE nombre = ?", (name,)).fetchone()[0]
+                conn.execute("DELETE FROM entradas WHERE catalogo = ?", (catalog_id,))
+                entries = self._entries(catalog_id, columns, rows)
+                while True:
+                    batch = [entry for _, entry in zip(range(LOAD_BATCH_SIZE), entries)]
+                    if not batch:
+                        break
+                    # claves repetidas (p. ej. c_TasaOCuota): gana la última fila
+                    conn.executemany("INSERT OR REPLACE INTO entradas VALUES (?, ?, ?, ?, ?)", batch)
+                total = conn.execute("SELECT COUNT(*) FROM entradas WHERE catalogo = ?", (catalog_id,)).fetchone()[0]
+                conn.execute("UPDATE catalogos SET total = ? WHERE id = ?", (total, catalog_id))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._data_version = None
+        return total
+
+    def load_file(self, path: str, only: Optional[Sequence[str]] = None) -> Dict[str, int]:
+        """Carga los catálogos de un XLS/CSV; las hojas _Parte_N se juntan en uno solo"""
+        grouped: "OrderedDict[str, Tuple[List[str], List[Iterator[List[str]]]]]" = OrderedDict()
+        for name, columns, rows in read_catalog_file(path):
+            if only and name not in only:
+                continue
+            grouped.setdefault(name, (columns, []))[1].append(rows)
+        origen = os.path.basename(path)
+        return {
+            name: self.load(name, columns, chain.from_iterable(parts), origen)
+            for name, (columns, parts) in grouped.items()
+        }
+
+    def drop(self, name: str) -> bool:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT id FROM catalogos WHERE nombre = ?", (name,)).fetchone()
+                if row:
+                    conn.execute("DELETE FROM entradas WHERE catalogo = ?", (row[0],))
+                    conn.execute("DELETE FROM catalogos WHERE id = ?", (row[0],))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._data_version = None
+        return row is not None
+
+    # -------------------- consulta --------------------
+
+    def catalogs(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return {
+                name: {key: value for key, value in info.items() if key != "id"}
+                for name, info in self._catalogs.items()
+            }
+
+    def info(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return self._catalogs.get(name)
+
+    @staticmethod
+    def _entry(row: Tuple[Any, ...]) -> Entry:
+        clave, descripcion, datos = row
+        entry = {"clave": clave, "descripcion": descripcion}
+        if datos:
+            entry.update(json.loads(datos))
+        return entry
+
+    def lookup(self, name: str, clave: str) -> Optional[Entry]:
+        key = (name, clave)
+        with self._lock:
+            self._refresh()
+            if key in self._lookups:
+                self._lookups.move_to_end(key)
+                self.hits += 1
+                return self._lookups[key]
+            self.misses += 1
+            info = self._catalogs.get(name)
+            if info is None:
+                return None
+            row = self._conn.execute(
+                "SELECT clave, descripcion, datos FROM entradas WHERE catalogo = ? AND clave = ?",
+                (info["id"], clave)
+            ).fetchone()
+            entry = self._entry(row) if row else None
+            self._lookups[key] = entry
+            if len(self._lookups) > self.cache_size:
+                self._lookups.popitem(last=False)
+            return entry
+
+    def contains(self, name: str, clave: str) -> bool:
+        return self.lookup(name, clave) is not None
+
+    def page(self, name: str, after: Optional[str], limit: int, q: Optional[str] = None) -> Tuple[List[Entry], Optional[str]]:
+        """
+        Entradas en orden de clave a partir de `after`; `q` filtra por prefijo de
+        clave o por texto en la descripción (sin acentos ni mayúsculas).
+        Regresa (entradas, última clave si hay más)
+        """
+        with self._lock:
+            self._refresh()
+            info = self._catalogs.get(name)
+            if info is None:
+                return [], None
+            sql = "SELECT clave, descripcion, datos FROM entradas WHERE catalogo = ? AND clave > ?"
+            params: List[Any] = [info["id"], after or ""]
+            if q:
+                pattern = re.sub(r"([\\%_])", r"\\\1", normalize_text(q))
+                # `busqueda` es "<clave> <descripción>": prefijo de clave o texto de la descripción
+                sql += " AND (busqueda LIKE ? ESCAPE '\\' OR busqueda LIKE ? ESCAPE '\\')"
+                params += [f"{pattern}%", f"% %{pattern}%"]
+            sql += " ORDER BY clave LIMIT ?"
+            params.append(limit + 1)
+            rows = self._conn.execute(sql, params).fetchall()
+        entries = [self._entry(row) for row in rows[:limit]]
+        return entries, entries[-1]["clave"] if len(rows) > limit else None
+
+    def stats(self) -> Dict[str, Any]:
+        catalogs = self.catalogs()
+        return {
+            "catalogos": {name: info["total"] for name, info in catalogs.items()},
+            "cache_claves": len(self._lookups),
+            "aciertos": self.hits,
+            "fallos": self.misses
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def dict_page(catalog: Dict[str, str], after: Optional[str], limit: int, q: Optional[str] = None) -> Tuple[List[Entry], Optional[str]]:
+    """Mismo listado que CatalogEngine.page() para los catálogos del archivo de datos"""
+    needle = normalize_text(q) if q else None
+    entries = []
+    for clave in sorted(catalog):
+        if after is not None and clave <= after:
+            continue
+        descripcion = catalog[clave]
+        if needle and not (normalize_text(clave).startswith(needle) or needle in normalize_text(descripcion or "")):
+            continue
+        if len(entries) == limit:
+            return entries, entries[-1]["clave"]
+        entries.append({"clave": clave, "descripcion": descripcion})
+    return entries, None
+
+
+class CatalogView:
+    """
+    Un catálogo del motor con la interfaz `clave in catalogo` que usa la
+    validación de comprobantes, en lugar del dict del archivo de datos
+    """
+
+    def __init__(self, engine: CatalogEngine, name: str):
+        self.engine = engine
+        self.name = name
+
+    def __contains__(self, clave: object) -> bool:
+        return isinstance(clave, str) and self.engine.contains(self.name, clave)
+
+
+def validation_catalogs(json_catalogs: Dict[str, Dict[str, str]]) -> Dict[str, Any]:
+    """
+    Catálogos para validar comprobantes: los del motor cuando están cargados (con
+    el nombre del archivo de datos y con el oficial) y, si no, los del archivo de datos
+    """
+    engine = get_catalog_engine()
+    loaded = engine.catalogs()
+    catalogs: Dict[str, Any] = dict(json_catalogs)
+    for alias, name in JSON_ALIASES.items():
+        if name in loaded:
+            catalogs[alias] = CatalogView(engine, name)
+    for name in loaded:
+        catalogs[name] = CatalogView(engine, name)
+    return catalogs
+
+
+_catalog_engine: Optional[CatalogEngine] = None
+_catalog_engine_lock = threading.Lock()
+
+
+def get_catalog_engine() -> CatalogEngine:
+    global _catalog_engine
+    if _catalog_engine is None:
+        with _catalog_engine_lock:
+            if _catalog_engine is None:
+                _catalog_engine = CatalogEngine()
+    return _catalog_engine
+
+
+def close_catalog_engine() -> None:
+    global _catalog_engine
+    with _catalog_engine_lock:
+        if _catalog_engine is not None:
+            _catalog_engine.close()
+            _catalog_engine = None
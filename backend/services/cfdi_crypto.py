@@ -0,0 +1,292 @@
+"""
+MVP CFDI - Validación criptográfica local de sello y certificado
+Construye la cadena original, verifica el sello RSA-SHA256 con el certificado
+incrustado y revisa su vigencia a la fecha de emisión.
+
+La cadena original se genera con la XSLT del SAT (CFDI_XSLT_PATH) cuando lxml está
+instalado; si no, con la implementación interna para los nodos base de CFDI 3.3/4.0
+(sin complementos distintos del TimbreFiscalDigital).
+"""
+
+import base64
+import os
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+
+from services.cfdi_xml import local_name
+from services.ingest import MIN_PARALLEL_FILES, Task, ZipCache, open_task, process_pool, task_label
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # lxml es opcional: sin él se usa la cadena original interna
+    lxml_etree = None
+
+# Orden de atributos en la cadena original (anexo 20); se omiten los que no vienen
+ATTRIBUTE_ORDER: Dict[str, Tuple[str, ...]] = {
+    "Comprobante": (
+        "Version", "Serie", "Folio", "Fecha", "FormaPago", "NoCertificado", "CondicionesDePago",
+        "SubTotal", "Descuento", "Moneda", "TipoCambio", "Total", "TipoDeComprobante",
+        "Exportacion", "MetodoPago", "LugarExpedicion", "Confirmacion"
+    ),
+    "InformacionGlobal": ("Periodicidad", "Meses", "Año"),
+    "CfdiRelacionados": ("TipoRelacion",),
+    "CfdiRelacionado": ("UUID",),
+    "Emisor": ("Rfc", "Nombre", "RegimenFiscal", "FacAtrAdquirente"),
+    "Receptor": (
+        "Rfc", "Nombre", "DomicilioFiscalReceptor", "ResidenciaFiscal", "NumRegIdTrib",
+        "RegimenFiscalReceptor", "UsoCFDI"
+    ),
+    "Concepto": (
+        "ClaveProdServ", "NoIdentificacion", "Cantidad", "ClaveUnidad", "Unidad", "Descripcion",
+        "ValorUnitario", "Importe", "Descuento", "ObjetoImp"
+    ),
+    "Traslado": ("Base", "Impuesto", "TipoFactor", "TasaOCuota", "Importe"),
+    "Retencion": ("Base", "Impuesto", "TipoFactor", "TasaOCuota", "Importe"),
+    "ACuentaTerceros": (
+        "RfcACuentaTerceros", "NombreACuentaTerceros", "RegimenFiscalACuentaTerceros",
+        "DomicilioFiscalACuentaTerceros"
+    ),
+    "InformacionAduanera": ("NumeroPedimento",),
+    "CuentaPredial": ("Numero",),
+    "Parte": ("ClaveProdServ", "NoIdentificacion", "Cantidad", "Unidad", "Descripcion", "ValorUnitario", "Importe")
+}
+
+# la fecha del comprobante es hora local sin zona; se toma la del centro del país
+FECHA_TZ = timezone(timedelta(hours=-6))
+CERT_CACHE_SIZE = 1024
+
+
+class CadenaOriginalError(ValueError):
+    """No se puede construir la cadena original sin la XSLT del SAT"""
+
+
+def normalize_space(value: str) -> str:
+    return " ".join(value.split())
+
+
+# ==================== CADENA ORIGINAL ====================
+
+def _append_attributes(element: ET.Element, values: List[str]) -> None:
+    for attribute in ATTRIBUTE_ORDER.get(local_name(element.tag), ()):
+        value = element.get(attribute)
+        if value is not None:
+            values.append(normalize_space(value))
+
+
+def _append_node(element: ET.Element, values: List[str], top_level: bool = False) -> None:
+    name = local_name(element.tag)
+    if name == "Addenda":
+        return
+    if name == "Complemento":
+        for child in element:
+            if local_name(child.tag) != "TimbreFiscalDigital":
+                raise CadenaOriginalError(f"Complemento {local_name(child.tag)} requiere la XSLT del SAT")
+        return
+    if name == "Impuestos" and top_level:
+        # los totales van después de su grupo de retenciones / traslados
+        for group, total in (("Retenciones", "TotalImpuestosRetenidos"), ("Traslados", "TotalImpuestosTrasladados")):
+            for child in element:
+                if local_name(child.tag) == group:
+                    _append_node(child, values)
+            if element.get(total) is not None:
+                values.append(normalize_space(element.get(total)))
+        return
+    _append_attributes(element, values)
+    for child in element:
+        _append_node(child, values)
+
+
+def cadena_original(root: ET.Element) -> str:
+    """Cadena original interna: ||valor|valor|...|| en el orden del anexo 20"""
+    if local_name(root.tag) != "Comprobante":
+        raise CadenaOriginalError("El nodo raíz no es Comprobante")
+    values: List[str] = []
+    _append_attributes(root, values)
+    for child in root:
+        _append_node(child, values, top_level=True)
+    return "||" + "|".join(values) + "||"
+
+
+_xslt = None
+
+
+def _sat_transform():
+    global _xslt
+    path = os.getenv("CFDI_XSLT_PATH")
+    if lxml_etree is None or not path:
+        return None
+    if _xslt is None:
+        _xslt = lxml_etree.XSLT(lxml_etree.parse(path))
+    return _xslt
+
+
+def build_cadena(xml_bytes: bytes, root: ET.Element) -> str:
+    transform = _sat_transform()
+    if transform is not None:
+        return str(transform(lxml_etree.fromstring(xml_bytes)))
+    return cadena_original(root)
+
+
+# ==================== CERTIFICADOS ====================
+
+_cert_cache: "OrderedDict[str, Tuple[str, x509.Certificate]]" = OrderedDict()
+_cert_lock = threading.Lock()
+cert_cache_stats = {"hits": 0, "misses": 0}
+
+
+def serial_to_no_certificado(serial: int) -> str:
+    """Los certificados del SAT codifican el NoCertificado como dígitos ASCII en el número de serie"""
+    digits = format(serial, "x")
+    try:
+        decoded = bytes.fromhex(digits if len(digits) % 2 == 0 else "0" + digits).decode("ascii")
+    except (ValueError, UnicodeDecodeError):
+        return str(serial)
+    return decoded if decoded.isdigit() else str(serial)
+
+
+def load_certificate(no_certificado: str, certificado_b64: str) -> x509.Certificate:
+    """Certificado parseado, en caché por NoCertificado (el mismo emisor firma miles de CFDIs)"""
+    with _cert_lock:
+        cached = _cert_cache.get(no_certificado)
+        if cached is not None and cached[0] == certificado_b64:
+            _cert_cache.move_to_end(no_certificado)
+            cert_cache_stats["hits"] += 1
+            return cached[1]
+    cert = x509.load_der_x509_certificate(base64.b64decode(certificado_b64))
+    with _cert_lock:
+        cert_cache_stats["misses"] += 1
+        _cert_cache[no_certificado] = (certificado_b64, cert)
+        if len(_cert_cache) > CERT_CACHE_SIZE:
+            _cert_cache.popitem(last=False)
+    return cert
+
+
+def _validity(cert: x509.Certificate) -> Tuple[datetime, datetime]:
+    if hasattr(cert, "not_valid_before_utc"):
+        return cert.not_valid_before_utc, cert.not_valid_after_utc
+    return (
+        cert.not_valid_before.replace(tzinfo=timezone.utc),
+        cert.not_valid_after.replace(tzinfo=timezone.utc)
+    )
+
+
+def check_certificate(cert: x509.Certificate, no_certificado: str, fecha: str) -> Optional[str]:
+    """Regresa el motivo por el que el certificado no es válido, o None"""
+    if no_certificado and serial_to_no_certificado(cert.serial_number) != no_certificado:
+        return "El NoCertificado no corresponde al certificado"
+    try:
+        emitted = datetime.fromisoformat(fecha)
+    except ValueError:
+        return f"Fecha de emisión inválida: {fecha}"
+    if emitted.tzinfo is None:
+        emitted = emitted.replace(tzinfo=FECHA_TZ)
+    not_before, not_after = _validity(cert)
+    if not not_before <= emitted <= not_after:
+        return "El certificado no estaba vigente a la fecha de emisión"
+    return None
+
+
+def verify_sello(cert: x509.Certificate, sello_b64: str, cadena: str) -> bool:
+    try:
+        cert.public_key().verify(
+            base64.b64decode(sello_b64), cadena.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256()
+        )
+    except (InvalidSignature, ValueError):
+        return False
+    return True
+
+
+# ==================== VALIDACIÓN ====================
+
+def validate_xml(xml_bytes: bytes) -> Dict[str, Any]:
+    """
+    Regresa uuid, no_certificado, sello_valido, certificado_valido y errores;
+    sello_valido es None si no se pudo construir la cadena original.
+    """
+    result: Dict[str, Any] = {
+        "uuid": "", "no_certificado": "", "sello_valido": False, "certificado_valido": False, "errores": []
+    }
+    try:
+        root = ET.fromstring(xml_bytes)
+    except ET.ParseError as e:
+        result["errores"].append(f"XML mal formado: {e}")
+        return result
+
+    for element in root.iter():
+        if local_name(element.tag) == "TimbreFiscalDigital":
+            result["uuid"] = (element.get("UUID") or "").upper()
+            break
+    no_certificado = root.get("NoCertificado", "")
+    result["no_certificado"] = no_certificado
+
+    try:
+        cert = load_certificate(no_certificado, root.get("Certificado", ""))
+    except ValueError as e:
+        result["errores"].append(f"Certificado ilegible: {e}")
+        return result
+
+    error = check_certificate(cert, no_certificado, root.get("Fecha", ""))
+    result["certificado_valido"] = error is None
+    if error:
+        result["errores"].append(error)
+
+    try:
+        cadena = build_cadena(xml_bytes, root)
+    except CadenaOriginalError as e:
+        result["sello_valido"] = None
+        result["errores"].append(str(e))
+        return result
+    result["sello_valido"] = verify_sello(cert, root.get("Sello", ""), cadena)
+    if not result["sello_valido"]:
+        result["errores"].append("El sello no corresponde a la cadena original")
+    return result
+
+
+def validate_task(task: Task, zips: Optional[ZipCache] = None) -> Dict[str, Any]:
+    """Se ejecuta en los procesos del pool; cada proceso mantiene su caché de certificados"""
+    try:
+        with open_task(task, zips) as source:
+            xml_bytes = source.read()
+    except (OSError, KeyError) as e:
+        return {"archivo": task_label(task), "sello_valido": False, "certificado_valido": False, "errores": [str(e)]}
+    return {"archivo": task_label(task), **validate_xml(xml_bytes)}
+
+
+def validate_batch(tasks: Iterable[Task], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Valida los XML de `tasks`, repartidos en un pool de procesos si son suficientes"""
+    tasks = list(tasks)
+    workers = workers or int(os.getenv("CFDI_CRYPTO_WORKERS", "0")) or os.cpu_count() or 1
+    if workers > 1 and len(tasks) >= MIN_PARALLEL_FILES:
+        # bloques grandes: los CFDIs de un mismo emisor tienden a caer en el mismo proceso
+        chunksize = max(1, min(256, len(tasks) // (workers * 4)))
+        with process_pool(workers) as executor:
+            return list(executor.map(validate_task, tasks, chunksize=chunksize))
+    zips = ZipCache()
+    try:
+        return [validate_task(task, zips) for task in tasks]
+    finally:
+        zips.close()
+
+
+def merge_result(record: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Registro de cfdis_validacion con el resultado criptográfico; un CFDI sin
+    estatus previo del SAT queda Pendiente, o en Error si falló la validación local
+    """
+    merged = {**record, "sello_valido": result["sello_valido"], "certificado_valido": result["certificado_valido"]}
+    merged.setdefault("uuid", result["uuid"])
+    if result["sello_valido"] is False or not result["certificado_valido"]:
+        merged["estado"] = "Error"
+        merged["errores_validacion"] = result["errores"]
+    elif not record.get("estatus_sat"):
+        merged["estado"] = "Pendiente"
+        merged["estatus_sat"] = "Sin consultar"
+    return merged
@@ -0,0 +1,425 @@
+"""
+MVP CFDI - Generación de CFDI 4.0
+Valida cada comprobante contra los catálogos, le asigna folio, lo arma con
+plantillas precompiladas, lo sella con el CSD y lo manda a timbrar al PAC por lotes
+"""
+
+import base64
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+from string import Template
+from typing import Any, Callable, Container, Dict, List, Mapping, Optional, Tuple
+from xml.sax.saxutils import quoteattr
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+
+from services.amounts import DEFAULT_MONEDA, format_centavos, parse_centavos
+from services.cfdi_crypto import cadena_original, serial_to_no_certificado
+from services.folios import FolioAllocator
+from services.pac import PACClient, PACError, create_pac
+from services.storage import DATA_DIR
+
+XML_DIR = os.getenv("CFDI_XML_DIR", os.path.join(DATA_DIR, "xml", "generados"))
+PAC_BATCH_SIZE = 50
+MAX_BATCH = 10000
+
+RFC_PATTERN = re.compile(r"^[A-ZÑ&]{3,4}\d{6}[A-Z\d]{3}$")
+CP_PATTERN = re.compile(r"^\d{5}$")
+METODOS_PAGO = {"PUE", "PPD"}
+OBJETOS_IMP = {"01", "02", "03", "04"}
+# TasaOCuota de IVA trasladado (c_TasaOCuota); solo se usa con ObjetoImp 02
+TASAS_IVA = {"0.000000", "0.080000", "0.160000"}
+# Campos que se revisan contra el catálogo oficial solo si está cargado (services.catalogs)
+OFFICIAL_FIELDS = (
+    ("regimen_fiscal", "c_RegimenFiscal"),
+    ("regimen_fiscal_receptor", "c_RegimenFiscal"),
+    ("uso_cfdi", "c_UsoCFDI"),
+    ("lugar_expedicion", "c_CodigoPostal"),
+    ("domicilio_fiscal_receptor", "c_CodigoPostal")
+)
+OFFICIAL_CONCEPTO_FIELDS = (("clave_prod_serv", "c_ClaveProdServ"), ("clave_unidad", "c_ClaveUnidad"))
+CENTAVO = Decimal("0.01")
+# Límites de cantidad y valor unitario: el importe (producto) cabe en la precisión de Decimal
+MAX_CONCEPTO = Decimal("1E+12")
+MAX_DECIMALES = 6
+
+# ==================== PLANTILLAS ====================
+# Los valores llegan ya escapados y entre comillas (quoteattr)
+
+COMPROBANTE_TEMPLATE = Template(
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:schemaLocation="http://www.sat.gob.mx/cfd/4 http://www.sat.gob.mx/sitio_internet/cfd/4/cfdv40.xsd" '
+    'Version="4.0" Serie=$serie Folio=$folio Fecha=$fecha FormaPago=$forma_pago '
+    'NoCertificado=$no_certificado Certificado=$certificado Sello="" SubTotal=$subtotal '
+    'Moneda=$moneda Total=$total TipoDeComprobante=$tipo_comprobante Exportacion=$exportacion '
+    'MetodoPago=$metodo_pago LugarExpedicion=$lugar_expedicion>'
+    '<cfdi:Emisor Rfc=$emisor_rfc Nombre=$emisor_nombre RegimenFiscal=$regimen_fiscal/>'
+    '<cfdi:Receptor Rfc=$receptor_rfc Nombre=$receptor_nombre DomicilioFiscalReceptor=$domicilio_fiscal_receptor '
+    'RegimenFiscalReceptor=$regimen_fiscal_receptor UsoCFDI=$uso_cfdi/>'
+    '<cfdi:Conceptos>$conceptos</cfdi:Conceptos>$impuestos'
+    '</cfdi:Comprobante>'
+)
+
+CONCEPTO_TEMPLATE = Template(
+    '<cfdi:Concepto ClaveProdServ=$clave_prod_serv Cantidad=$cantidad ClaveUnidad=$clave_unidad '
+    'Descripcion=$descripcion ValorUnitario=$valor_unitario Importe=$importe ObjetoImp=$objeto_imp>'
+    '$impuestos</cfdi:Concepto>'
+)
+
+CONCEPTO_SIN_IMPUESTOS_TEMPLATE = Template(
+    '<cfdi:Concepto ClaveProdServ=$clave_prod_serv Cantidad=$cantidad ClaveUnidad=$clave_unidad '
+    'Descripcion=$descripcion ValorUnitario=$valor_unitario Importe=$importe ObjetoImp=$objeto_imp/>'
+)
+
+TRASLADO_TEMPLATE = Template(
+    '<cfdi:Traslado Base=$base Impuesto="002" TipoFactor="Tasa" TasaOCuota=$tasa Importe=$importe/>'
+)
+
+
+def money(value: Decimal) -> str:
+    return str(value.quantize(CENTAVO))
+
+
+# ==================== VALIDACIÓN ====================
+
+def concepto_decimal(value: Any) -> Decimal:
+    """Número finito, menor a MAX_CONCEPTO y con hasta MAX_DECIMALES; si no, InvalidOperation"""
+    number = Decimal(str(value))
+    if not number.is_finite() or abs(number) >= MAX_CONCEPTO or number.as_tuple().exponent < -MAX_DECIMALES:
+        raise InvalidOperation(value)
+    return number
+
+
+def validate_payload(payload: Dict[str, Any], catalogos: Mapping[str, Container[str]]) -> List[str]:
+    """Errores de un comprobante contra los catálogos del SAT y las reglas básicas de CFDI 4.0"""
+    errors = []
+    for field, catalogo in (("forma_pago", "formas_pago"), ("moneda", "monedas"), ("tipo_comprobante", "tipos_comprobante")):
+        value = payload.get(field)
+        if value not in catalogos.get(catalogo, {}):
+            errors.append(f"{field} no está en el catálogo {catalogo}: {value}")
+    for field in ("emisor_rfc", "receptor_rfc"):
+        if not RFC_PATTERN.match((payload.get(field) or "").upper()):
+            errors.append(f"{field} inválido: {payload.get(field)}")
+    for field in ("lugar_expedicion", "domicilio_fiscal_receptor"):
+        if not CP_PATTERN.match(payload.get(field) or ""):
+            errors.append(f"{field} debe ser un código postal de 5 dígitos")
+    if payload.get("metodo_pago") not in METODOS_PAGO:
+        errors.append(f"metodo_pago inválido: {payload.get('metodo_pago')}")
+    for field, catalogo in OFFICIAL_FIELDS:
+        value = payload.get(field)
+        if value and catalogo in catalogos and value not in catalogos[catalogo]:
+            errors.append(f"{field} no está en el catálogo {catalogo}: {value}")
+
+    conceptos = payload.get("conceptos") or []
+    if not conceptos:
+        errors.append("El comprobante no tiene conceptos")
+    for position, concepto in enumerate(conceptos, 1):
+        try:
+            if concepto_decimal(concepto.get("cantidad")) <= 0:
+                errors.append(f"Concepto {position}: la cantidad debe ser mayor a cero")
+            if concepto_decimal(concepto.get("valor_unitario")) < 0:
+                errors.append(f"Concepto {position}: el valor unitario no puede ser negativo")
+        except InvalidOperation:
+            errors.append(
+                f"Concepto {position}: cantidad o valor unitario no numérico o fuera de rango "
+                f"(menor a {MAX_CONCEPTO:E} y hasta {MAX_DECIMALES} decimales)"
+            )
+        objeto_imp = concepto.get("objeto_imp") or "02"
+        if objeto_imp not in OBJETOS_IMP:
+            errors.append(f"Concepto {position}: objeto_imp inválido: {objeto_imp}")
+        elif objeto_imp == "02" and (concepto.get("tasa_iva") or "0.160000") not in TASAS_IVA:
+            errors.append(f"Concepto {position}: tasa_iva no está en el catálogo c_TasaOCuota: {concepto.get('tasa_iva')}")
+        for field, catalogo in OFFICIAL_CONCEPTO_FIELDS:
+            value = concepto.get(field)
+            if value and catalogo in catalogos and value not in catalogos[catalogo]:
+                errors.append(f"Concepto {position}: {field} no está en el catálogo {catalogo}: {value}")
+    return errors
+
+
+# ==================== CSD ====================
+
+class CSDSigner:
+    """Sella cadenas originales con la llave privada del CSD del emisor"""
+
+    def __init__(self, private_key, certificate: x509.Certificate):
+        self._key = private_key
+        self.no_certificado = serial_to_no_certificado(certificate.serial_number)
+        self.certificado = base64.b64encode(certificate.public_bytes(serialization.Encoding.DER)).decode("ascii")
+
+    def sign(self, cadena: str) -> str:
+        signature = self._key.sign(cadena.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256())
+        return base64.b64encode(signature).decode("ascii")
+
+    @classmethod
+    def from_files(cls, key_path: str, cer_path: str, password: Optional[str] = None) -> "CSDSigner":
+        """Archivos .key (PKCS#8 DER cifrado, como los entrega el SAT, o PEM) y .cer"""
+        with open(key_path, "rb") as file:
+            key_data = file.read()
+        with open(cer_path, "rb") as file:
+            cer_data = file.read()
+        secret = password.encode("utf-8") if password else None
+        if key_data.startswith(b"-----"):
+            key = serialization.load_pem_private_key(key_data, secret)
+        else:
+            key = serialization.load_der_private_key(key_data, secret)
+        if cer_data.startswith(b"-----"):
+            certificate = x509.load_pem_x509_certificate(cer_data)
+        else:
+            certificate = x509.load_der_x509_certificate(cer_data)
+        return cls(key, certificate)
+
+    @classmethod
+    def ephemeral(cls, no_certificado: str = "30001000000500000000") -> "CSDSigner":
+        """CSD de prueba autofirmado, válido por 4 años desde ayer"""
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "MVP CFDI CSD DE PRUEBA")])
+        start = datetime.now(timezone.utc) - timedelta(days=1)
+        certificate = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(int(no_certificado.encode("ascii").hex(), 16))
+            .not_valid_before(start)
+            .not_valid_after(start + timedelta(days=4 * 365))
+            .sign(key, hashes.SHA256())
+        )
+        return cls(key, certificate)
+
+
+def signer_from_env() -> CSDSigner:
+    key_path, cer_path = os.getenv("CFDI_CSD_KEY_PATH"), os.getenv("CFDI_CSD_CER_PATH")
+    if key_path and cer_path:
+        return CSDSigner.from_files(key_path, cer_path, os.getenv("CFDI_CSD_PASSWORD"))
+    return CSDSigner.ephemeral()
+
+
+# ==================== ARMADO ====================
+
+def render_conceptos(conceptos: List[Dict[str, Any]]) -> Tuple[str, Decimal, Dict[str, List[Decimal]]]:
+    """XML de los conceptos, subtotal y traslados de IVA agrupados por tasa: {tasa: [base, importe]}"""
+    parts = []
+    subtotal = Decimal(0)
+    traslados: Dict[str, List[Decimal]] = {}
+    for concepto in conceptos:
+        importe = (Decimal(str(concepto["cantidad"])) * Decimal(str(concepto["valor_unitario"]))).quantize(CENTAVO)
+        subtotal += importe
+        values = {
+            "clave_prod_serv": quoteattr(concepto.get("clave_prod_serv") or "01010101"),
+            "cantidad": quoteattr(str(concepto["cantidad"])),
+            "clave_unidad": quoteattr(concepto.get("clave_unidad") or "H87"),
+            "descripcion": quoteattr(concepto.get("descripcion") or ""),
+            "valor_unitario": quoteattr(money(Decimal(str(concepto["valor_unitario"])))),
+            "importe": quoteattr(money(importe)),
+            "objeto_imp": quoteattr(concepto.get("objeto_imp") or "02")
+        }
+        if (concepto.get("objeto_imp") or "02") != "02":
+            parts.append(CONCEPTO_SIN_IMPUESTOS_TEMPLATE.substitute(values))
+            continue
+        tasa = concepto.get("tasa_iva") or "0.160000"
+        iva = (importe * Decimal(tasa)).quantize(CENTAVO)
+        group = traslados.setdefault(tasa, [Decimal(0), Decimal(0)])
+        group[0] += importe
+        group[1] += iva
+        values["impuestos"] = "<cfdi:Impuestos><cfdi:Traslados>" + TRASLADO_TEMPLATE.substitute(
+            base=quoteattr(money(importe)), tasa=quoteattr(tasa), importe=quoteattr(money(iva))
+        ) + "</cfdi:Traslados></cfdi:Impuestos>"
+        parts.append(CONCEPTO_TEMPLATE.substitute(values))
+    return "".join(parts), subtotal, traslados
+
+
+def render_cfdi(payload: Dict[str, Any], serie: str, folio: int, fecha: str, signer: CSDSigner) -> Tuple[str, str, Decimal]:
+    """Regresa (xml sellado, sello, total)"""
+    conceptos, subtotal, traslados = render_conceptos(payload["conceptos"])
+    total_iva = sum((importe for _, importe in traslados.values()), Decimal(0))
+    impuestos = ""
+    if traslados:
+        impuestos = (
+            f'<cfdi:Impuestos TotalImpuestosTrasladados="{money(total_iva)}"><cfdi:Traslados>'
+            + "".join(
+                TRASLADO_TEMPLATE.substitute(base=quoteattr(money(base)), tasa=quoteattr(tasa), importe=quoteattr(money(importe)))
+                for tasa, (base, importe) in traslados.items()
+            )
+            + "</cfdi:Traslados></cfdi:Impuestos>"
+        )
+    total = subtotal + total_iva
+
+    xml = COMPROBANTE_TEMPLATE.substitute(
+        serie=quoteattr(serie),
+        folio=quoteattr(str(folio)),
+        fecha=quoteattr(fecha),
+        forma_pago=quoteattr(payload["forma_pago"]),
+        no_certificado=quoteattr(signer.no_certificado),
+        certificado=quoteattr(signer.certificado),
+        subtotal=quoteattr(money(subtotal)),
+        moneda=quoteattr(payload.get("moneda") or DEFAULT_MONEDA),
+        total=quoteattr(money(total)),
+        tipo_comprobante=quoteattr(payload["tipo_comprobante"]),
+        exportacion=quoteattr(payload.get("exportacion") or "01"),
+        metodo_pago=quoteattr(payload["metodo_pago"]),
+        lugar_expedicion=quoteattr(payload["lugar_expedicion"]),
+        emisor_rfc=quoteattr(payload["emisor_rfc"].upper()),
+        emisor_nombre=quoteattr(payload["emisor_nombre"]),
+        regimen_fiscal=quoteattr(payload.get("regimen_fiscal") or "601"),
+        receptor_rfc=quoteattr(payload["receptor_rfc"].upper()),
+        receptor_nombre=quoteattr(payload["receptor_nombre"]),
+        domicilio_fiscal_receptor=quoteattr(payload["domicilio_fiscal_receptor"]),
+        regimen_fiscal_receptor=quoteattr(payload.get("regimen_fiscal_receptor") or "616"),
+        uso_cfdi=quoteattr(payload.get("uso_cfdi") or "G03"),
+        conceptos=conceptos,
+        impuestos=impuestos
+    )
+    sello = signer.sign(cadena_original(ET.fromstring(xml.encode("utf-8"))))
+    return xml.replace('Sello=""', f'Sello="{sello}"', 1), sello, total
+
+
+def to_generated_record(payload: Dict[str, Any], serie: str, folio: int, fecha: str, total: Decimal, uuid: str, fecha_timbrado: str) -> Dict[str, Any]:
+    """Registro de cfdis_generados"""
+    return {
+        "id": uuid,
+        "serie": serie,
+        "folio": str(folio),
+        "fecha": fecha,
+        "emisor_rfc": payload["emisor_rfc"].upper(),
+        "emisor_nombre": payload["emisor_nombre"],
+        "receptor_rfc": payload["receptor_rfc"].upper(),
+        "receptor_nombre": payload["receptor_nombre"],
+        "total": format_centavos(parse_centavos(str(total))),
+        "moneda": payload.get("moneda") or DEFAULT_MONEDA,
+        "forma_pago": payload["forma_pago"],
+        "estado": "Timbrado",
+        "tipo_comprobante": payload["tipo_comprobante"],
+        "lugar_expedicion": payload["lugar_expedicion"],
+        "uuid": uuid,
+        "fecha_timbrado": fecha_timbrado
+    }
+
+
+# ==================== PIPELINE ====================
+
+class CFDIGenerator:
+
+    def __init__(self, folios: FolioAllocator, signer: CSDSigner, pac: PACClient, xml_dir: str = XML_DIR):
+        self.folios = folios
+        self.signer = signer
+        self.pac = pac
+        self.xml_dir = xml_dir
+
+    def _write_xml(self, uuid: str, xml: str) -> None:
+        with open(os.path.join(self.xml_dir, f"{uuid}.xml"), "w", encoding="utf-8") as file:
+            file.write(xml)
+
+    def generate(
+        self,
+        payloads: List[Dict[str, Any]],
+        catalogos: Mapping[str, Container[str]],
+        insert_batch: Callable[[List[Dict[str, Any]]], Any],
+        on_progress: Optional[Callable[[int, int, List[Dict[str, Any]]], None]] = None,
+        pac_batch_size: int = PAC_BATCH_SIZE,
+        start: int = 0,
+        skip: Container[int] = (),
+        trabajo: Optional[str] = None
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Genera y timbra `payloads` desde `start`; los registros timbrados se entregan a `insert_batch`
+        por lote de PAC y después se llama `on_progress(procesados, timbrados, errores)`.
+        Los índices de `skip` (ya timbrados) cuentan como procesados sin volver a timbrarse.
+        Con `trabajo`, cada registro lleva "trabajo" e "indice" para reconocerlo al retomar.
+        Regresa (timbrados, errores por índice del payload).
+        """
+        os.makedirs(self.xml_dir, exist_ok=True)
+        errors: List[Dict[str, Any]] = []
+        timbrados = 0
+        processed = 0
+        pending: List[Tuple[int, Dict[str, Any], str, int, str, str, str, Decimal]] = []
+
+        def send() -> None:
+            nonlocal timbrados, processed
+            try:
+                timbres = self.pac.timbrar_lote([(item[5], item[6]) for item in pending])
+            except PACError as e:
+                errors.extend({"indice": item[0], "errores": [f"PAC: {e}"]} for item in pending)
+                timbres = []
+            else:
+                # los timbres vienen en el orden enviado; los que falten no se dan por timbrados
+                errors.extend(
+                    {"indice": item[0], "errores": [f"PAC: no regresó timbre ({len(timbres)} de {len(pending)})"]}
+                    for item in pending[len(timbres):]
+                )
+            records = []
+            for item, timbre in zip(pending, timbres):
+                index, payload, serie, folio, fecha, _, _, total = item
+                self._write_xml(timbre.uuid, timbre.xml)
+                record = to_generated_record(payload, serie, folio, fecha, total, timbre.uuid, timbre.fecha_timbrado)
+                if trabajo is not None:
+                    record.update(trabajo=trabajo, indice=index)
+                records.append(record)
+            if records:
+                insert_batch(records)
+            timbrados += len(records)
+            processed += len(pending)
+            pending.clear()
+            if on_progress:
+                on_progress(processed, timbrados, errors)
+
+        for index in range(start, len(payloads)):
+            if index in skip:
+                processed += 1
+                continue
+            payload = payloads[index]
+            payload_errors = validate_payload(payload, catalogos)
+            if payload_errors:
+                errors.append({"indice": index, "errores": payload_errors})
+                processed += 1
+                continue
+            serie = (payload.get("serie") or "").upper()
+            folio = self.folios.next_folio(payload["emisor_rfc"], serie)
+            fecha = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+            try:
+                xml, sello, total = render_cfdi(payload, serie, folio, fecha, self.signer)
+            except Exception as e:
+                # el folio ya quedó reservado y aparece como hueco en la auditoría
+                errors.append({"indice": index, "errores": [f"No se pudo armar el CFDI con folio {folio}: {e!r}"]})
+                processed += 1
+                continue
+            pending.append((index, payload, serie, folio, fecha, xml, sello, total))
+            if len(pending) >= pac_batch_size:
+                send()
+        if pending:
+            send()
+        return timbrados, errors
+
+
+_generator: Optional[CFDIGenerator] = None
+_generator_lock = threading.Lock()
+
+
+def get_generator(existing: Callable[[], Any]) -> CFDIGenerator:
+    """Generador compartido; `existing` da los CFDIs generados para continuar los folios"""
+    global _generator
+    with _generator_lock:
+        if _generator is None:
+            _generator = CFDIGenerator(FolioAllocator(existing()), signer_from_env(), create_pac())
+        return _generator
+
+
+def active_generator() -> Optional[CFDIGenerator]:
+    """Generador ya creado en este proceso, sin crearlo"""
+    return _generator
+
+
+def close_generator() -> None:
+    global _generator
+    with _generator_lock:
+        if _generator is not None:
+            _generator.folios.close()
+            _generator = None
@@ -0,0 +1,287 @@
+"""
+MVP CFDI - Colecciones indexadas
+Índices hash para búsquedas por igualdad y un índice ordenado por (fecha, id) para rangos y paginación
+"""
+
+import threading
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+
+from services.amounts import DEFAULT_MONEDA, parse_centavos
+from services.dedup import BloomFilter, dedup_key, dedup_keys, serie_folio_key, uuid_key
+from services.pagination import DEFAULT_LIMIT, SortKey, decode_cursor, encode_cursor, project, sort_key
+
+# Capacidad del filtro de Bloom en llaves (hasta 2 por registro: UUID y serie/folio)
+MIN_BLOOM_CAPACITY = 100_000
+
+# Campos con índice hash; "serie_folio" es la llave compuesta serie + folio y
+# "trabajo" el trabajo de generación que timbró el CFDI (para retomarlo sin duplicar)
+HASH_FIELDS = (
+    "uuid",
+    "emisor_rfc",
+    "receptor_rfc",
+    "estado",
+    "tipo_comprobante",
+    "moneda",
+    "serie",
+    "serie_folio",
+    "trabajo"
+)
+
+
+def normalize(value: Any) -> str:
+    return str(value).strip().casefold()
+
+
+def serie_folio(serie: Any, folio: Any) -> str:
+    return f"{normalize(serie)}|{normalize(folio)}"
+
+
+def index_values(record: Dict[str, Any]) -> Dict[str, str]:
+    values = {}
+    for field in HASH_FIELDS:
+        if field == "serie_folio":
+            if record.get("folio") not in (None, ""):
+                values[field] = serie_folio(record.get("serie") or "", record["folio"])
+        elif record.get(field) not in (None, ""):
+            values[field] = normalize(record[field])
+    return values
+
+
+class CFDICollection:
+    """
+    Registros de una colección indexados por id.
+    Los cambios se hacen con upsert()/upsert_many()/remove() (desde el store) y
+    actualizan los índices de forma incremental en el mismo objeto, así que
+    escrituras y lecturas comparten un candado: cada lectura (una página, un
+    bloque de iter_chunks, una consulta) ve un estado consistente, con un lote
+    de upsert_many() completo o sin aplicar. Lecturas sucesivas sí pueden ver
+    escrituras intermedias.
+    También mantiene la suma de `total` en centavos, global y por moneda, y
+    opcionalmente un objeto `stats` con add()/remove() que recibe cada cambio.
+    Con `dedupe=True` mantiene un filtro de Bloom de llaves de unicidad para
+    que find_duplicate() descarte en O(1) los registros nuevos.
+    """
+
+    def __init__(self, records=(), stats=None, dedupe: bool = False):
+        self.stats = stats
+        self.bloom: Optional[BloomFilter] = BloomFilter(max(len(records) * 4, MIN_BLOOM_CAPACITY)) if dedupe else None
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._hash: Dict[str, Dict[str, Set[str]]] = {field: {} for field in HASH_FIELDS}
+        self._centavos: Dict[str, int] = {}
+        self._totales_por_moneda: Dict[str, int] = {}
+        self.total_centavos = 0
+        self._lock = threading.RLock()
+        for record in records:
+            previous = self._records.get(record["id"])
+            if previous is not None:
+                self._unindex(previous)
+            self._records[record["id"]] = record
+            self._index(record)
+        self._keys: List[SortKey] = sorted(sort_key(record) for record in self._records.values())
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            return iter(list(self._records.values()))
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        return self._records.get(record_id)
+
+    def centavos(self, record_id: str) -> int:
+        return self._centavos.get(record_id, 0)
+
+    def totales_por_moneda(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._totales_por_moneda)
+
+    # ==================== MANTENIMIENTO DE ÍNDICES ====================
+
+    def _index(self, record: Dict[str, Any]) -> None:
+        for field, value in index_values(record).items():
+            self._hash[field].setdefault(value, set()).add(record["id"])
+        centavos = parse_centavos(record.get("total"))
+        moneda = record.get("moneda") or DEFAULT_MONEDA
+        self._centavos[record["id"]] = centavos
+        self._totales_por_moneda[moneda] = self._totales_por_moneda.get(moneda, 0) + centavos
+        self.total_centavos += centavos
+        if self.stats is not None:
+            self.stats.add(record)
+        if self.bloom is not None:
+            for key in dedup_keys(record):
+                self.bloom.add(key)
+
+    def _unindex(self, record: Dict[str, Any]) -> None:
+        for field, value in index_values(record).items():
+            bucket = self._hash[field].get(value)
+            if bucket is not None:
+                bucket.discard(record["id"])
+                if not bucket:
+                    del self._hash[field][value]
+        centavos = self._centavos.pop(record["id"], 0)
+        moneda = record.get("moneda") or DEFAULT_MONEDA
+        self._totales_por_moneda[moneda] = self._totales_por_moneda.get(moneda, 0) - centavos
+        if not self._totales_por_moneda[moneda]:
+            del self._totales_por_moneda[moneda]
+        self.total_centavos -= centavos
+        if self.stats is not None:
+            self.stats.remove(record)
+
+    def upsert(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Inserta o reemplaza un registro; regresa el registro anterior si existía"""
+        with self._lock:
+            previous = self.remove(record["id"])
+            self._records[record["id"]] = record
+            self._index(record)
+            insort(self._keys, sort_key(record))
+            if self.bloom is not None and self.bloom.saturated:
+                self._rebuild_bloom()
+            return previous
+
+    def upsert_many(self, records: List[Dict[str, Any]]) -> None:
+        """Aplica un lote completo sin que una lectura lo vea a medias"""
+        with self._lock:
+            for record in records:
+                self.upsert(record)
+
+    def _rebuild_bloom(self) -> None:
+        bloom = BloomFilter(len(self._records) * 4)
+        for record in list(self._records.values()):
+            for key in dedup_keys(record):
+                bloom.add(key)
+        self.bloom = bloom
+
+    def remove(self, record_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            previous = self._records.pop(record_id, None)
+            if previous is not None:
+                self._unindex(previous)
+                key = sort_key(previous)
+                position = bisect_left(self._keys, key)
+                if position < len(self._keys) and self._keys[position] == key:
+                    del self._keys[position]
+            return previous
+
+    # ==================== CONSULTAS ====================
+
+    def find_duplicate(self, record: Dict[str, Any]) -> Optional[str]:
+        """
+        Id de un registro existente con la misma llave de unicidad: el UUID o
+        emisor + serie + folio. Un registro con UUID también coincide por serie y
+        folio con uno guardado sin UUID (el mismo comprobante antes de timbrarse).
+        Si el filtro de Bloom dice que la llave es nueva no se consulta nada más;
+        un positivo se confirma con los índices.
+        """
+        with self._lock:
+            if dedup_key(record) is None:
+                return record["id"] if record.get("id") in self._records else None
+            key = uuid_key(record)
+            if key is not None and (self.bloom is None or key in self.bloom):
+                for record_id in tuple(self._hash["uuid"].get(normalize(record["uuid"]), ())):
+                    return record_id
+            key = serie_folio_key(record)
+            if key is None or (self.bloom is not None and key not in self.bloom):
+                return None
+            emisor = normalize(record.get("emisor_rfc") or "")
+            has_uuid = bool(record.get("uuid"))
+            for record_id in tuple(self._hash["serie_folio"].get(serie_folio(record.get("serie") or "", record["folio"]), ())):
+                existing = self._records.get(record_id)
+                if existing is None or normalize(existing.get("emisor_rfc") or "") != emisor:
+                    continue
+                # dos UUID distintos son comprobantes distintos
+                if not has_uuid or not existing.get("uuid"):
+                    return record_id
+            return None
+
+    def lookup(self, field: str, value: Any) -> FrozenSet[str]:
+        """Búsqueda O(1) en un índice hash"""
+        with self._lock:
+            return frozenset(self._hash[field].get(normalize(value), ()))
+
+    def fecha_range(self, desde: Optional[str] = None, hasta: Optional[str] = None) -> List[SortKey]:
+        """
+        Llaves dentro del rango de fechas (inclusivo) en O(log n) + tamaño del resultado.
+        `hasta` funciona como prefijo: "2023-03-02" incluye todo ese día.
+        """
+        with self._lock:
+            keys = self._keys
+            start = bisect_left(keys, (desde, "")) if desde else 0
+            end = bisect_right(keys, (hasta + "\uffff", "")) if hasta else len(keys)
+            return keys[start:end]
+
+    def query(
+        self,
+        filters: Dict[str, Any],
+        fecha_desde: Optional[str] = None,
+        fecha_hasta: Optional[str] = None
+    ) -> List[SortKey]:
+        """
+        Regresa las llaves (fecha, id) que cumplen todos los filtros, en orden.
+        Los filtros de igualdad se intersectan empezando por el índice más selectivo.
+        """
+        with self._lock:
+            filters = {field: value for field, value in filters.items() if value not in (None, "")}
+            if not filters:
+                return self.fecha_range(fecha_desde, fecha_hasta)
+
+            candidates = sorted(
+                (self.lookup(field, value) for field, value in filters.items()),
+                key=len
+            )
+            ids = candidates[0].intersection(*candidates[1:])
+
+            keys = []
+            for record_id in ids:
+                record = self._records.get(record_id)
+                if record is None:
+                    continue
+                key = sort_key(record)
+                if fecha_desde and key[0] < fecha_desde:
+                    continue
+                if fecha_hasta and key[0] > fecha_hasta + "\uffff":
+                    continue
+                keys.append(key)
+            keys.sort()
+            return keys
+
+    def page(
+        self,
+        keys: Optional[List[SortKey]] = None,
+        cursor: Optional[str] = None,
+        limit: int = DEFAULT_LIMIT,
+        fields: Optional[Tuple[str, ...]] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Página de registros a partir de llaves ordenadas (todas si keys es None)"""
+        with self._lock:
+            if keys is None:
+                keys = self._keys
+            start = bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+            end = min(start + limit, len(keys))
+            page = []
+            for _, record_id in keys[start:end]:
+                record = self._records.get(record_id)
+                if record is not None:
+                    page.append(project(record, fields))
+            next_cursor = encode_cursor(keys[end - 1]) if end < len(keys) else None
+            return page, next_cursor
+
+    def iter_chunks(self, chunk_size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Recorre la colección en orden (fecha, id) en bloques, reanudando cada
+        bloque con bisect desde la última llave para no copiar la lista completa.
+        """
+        last: Optional[SortKey] = None
+        while True:
+            # el candado no se mantiene mientras el consumidor procesa el bloque
+            with self._lock:
+                keys = self._keys
+                start = bisect_right(keys, last) if last is not None else 0
+                chunk_keys = keys[start:start + chunk_size]
+                if not chunk_keys:
+                    return
+                chunk = [self._records[record_id] for _, record_id in chunk_keys if record_id in self._records]
+            if chunk:
+                yield chunk
+            last = chunk_keys[-1]
@@ -0,0 +1,240 @@
+"""
+MVP CFDI - Almacén de datos en memoria
+Carga los CFDIs una sola vez desde el backend de almacenamiento y los recarga solo cuando cambian
+"""
+
+import asyncio
+import secrets
+import threading
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import Any, Dict, Hashable, Iterable, List, Mapping, Optional, Tuple
+
+from services.cfdi_index import CFDICollection
+from services.dedup import dedup_key
+from services.storage import CFDIDataError, StorageBackend, create_storage
+from services.validation_stats import ValidationStats
+
+# Acción de la API -> colección del archivo de datos
+ACTION_COLLECTIONS = {
+    "download": "cfdis_descargados",
+    "validate": "cfdis_validacion",
+    "generate": "cfdis_generados"
+}
+
+# Colecciones donde insert_records() rechaza CFDIs repetidos (UUID o emisor + serie + folio)
+UNIQUE_COLLECTIONS = {"cfdis_descargados", "cfdis_generados"}
+
+# Colecciones con estadísticas incrementales
+COLLECTION_STATS = {
+    "cfdis_validacion": ValidationStats
+}
+
+
+@dataclass(frozen=True)
+class CFDISnapshot:
+    """
+    Datos cargados del backend. Se reemplaza completo al recargar, pero no es
+    inmutable: las escrituras del store (upsert_records) actualizan en el mismo
+    objeto las colecciones indexadas, bajo el candado de cada colección. Cada
+    lectura de una colección es consistente por sí misma; dos lecturas seguidas
+    pueden ver un lote escrito entre ellas. Los registros no deben modificarse.
+    """
+    data: Mapping[str, Any]
+    signature: Hashable
+
+    def collection(self, name: str) -> CFDICollection:
+        value = self.data.get(name)
+        return value if isinstance(value, CFDICollection) else empty_collection(name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            key: list(value) if isinstance(value, CFDICollection) else value
+            for key, value in self.data.items()
+        }
+
+
+def resolve_collection(name: str) -> Optional[str]:
+    """Acepta la acción ("download") o el nombre de la colección ("cfdis_descargados")"""
+    if name in ACTION_COLLECTIONS:
+        return ACTION_COLLECTIONS[name]
+    if name in ACTION_COLLECTIONS.values():
+        return name
+    return None
+
+
+def new_collection(name: str, records=()) -> CFDICollection:
+    stats_class = COLLECTION_STATS.get(name)
+    return CFDICollection(
+        records,
+        stats=stats_class() if stats_class else None,
+        dedupe=name in UNIQUE_COLLECTIONS
+    )
+
+
+class EmptyCollection(CFDICollection):
+    """Colección vacía de solo lectura; las escrituras pasan por CFDIStore.upsert_records()"""
+
+    def __init__(self, name: str):
+        stats_class = COLLECTION_STATS.get(name)
+        super().__init__(stats=stats_class() if stats_class else None)
+
+    def upsert(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        raise TypeError("La colección vacía compartida es de solo lectura")
+
+    def upsert_many(self, records: List[Dict[str, Any]]) -> None:
+        raise TypeError("La colección vacía compartida es de solo lectura")
+
+    def remove(self, record_id: str) -> Optional[Dict[str, Any]]:
+        raise TypeError("La colección vacía compartida es de solo lectura")
+
+
+# Una por nombre, creada una sola vez para las colecciones que aún no existen
+_empty_collections: Dict[str, EmptyCollection] = {}
+
+
+def empty_collection(name: str) -> EmptyCollection:
+    collection = _empty_collections.get(name)
+    if collection is None:
+        collection = _empty_collections.setdefault(name, EmptyCollection(name))
+    return collection
+
+
+def _build(raw: Dict[str, Any]) -> Mapping[str, Any]:
+    data = {
+        key: new_collection(key, value) if isinstance(value, list) else value
+        for key, value in raw.items()
+    }
+    return MappingProxyType(data)
+
+
+class CFDIStore:
+    """
+    Almacén compartido por los routers.
+    La lectura rápida solo compara la firma del backend (mtime/tamaño del JSON,
+    data_version de SQLite); la carga ocurre bajo un lock y únicamente cuando
+    los datos cambiaron fuera de este proceso o se llamó a invalidate().
+    `version` aumenta en cada recarga o modificación; `epoch` distingue a este
+    proceso, porque cada worker lleva su propio contador.
+    """
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+        self._lock = threading.RLock()
+        self._snapshot: Optional[CFDISnapshot] = None
+        self._version = 0
+        self.epoch = secrets.token_hex(4)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def _is_fresh(self, snapshot: Optional[CFDISnapshot]) -> bool:
+        return snapshot is not None and snapshot.signature == self.backend.signature()
+
+    def _reload(self) -> CFDISnapshot:
+        with self._lock:
+            if self._is_fresh(self._snapshot):
+                return self._snapshot
+            signature = self.backend.signature()
+            self._snapshot = CFDISnapshot(
+                data=_build(self.backend.load()),
+                signature=signature
+            )
+            self._version += 1
+            return self._snapshot
+
+    def snapshot(self) -> CFDISnapshot:
+        current = self._snapshot
+        if self._is_fresh(current):
+            return current
+        return self._reload()
+
+    async def asnapshot(self) -> CFDISnapshot:
+        """Igual que snapshot(), pero la carga se hace fuera del event loop"""
+        current = self._snapshot
+        if self._is_fresh(current):
+            return current
+        return await asyncio.to_thread(self._reload)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._snapshot = None
+
+    # ==================== ESCRITURA ====================
+
+    def save(self, data: Dict[str, Any]) -> bool:
+        with self._lock:
+            try:
+                self.backend.save_all(data)
+            except CFDIDataError:
+                return False
+            finally:
+                self._snapshot = None
+        return True
+
+    def upsert_records(self, collection: str, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Inserta o reemplaza registros (por id) en una colección.
+        Los índices se actualizan de forma incremental y el backend escribe
+        solo los registros recibidos, sin recargar nada.
+        """
+        records = list(records)
+        with self._lock:
+            snapshot = self.snapshot()
+            target = snapshot.data.get(collection)
+            if not isinstance(target, CFDICollection):
+                target = new_collection(collection)
+                snapshot = replace(
+                    snapshot,
+                    data=MappingProxyType({**snapshot.data, collection: target})
+                )
+
+            try:
+                self.backend.upsert_records(collection, records)
+            except CFDIDataError:
+                self._snapshot = None
+                raise
+
+            target.upsert_many(records)
+            self._snapshot = replace(snapshot, signature=self.backend.signature())
+            self._version += 1
+            return len(records)
+
+    def insert_records(self, collection: str, records: Iterable[Dict[str, Any]]) -> Tuple[int, List[str]]:
+        """
+        Inserta solo los registros nuevos. En colecciones únicas se descartan los
+        que ya existen (o se repiten dentro del lote); regresa (insertados, ids duplicados).
+        """
+        with self._lock:
+            target = self.snapshot().collection(collection)
+            accepted: List[Dict[str, Any]] = []
+            duplicates: List[str] = []
+            unique = collection in UNIQUE_COLLECTIONS
+            seen = set()
+            for record in records:
+                key = dedup_key(record) if unique else record["id"]
+                existing = target.find_duplicate(record) if unique else target.get(record["id"])
+                if key in seen or existing is not None:
+                    duplicates.append(record["id"])
+                    continue
+                if key:
+                    seen.add(key)
+                accepted.append(record)
+            if accepted:
+                self.upsert_records(collection, accepted)
+            return len(accepted), duplicates
+
+    def flush(self) -> None:
+        self.backend.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self.backend.close()
+
+
+cfdi_store = CFDIStore(create_storage())
+
+
+def get_cfdi_store() -> CFDIStore:
+    return cfdi_store
@@ -0,0 +1,83 @@
+"""
+MVP CFDI - Parser de XML CFDI 3.3 / 4.0
+Lectura en streaming con iterparse: solo se conservan los atributos de
+Comprobante, Emisor, Receptor y TimbreFiscalDigital; los conceptos se descartan
+"""
+
+import xml.etree.ElementTree as ET
+from typing import IO, Any, Dict, Union
+
+from services.amounts import DEFAULT_MONEDA, format_centavos, parse_centavos
+
+
+class CFDIParseError(ValueError):
+    """El XML no es un CFDI válido"""
+
+
+def local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_cfdi(source: Union[str, IO[bytes]]) -> Dict[str, Dict[str, str]]:
+    """
+    Regresa los atributos de los nodos relevantes:
+    {"Comprobante": {...}, "Emisor": {...}, "Receptor": {...}, "TimbreFiscalDigital": {...}}
+    """
+    nodes: Dict[str, Dict[str, str]] = {}
+    depth = 0
+    try:
+        for event, element in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                name = local_name(element.tag)
+                if depth == 1 and name != "Comprobante":
+                    raise CFDIParseError(f"Nodo raíz inesperado: {name}")
+                if name in ("Comprobante", "Emisor", "Receptor", "TimbreFiscalDigital") and name not in nodes:
+                    nodes[name] = dict(element.attrib)
+            else:
+                depth -= 1
+                # los hijos ya procesados no se necesitan: memoria constante
+                element.clear()
+    except ET.ParseError as e:
+        raise CFDIParseError(f"XML mal formado: {e}")
+
+    if "Comprobante" not in nodes:
+        raise CFDIParseError("No se encontró el nodo Comprobante")
+    return nodes
+
+
+def to_record(nodes: Dict[str, Dict[str, str]], estado: str = "Descargado") -> Dict[str, Any]:
+    """Convierte los nodos del CFDI al esquema de cfdis_descargados"""
+    comprobante = nodes.get("Comprobante", {})
+    emisor = nodes.get("Emisor", {})
+    receptor = nodes.get("Receptor", {})
+    timbre = nodes.get("TimbreFiscalDigital", {})
+
+    uuid = (timbre.get("UUID") or "").upper()
+    record_id = uuid or "-".join(
+        filter(None, (emisor.get("Rfc"), comprobante.get("Serie"), comprobante.get("Folio")))
+    )
+    if not record_id:
+        raise CFDIParseError("El CFDI no tiene UUID ni serie/folio")
+
+    record = {
+        "id": record_id,
+        "version": comprobante.get("Version", ""),
+        "serie": comprobante.get("Serie", ""),
+        "folio": comprobante.get("Folio", ""),
+        "fecha": comprobante.get("Fecha", ""),
+        "emisor_rfc": emisor.get("Rfc", ""),
+        "emisor_nombre": emisor.get("Nombre", ""),
+        "receptor_rfc": receptor.get("Rfc", ""),
+        "receptor_nombre": receptor.get("Nombre", ""),
+        "total": format_centavos(parse_centavos(comprobante.get("Total"))),
+        "moneda": comprobante.get("Moneda") or DEFAULT_MONEDA,
+        "forma_pago": comprobante.get("FormaPago", ""),
+        "estado": estado,
+        "tipo_comprobante": comprobante.get("TipoDeComprobante", ""),
+        "lugar_expedicion": comprobante.get("LugarExpedicion", "")
+    }
+    if uuid:
+        record["uuid"] = uuid
+        record["fecha_timbrado"] = timbre.get("FechaTimbrado", "")
+    return record
@@ -0,0 +1,203 @@
+"""
+MVP CFDI - Compresión de respuestas
+Negocia gzip o brotli (si está instalado) con Accept-Encoding y comprime las
+respuestas que superan CFDI_COMPRESS_MIN_BYTES. Los cuerpos grandes se comprimen
+en un hilo para no detener el event loop. Las rutas con caché de respuestas
+guardan la variante comprimida junto a los bytes codificados; el middleware
+solo comprime lo que llega sin Content-Encoding.
+"""
+
+import asyncio
+import os
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se ofrece gzip
+    brotli = None
+
+MIN_SIZE = int(os.getenv("CFDI_COMPRESS_MIN_BYTES", 1024))
+# a partir de este tamaño la compresión corre fuera del event loop
+THREAD_SIZE = int(os.getenv("CFDI_COMPRESS_THREAD_BYTES", 256 * 1024))
+GZIP_LEVEL = int(os.getenv("CFDI_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("CFDI_BROTLI_QUALITY", 5))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/xml", "text/")
+# SSE necesita cada evento en cuanto se emite
+STREAMING_EXCLUDED = ("text/event-stream",)
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Elige br o gzip según los q-values de Accept-Encoding; a igual q gana br"""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in supported_encodings():
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def variant_etag(etag: Optional[str], encoding: str) -> Optional[str]:
+    """Un ETag fuerte distinto por codificación: "v" -> "v-gzip" """
+    if not etag or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def strip_variant(etag: str) -> str:
+    for encoding in ("br", "gzip"):
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # wbits 31 = formato gzip con mtime 0: mismo cuerpo, mismos bytes
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+async def compress_async(body: bytes, encoding: str) -> bytes:
+    if len(body) >= THREAD_SIZE:
+        return await asyncio.to_thread(compress, body, encoding)
+    return compress(body, encoding)
+
+
+class StreamCompressor:
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._compress = self._compressor.process
+            self._flush = self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+            self._flush = self._compressor.flush
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._compress(chunk)
+
+    def finish(self) -> bytes:
+        return self._flush()
+
+
+def set_encoding_headers(headers: MutableHeaders, encoding: str) -> None:
+    headers["Content-Encoding"] = encoding
+    headers.add_vary_header("Accept-Encoding")
+    etag = headers.get("etag")
+    if etag:
+        headers["ETag"] = variant_etag(etag, encoding)
+
+
+class CompressionMiddleware:
+    """Middleware ASGI; deja pasar sin tocar lo que ya trae Content-Encoding"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await CompressionResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class CompressionResponder:
+
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Send
+        self.start: Optional[Message] = None
+        # None = aún no se decide; False = sin comprimir; StreamCompressor al transmitir
+        self.mode: Any = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_wrapper)
+
+    def _eligible(self) -> bool:
+        headers = Headers(raw=self.start["headers"])
+        return (
+            self.start["status"] not in (204, 206, 304)
+            and "content-encoding" not in headers
+            and is_compressible(headers.get("content-type"))
+        )
+
+    async def send_wrapper(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        if self.mode is None:
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            headers = MutableHeaders(raw=self.start["headers"])
+            if not self._eligible():
+                self.mode = False
+            elif not more_body:
+                if len(body) < self.minimum_size:
+                    self.mode = False
+                else:
+                    compressed = await compress_async(body, self.encoding)
+                    set_encoding_headers(headers, self.encoding)
+                    headers["Content-Length"] = str(len(compressed))
+                    await self.send(self.start)
+                    await self.send({"type": "http.response.body", "body": compressed})
+                    return
+            elif headers.get("content-type", "").startswith(STREAMING_EXCLUDED):
+                self.mode = False
+            else:
+                self.mode = StreamCompressor(self.encoding)
+                set_encoding_headers(headers, self.encoding)
+                del headers["Content-Length"]
+            await self.send(self.start)
+
+        if self.mode is False:
+            await self.send(message)
+            return
+        chunk = self.mode.compress(message.get("body", b""))
+        more_body = message.get("more_body", False)
+        if not more_body:
+            chunk += self.mode.finish()
+        if chunk or not more_body:
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
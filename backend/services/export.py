@@ -0,0 +1,48 @@
+"""
+MVP CFDI - Exportación en streaming
+Generadores NDJSON y CSV que recorren la colección por bloques, sin materializar la respuesta completa
+"""
+
+import csv
+import io
+import json
+from typing import Iterator, Optional, Tuple
+
+from services.cfdi_index import CFDICollection
+from services.pagination import project
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+CHUNK_SIZE = 500
+
+
+def ndjson_chunks(cfdis: CFDICollection, fields: Optional[Tuple[str, ...]] = None) -> Iterator[bytes]:
+    for chunk in cfdis.iter_chunks(CHUNK_SIZE):
+        yield "".join(
+            json.dumps(project(record, fields), ensure_ascii=False) + "\n"
+            for record in chunk
+        ).encode("utf-8")
+
+
+def csv_chunks(cfdis: CFDICollection, fields: Optional[Tuple[str, ...]] = None) -> Iterator[bytes]:
+    """Las columnas son `fields` o, si no se indican, las llaves del primer registro"""
+    buffer = io.StringIO()
+    writer = None
+    for chunk in cfdis.iter_chunks(CHUNK_SIZE):
+        if writer is None:
+            columns = fields or tuple(chunk[0].keys())
+            writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def export_chunks(cfdis: CFDICollection, format: str, fields: Optional[Tuple[str, ...]] = None) -> Iterator[bytes]:
+    if format == "csv":
+        return csv_chunks(cfdis, fields)
+    return ndjson_chunks(cfdis, fields)
@@ -0,0 +1,76 @@
+"""
+MVP CFDI - Servicio de estatus del SAT local
+Imitación del ConsultaCFDIService para pruebas de rendimiento y timeouts sin conexión:
+mismo sobre SOAP, latencia y tasa de errores configurables
+Uso: python manage.py fake-sat --port 8081 --latency-ms 50 --error-rate 0.05
+"""
+
+import asyncio
+import hashlib
+import random
+import xml.etree.ElementTree as ET
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request, Response
+
+from services.sat_validation import SATStatus
+
+RESPONSE_TEMPLATE = (
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body>'
+    '<ConsultaResponse xmlns="http://tempuri.org/"><ConsultaResult '
+    'xmlns:a="http://schemas.datacontract.org/2004/07/Sat.Cfdi.Negocio.ConsultaCfdi.Servicio" '
+    'xmlns:i="http://www.w3.org/2001/XMLSchema-instance">'
+    '<a:CodigoEstatus>{codigo_estatus}</a:CodigoEstatus>'
+    '<a:EsCancelable>{es_cancelable}</a:EsCancelable>'
+    '<a:Estado>{estado}</a:Estado>'
+    '<a:EstatusCancelacion>{estatus_cancelacion}</a:EstatusCancelacion>'
+    '</ConsultaResult></ConsultaResponse></s:Body></s:Envelope>'
+)
+
+
+def fake_status(uuid: str) -> SATStatus:
+    """Estatus determinista por UUID: ~85% vigentes, ~10% cancelados, ~5% no encontrados"""
+    if not uuid:
+        return SATStatus("N - 601: La expresión impresa proporcionada no es válida.", "No Encontrado")
+    bucket = hashlib.blake2b(uuid.upper().encode("utf-8"), digest_size=2).digest()[0] % 20
+    if bucket == 0:
+        return SATStatus("N - 602: Comprobante no encontrado.", "No Encontrado")
+    if bucket <= 2:
+        return SATStatus(
+            "S - Comprobante obtenido satisfactoriamente.", "Cancelado",
+            "Cancelable sin aceptación", "Cancelado sin aceptación"
+        )
+    return SATStatus("S - Comprobante obtenido satisfactoriamente.", "Vigente", "Cancelable sin aceptación")
+
+
+def expresion_uuid(body: bytes) -> str:
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError:
+        return ""
+    for element in root.iter():
+        if element.tag.rsplit("}", 1)[-1] == "expresionImpresa":
+            params = parse_qs((element.text or "").strip().lstrip("?"))
+            return params.get("id", [""])[0]
+    return ""
+
+
+def create_app(latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0) -> FastAPI:
+    """`latency` y `jitter` en segundos; `error_rate` es la fracción de respuestas 503"""
+    app = FastAPI(title="SAT local", docs_url=None, redoc_url=None)
+
+    @app.post("/ConsultaCFDIService.svc")
+    async def consulta(request: Request):
+        body = await request.body()
+        delay = latency + (random.uniform(0, jitter) if jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if error_rate and random.random() < error_rate:
+            return Response(status_code=503, content="Servicio no disponible")
+        status = fake_status(expresion_uuid(body))
+        return Response(
+            content=RESPONSE_TEMPLATE.format(**status.__dict__),
+            media_type="text/xml; charset=utf-8"
+        )
+
+    return app
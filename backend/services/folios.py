@@ -0,0 +1,223 @@
+"""
+MVP CFDI - Asignación de folios por emisor y serie
+Los folios se reservan por bloques en SQLite (data/folios.db) dentro de una
+transacción BEGIN IMMEDIATE, así que varios workers de uvicorn nunca reciben el
+mismo rango; dentro del proceso cada bloque se consume con itertools.count, cuyo
+next() es atómico, y solo se toma un candado al pedir el siguiente bloque.
+Cada reserva queda registrada para auditar huecos de folios.
+"""
+
+import itertools
+import os
+import socket
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from services.storage import DATA_DIR
+
+FOLIOS_DB_PATH = os.getenv("CFDI_FOLIOS_DB", os.path.join(DATA_DIR, "folios.db"))
+DEFAULT_BLOCK_SIZE = 100
+AUDIT_QUERY = (
+    "SELECT id, inicio, fin, ultimo_usado, proceso, reservado, liberado FROM folio_bloques "
+    "WHERE emisor_rfc = ? AND serie = ? ORDER BY inicio"
+)
+
+FolioKey = Tuple[str, str]
+
+
+def folio_key(emisor_rfc: str, serie: str) -> FolioKey:
+    return emisor_rfc.strip().upper(), serie.strip().upper()
+
+
+class FolioBlock:
+    """Rango [inicio, fin] reservado por este proceso"""
+
+    def __init__(self, block_id: int, inicio: int, fin: int):
+        self.id = block_id
+        self.inicio = inicio
+        self.fin = fin
+        self._counter: Iterator[int] = itertools.count(inicio)
+        self.ultimo = inicio - 1
+
+    def take(self) -> Optional[int]:
+        folio = next(self._counter)
+        if folio > self.fin:
+            return None
+        self.ultimo = max(self.ultimo, folio)
+        return folio
+
+
+def compress_ranges(folios: Iterable[int]) -> List[List[int]]:
+    """[1, 2, 3, 7, 9, 10] -> [[1, 3], [7, 7], [9, 10]]"""
+    ranges: List[List[int]] = []
+    for folio in sorted(set(folios)):
+        if ranges and folio == ranges[-1][1] + 1:
+            ranges[-1][1] = folio
+        else:
+            ranges.append([folio, folio])
+    return ranges
+
+
+class FolioAllocator:
+
+    def __init__(self, existing: Iterable[Dict] = (), path: str = FOLIOS_DB_PATH, block_size: Optional[int] = None):
+        """`existing`: CFDIs ya generados; una serie nueva continúa después de su folio mayor"""
+        self.path = path
+        self.block_size = block_size or int(os.getenv("CFDI_FOLIO_BLOCK", DEFAULT_BLOCK_SIZE))
+        self._seed: Dict[FolioKey, int] = {}
+        for record in existing:
+            folio = str(record.get("folio") or "")
+            if folio.isdigit():
+                key = folio_key(record.get("emisor_rfc") or "", record.get("serie") or "")
+                self._seed[key] = max(self._seed.get(key, 0), int(folio))
+        self._blocks: Dict[FolioKey, FolioBlock] = {}
+        self._locks: Dict[FolioKey, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS folio_series (
+                emisor_rfc TEXT NOT NULL,
+                serie TEXT NOT NULL,
+                siguiente INTEGER NOT NULL,
+                PRIMARY KEY (emisor_rfc, serie)
+            );
+            CREATE TABLE IF NOT EXISTS folio_bloques (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                emisor_rfc TEXT NOT NULL,
+                serie TEXT NOT NULL,
+                inicio INTEGER NOT NULL,
+                fin INTEGER NOT NULL,
+                ultimo_usado INTEGER,
+                proceso TEXT NOT NULL,
+                reservado TEXT NOT NULL,
+                liberado TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_folio_bloques_serie ON folio_bloques (emisor_rfc, serie, inicio);
+        """)
+
+    def _key_lock(self, key: FolioKey) -> threading.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._locks.setdefault(key, threading.Lock())
+        return lock
+
+    def _reserve(self, key: FolioKey) -> FolioBlock:
+        """Reserva el siguiente bloque de la serie; BEGIN IMMEDIATE serializa a los demás procesos"""
+        emisor_rfc, serie = key
+        with self._db_lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT siguiente FROM folio_series WHERE emisor_rfc = ? AND serie = ?", key
+                ).fetchone()
+                # nunca por debajo de los folios ya emitidos fuera del asignador
+                inicio = max(row[0] if row else 1, self._seed.get(key, 0) + 1)
+                fin = inicio + self.block_size - 1
+                conn.execute(
+                    "INSERT INTO folio_series (emisor_rfc, serie, siguiente) VALUES (?, ?, ?) "
+                    "ON CONFLICT (emisor_rfc, serie) DO UPDATE SET siguiente = excluded.siguiente",
+                    (emisor_rfc, serie, fin + 1)
+                )
+                cursor = conn.execute(
+                    "INSERT INTO folio_bloques (emisor_rfc, serie, inicio, fin, proceso, reservado) VALUES (?, ?, ?, ?, ?, ?)",
+                    (emisor_rfc, serie, inicio, fin, self._owner, datetime.now().isoformat())
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return FolioBlock(cursor.lastrowid, inicio, fin)
+
+    def next_folio(self, emisor_rfc: str, serie: str) -> int:
+        key = folio_key(emisor_rfc, serie)
+        while True:
+            block = self._blocks.get(key)
+            if block is not None:
+                folio = block.take()
+                if folio is not None:
+                    return folio
+            with self._key_lock(key):
+                # otro hilo pudo haber reservado mientras esperábamos
+                if self._blocks.get(key) is block:
+                    if block is not None:
+                        self._mark_released(block)
+                    self._blocks[key] = self._reserve(key)
+
+    def _mark_released(self, block: FolioBlock) -> None:
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE folio_bloques SET ultimo_usado = ?, liberado = ? WHERE id = ?",
+                (block.ultimo if block.ultimo >= block.inicio else None, datetime.now().isoformat(), block.id)
+            )
+
+    def close(self) -> None:
+        """Registra hasta dónde se usó cada bloque abierto; el resto queda como hueco auditado"""
+        for block in list(self._blocks.values()):
+            self._mark_released(block)
+        self._blocks.clear()
+        with self._db_lock:
+            self._conn.close()
+
+    # ==================== AUDITORÍA ====================
+
+    def audit(self, emisor_rfc: str, serie: str, emitidos: Iterable[Any]) -> Dict[str, Any]:
+        """Auditoría de la serie usando los bloques que este proceso tiene abiertos"""
+        key = folio_key(emisor_rfc, serie)
+        with self._db_lock:
+            rows = self._conn.execute(AUDIT_QUERY, key).fetchall()
+        return audit_report(key, rows, emitidos, self._blocks.values())
+
+
+def audit_report(key: FolioKey, rows: Iterable[Tuple], emitidos: Iterable[Any], open_blocks: Iterable[FolioBlock] = ()) -> Dict[str, Any]:
+    """
+    Compara los folios reservados con los `emitidos` (folios de cfdis_generados):
+    huecos = reservados y no emitidos; fuera_de_bloque = emitidos sin reserva
+    """
+    current_blocks = {block.id: block for block in open_blocks}
+    used = {int(folio) for folio in emitidos if str(folio).isdigit()}
+    reserved = set()
+    bloques = []
+    for block_id, inicio, fin, ultimo_usado, proceso, reservado, liberado in rows:
+        current = current_blocks.get(block_id)
+        # del bloque en uso solo cuenta lo ya asignado
+        limit = current.ultimo if current is not None else fin
+        reserved.update(range(inicio, limit + 1))
+        bloques.append({
+            "id": block_id, "inicio": inicio, "fin": fin, "ultimo_usado": ultimo_usado,
+            "proceso": proceso, "reservado": reservado, "liberado": liberado, "en_uso": current is not None
+        })
+    return {
+        "emisor_rfc": key[0],
+        "serie": key[1],
+        "bloques": bloques,
+        "reservados": len(reserved),
+        "emitidos": len(used),
+        "huecos": compress_ranges(reserved - used),
+        "fuera_de_bloque": compress_ranges(used - reserved)
+    }
+
+
+def audit_series(emisor_rfc: str, serie: str, emitidos: Iterable[Any], path: str = FOLIOS_DB_PATH) -> Dict[str, Any]:
+    """
+    Auditoría leyendo folios.db en modo de solo lectura, sin crear un asignador;
+    los bloques abiertos por otro proceso cuentan completos hasta que se liberan
+    """
+    key = folio_key(emisor_rfc, serie)
+    rows: List[Tuple] = []
+    if os.path.exists(path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+        try:
+            rows = conn.execute(AUDIT_QUERY, key).fetchall()
+        except sqlite3.OperationalError:
+            # folios.db sin tablas: todavía no se ha reservado ningún bloque
+            rows = []
+        finally:
+            conn.close()
+    return audit_report(key, rows, emitidos)
@@ -0,0 +1,154 @@
+"""
+MVP CFDI - Caché HTTP de las rutas de lectura
+ETag fuerte a partir de la versión del almacén, respuestas 304 con If-None-Match
+y Cache-Control por tipo de endpoint. La hora de la respuesta va en el header
+X-Timestamp para que el cuerpo sea idéntico mientras los datos no cambien, y
+así el cuerpo ya codificado (y comprimido) se reutiliza desde la caché de respuestas.
+"""
+
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+from services.cfdi_store import CFDISnapshot, CFDIStore, get_cfdi_store
+from services.compression import MIN_SIZE, choose_encoding, compress_async, strip_variant, variant_etag
+from services.response_cache import encode_json, get_response_cache
+
+# Políticas por tipo de endpoint; los CFDIs requieren token, así que solo el
+# navegador los guarda y siempre los revalida con el ETag
+CACHE_CONTROL = {
+    "catalogos": os.getenv("CFDI_CACHE_CONTROL_CATALOGOS", "public, max-age=3600"),
+    "cfdis": os.getenv("CFDI_CACHE_CONTROL_CFDIS", "private, no-cache")
+}
+
+EXPOSED_HEADERS = ["ETag", "X-Timestamp"]
+
+
+def make_etag(store: CFDIStore, version: int) -> str:
+    return f'"{store.epoch}-{version}"'
+
+
+def matching_etag(if_none_match: Optional[str], etag: str) -> Optional[str]:
+    """
+    ETag de If-None-Match que coincide con `etag` en cualquiera de sus variantes
+    comprimidas; admite una lista, `*` y la forma débil W/"..."
+    """
+    if not if_none_match:
+        return None
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return etag
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if strip_variant(candidate) == etag:
+            return candidate
+    return None
+
+
+def cache_key(request: Request) -> str:
+    return f"{request.url.path}?{request.url.query}"
+
+
+def versioned_headers(policy: str, etag: str) -> Dict[str, str]:
+    return {"Cache-Control": CACHE_CONTROL[policy], "ETag": etag, "X-Timestamp": datetime.now().isoformat()}
+
+
+def not_modified_response(request: Request, policy: str, etag: str) -> Optional[Response]:
+    """
+    Para datos con versión propia (fuera del almacén de CFDIs): 304 si el cliente
+    ya tiene `etag`, antes de consultar nada
+    """
+    not_modified = matching_etag(request.headers.get("if-none-match"), etag)
+    if not_modified:
+        return Response(status_code=304, headers={**versioned_headers(policy, etag), "ETag": not_modified})
+    return None
+
+
+def versioned_response(policy: str, etag: str, content: Dict[str, Any]) -> Response:
+    return Response(content=encode_json(content), media_type="application/json", headers=versioned_headers(policy, etag))
+
+
+@dataclass
+class Conditional:
+    snapshot: CFDISnapshot
+    etag: Optional[str]
+    cache_control: str
+    # ETag que el cliente ya tiene si sigue vigente (304)
+    not_modified: Optional[str]
+    key: str
+    encoding: Optional[str]
+    # 304 o cuerpo ya codificado; None si hay que construir la respuesta
+    hit: Optional[Response] = None
+
+    def headers(self, encoding: Optional[str] = None) -> Dict[str, str]:
+        headers = {
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+            "X-Timestamp": datetime.now().isoformat()
+        }
+        if self.etag:
+            headers["ETag"] = variant_etag(self.etag, encoding) if encoding else self.etag
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return headers
+
+    async def json_response(self, variants: Dict[str, bytes]) -> Response:
+        """
+        Entrega la variante que acepta el cliente; si no está guardada se comprime
+        una sola vez (en un hilo si es grande) y se agrega a la caché
+        """
+        body = variants["identity"]
+        encoding = self.encoding if len(body) >= MIN_SIZE else None
+        if encoding is not None:
+            compressed = variants.get(encoding)
+            if compressed is None:
+                compressed = await compress_async(body, encoding)
+                cache = get_response_cache()
+                if cache is not None and self.etag is not None:
+                    cache.put(self.key, self.etag, compressed, encoding)
+            body = compressed
+        return Response(content=body, media_type="application/json", headers=self.headers(encoding))
+
+    async def respond(self, content: Dict[str, Any]) -> Response:
+        """Codifica el cuerpo una vez y lo guarda para la misma ruta y versión"""
+        body = encode_json(content)
+        cache = get_response_cache()
+        if cache is not None and self.etag is not None:
+            cache.put(self.key, self.etag, body)
+        return await self.json_response({"identity": body})
+
+
+async def conditional_snapshot(request: Request, policy: str) -> Conditional:
+    """
+    La versión se lee antes del snapshot: los datos nunca son más viejos que su
+    ETag. Si el snapshot se recargó a mitad de la lectura se intenta una vez más
+    (ya fresco, es inmediato) y, si sigue cambiando, no se emite ETag.
+    """
+    store = get_cfdi_store()
+    etag = None
+    for _ in range(2):
+        version = store.version
+        snapshot = await store.asnapshot()
+        if store.version == version:
+            etag = make_etag(store, version)
+            break
+    conditional = Conditional(
+        snapshot=snapshot,
+        etag=etag,
+        cache_control=CACHE_CONTROL[policy],
+        not_modified=matching_etag(request.headers.get("if-none-match"), etag) if etag else None,
+        key=cache_key(request),
+        encoding=choose_encoding(request.headers.get("accept-encoding"))
+    )
+    cache = get_response_cache()
+    if conditional.not_modified:
+        conditional.hit = Response(status_code=304, headers={**conditional.headers(), "ETag": conditional.not_modified})
+    elif cache is not None and etag is not None:
+        variants = cache.get(conditional.key, etag)
+        if variants is not None:
+            conditional.hit = await conditional.json_response(variants)
+    return conditional
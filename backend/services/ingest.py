@@ -0,0 +1,196 @@
+"""
+MVP CFDI - Ingesta masiva de XML
+Recibe un directorio o ZIP con XMLs del SAT, los parsea en paralelo con un
+pool de procesos y los inserta por lotes en cfdis_descargados
+"""
+
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from services.cfdi_xml import CFDIParseError, parse_cfdi, to_record
+from services.storage import DATA_DIR
+
+# (ruta del ZIP o None, ruta del archivo o miembro del ZIP)
+Task = Tuple[Optional[str], str]
+
+DEFAULT_BATCH_SIZE = 500
+# por debajo de esto no vale la pena levantar el pool de procesos
+MIN_PARALLEL_FILES = 64
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Pool de procesos con forkserver (spawn donde no existe): los pools se crean desde
+    hilos de un uvicorn con más hilos vivos, y un fork copiaría sus candados tomados
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+# Los trabajos de descarga solo leen rutas dentro de este directorio
+IMPORT_DIR = os.path.realpath(os.getenv("CFDI_IMPORT_DIR", os.path.join(DATA_DIR, "import")))
+
+
+class ImportPathError(ValueError):
+    """Ruta de importación fuera de CFDI_IMPORT_DIR o inexistente"""
+
+
+def resolve_import_path(path: str, root: str = IMPORT_DIR) -> str:
+    """
+    Ruta real (sin symlinks ni ..) de `path` dentro de `root`; las relativas se
+    toman desde `root`. Lanza ImportPathError si queda fuera o no existe
+    """
+    resolved = os.path.realpath(os.path.join(root, path))
+    if resolved != root and not resolved.startswith(root + os.sep):
+        raise ImportPathError(f"La ruta debe estar dentro de {root}")
+    if not os.path.exists(resolved):
+        raise ImportPathError(f"No existe la ruta: {path}")
+    return resolved
+
+
+@dataclass
+class IngestReport:
+    procesados: int = 0
+    insertados: int = 0
+    duplicados: int = 0
+    errores: List[Dict[str, str]] = field(default_factory=list)
+    duracion_segundos: float = 0.0
+
+    def to_dict(self, max_errores: int = 100) -> Dict[str, Any]:
+        return {
+            "procesados": self.procesados,
+            "insertados": self.insertados,
+            "duplicados": self.duplicados,
+            "total_errores": len(self.errores),
+            "errores": self.errores[:max_errores],
+            "duracion_segundos": round(self.duracion_segundos, 3),
+            "archivos_por_segundo": round(self.procesados / self.duracion_segundos, 1) if self.duracion_segundos else None
+        }
+
+
+def iter_tasks(path: str) -> Iterator[Task]:
+    """XMLs de un directorio (recursivo, incluyendo ZIPs dentro) o de un ZIP"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.lower().endswith(".xml"):
+                    yield path, member
+    elif os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                full_path = os.path.join(root, name)
+                if name.lower().endswith(".xml"):
+                    yield None, full_path
+                elif name.lower().endswith(".zip"):
+                    yield from iter_tasks(full_path)
+    elif path.lower().endswith(".xml"):
+        yield None, path
+    else:
+        raise ValueError(f"No es un directorio, ZIP ni XML: {path}")
+
+
+def task_label(task: Task) -> str:
+    container, name = task
+    return f"{os.path.basename(container)}:{name}" if container else name
+
+
+class ZipCache:
+    """ZIPs abiertos para las siguientes tareas del mismo archivo"""
+
+    def __init__(self):
+        self._archives: Dict[str, zipfile.ZipFile] = {}
+
+    def open(self, container: str, name: str) -> IO[bytes]:
+        archive = self._archives.get(container)
+        if archive is None:
+            archive = self._archives[container] = zipfile.ZipFile(container)
+        return archive.open(name)
+
+    def close(self) -> None:
+        for archive in self._archives.values():
+            archive.close()
+        self._archives.clear()
+
+
+# Solo la usan los procesos del pool, que terminan con él; en el proceso de
+# uvicorn cada llamada usa su propia ZipCache y la cierra al terminar
+_worker_zips = ZipCache()
+
+
+def open_task(task: Task, zips: Optional[ZipCache] = None) -> IO[bytes]:
+    """Abre el XML de la tarea; sin `zips` usa la caché del proceso del pool"""
+    container, name = task
+    if container:
+        return (zips or _worker_zips).open(container, name)
+    return open(name, "rb")
+
+
+def parse_task(task: Task, zips: Optional[ZipCache] = None) -> Tuple[str, Optional[Dict[str, Any]], Optional[str]]:
+    """Se ejecuta en los procesos del pool (o en el actual con `zips`); regresa (nombre, registro, error)"""
+    label = task_label(task)
+    try:
+        with open_task(task, zips) as source:
+            return label, to_record(parse_cfdi(source)), None
+    except (CFDIParseError, OSError, KeyError, zipfile.BadZipFile) as e:
+        return label, None, str(e)
+
+
+def ingest(
+    path: str,
+    insert_batch: Callable[[List[Dict[str, Any]]], int],
+    workers: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_progress: Optional[Callable[[IngestReport], None]] = None
+) -> IngestReport:
+    """
+    Parsea todos los XML de `path` y entrega los registros a `insert_batch`
+    en lotes de `batch_size`; `insert_batch` regresa cuántos insertó y el
+    resto se cuenta como duplicados.
+    """
+    started = time.perf_counter()
+    report = IngestReport()
+    tasks = list(iter_tasks(path))
+    workers = workers or int(os.getenv("CFDI_INGEST_WORKERS", "0")) or os.cpu_count() or 1
+
+    def flush_batch(batch: List[Dict[str, Any]]) -> None:
+        inserted = insert_batch(batch)
+        report.insertados += inserted
+        report.duplicados += len(batch) - inserted
+
+    def consume(results) -> None:
+        batch: List[Dict[str, Any]] = []
+        for label, record, error in results:
+            report.procesados += 1
+            if error:
+                report.errores.append({"archivo": label, "error": error})
+            else:
+                batch.append(record)
+            if len(batch) >= batch_size:
+                flush_batch(batch)
+                batch = []
+                if on_progress:
+                    on_progress(report)
+        if batch:
+            flush_batch(batch)
+
+    if workers > 1 and len(tasks) >= MIN_PARALLEL_FILES:
+        chunksize = max(1, min(256, len(tasks) // (workers * 4)))
+        with process_pool(workers) as executor:
+            consume(executor.map(parse_task, tasks, chunksize=chunksize))
+    else:
+        zips = ZipCache()
+        try:
+            consume(parse_task(task, zips) for task in tasks)
+        finally:
+            zips.close()
+
+    report.duracion_segundos = time.perf_counter() - started
+    if on_progress:
+        on_progress(report)
+    return report
@@ -0,0 +1,107 @@
+"""
+MVP CFDI - Eventos de trabajos (Server-Sent Events)
+Difusor en abanico: cada cambio de un trabajo se serializa una sola vez y se
+reparte a las colas asyncio de sus suscriptores con call_soon_threadsafe.
+Un cliente lento pierde avances intermedios, nunca el evento final.
+"""
+
+import asyncio
+import json
+import threading
+from typing import Any, Dict, Optional, Set
+
+from services.jobs import Job, JobQueue
+
+QUEUE_SIZE = 256
+KEEPALIVE_SECONDS = 15
+
+
+def format_event(evento: str, data: Any) -> bytes:
+    return f"event: {evento}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def event_data(job: Job, evento: str, data: Any = None) -> Any:
+    if evento == "progress":
+        return {
+            "id": job.id,
+            "procesados": job.procesados,
+            "total": job.total,
+            "porcentaje": round(job.procesados * 100 / job.total, 1) if job.total else None,
+            "resultado": job.resultado,
+            "total_errores": len(job.errores)
+        }
+    if evento == "batch":
+        return {"id": job.id, "procesados": job.procesados, "items": data}
+    if evento == "done":
+        return job.to_dict()
+    return job.to_dict(max_errores=0)
+
+
+class Subscriber:
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+
+    def deliver(self, message: bytes, final: bool) -> None:
+        """Corre en el event loop del suscriptor"""
+        if self.queue.full():
+            if not final:
+                self.dropped += 1
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait((message, final))
+
+
+class JobBroadcaster:
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, queue: JobQueue) -> None:
+        queue.subscribe(self.publish)
+
+    def subscribe(self, job_id: str) -> Subscriber:
+        subscriber = Subscriber(job_id)
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.job_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[subscriber.job_id]
+
+    def subscriber_count(self, job_id: Optional[str] = None) -> int:
+        with self._lock:
+            if job_id is not None:
+                return len(self._subscribers.get(job_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, job: Job, evento: str, data: Any = None) -> None:
+        """Llamado desde el hilo del trabajo; sin suscriptores no cuesta nada"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(job.id, ()))
+        if not subscribers:
+            return
+        message = format_event(evento, event_data(job, evento, data))
+        final = evento == "done"
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, message, final)
+            except RuntimeError:
+                # el event loop del suscriptor ya se cerró
+                self.unsubscribe(subscriber)
+
+
+job_broadcaster = JobBroadcaster()
+
+
+def get_job_broadcaster() -> JobBroadcaster:
+    return job_broadcaster
@@ -0,0 +1,124 @@
+"""
+MVP CFDI - Trabajos de CFDIs
+Handlers de la cola de trabajos para descarga (ingesta de XMLs), validación
+contra el SAT y generación por lotes. Todos pueden retomarse: la ingesta y la
+validación son idempotentes y la generación continúa desde el último lote timbrado.
+"""
+
+import asyncio
+from typing import Any, Dict
+
+from services.catalogs import validation_catalogs
+from services.cfdi_generation import get_generator
+from services.cfdi_store import get_cfdi_store
+from services.ingest import ingest, iter_tasks, resolve_import_path
+from services.jobs import JobContext, JobQueue
+from services.sat_validation import get_validation_engine, records_to_validate, validate_records
+
+
+def run_download(context: JobContext, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """payload: {"path": directorio o ZIP dentro de CFDI_IMPORT_DIR, "workers": opcional}"""
+    # se revisa otra vez aquí: el trabajo pudo quedar en la base antes de un cambio de CFDI_IMPORT_DIR
+    path = resolve_import_path(payload["path"])
+    store = get_cfdi_store()
+    context.progress(0, total=sum(1 for _ in iter_tasks(path)))
+
+    def insert_batch(batch):
+        insertados, duplicados = store.insert_records("cfdis_descargados", batch)
+        context.batch([{"insertados": insertados, "duplicados": len(duplicados)}])
+        return insertados
+
+    report = ingest(
+        path,
+        insert_batch,
+        workers=payload.get("workers"),
+        on_progress=lambda r: context.progress(r.procesados, insertados=r.insertados, duplicados=r.duplicados)
+    )
+    context.errors(report.errores)
+    result = report.to_dict(max_errores=0)
+    result.pop("errores")
+    return result
+
+
+def run_validate(context: JobContext, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """payload: {"ids": opcional}; consulta el estatus en el SAT y actualiza cfdis_validacion"""
+    store = get_cfdi_store()
+    snapshot = store.snapshot()
+    records = records_to_validate(
+        snapshot.collection("cfdis_descargados"),
+        snapshot.collection("cfdis_validacion"),
+        payload.get("ids")
+    )
+    con_uuid = sum(1 for record in records if record.get("uuid"))
+    context.progress(0, total=con_uuid, omitidos_sin_uuid=len(records) - con_uuid)
+    written = 0
+
+    def write_batch(batch):
+        nonlocal written
+        store.upsert_records("cfdis_validacion", batch)
+        written += len(batch)
+        context.batch([
+            {"id": record.get("id"), "uuid": record.get("uuid"), "estado": record.get("estado"), "estatus_sat": record.get("estatus_sat")}
+            for record in batch
+        ])
+        context.progress(written)
+
+    engine = get_validation_engine()
+    counts, results = asyncio.run(validate_records(records, write_batch, engine))
+    return {
+        "simulado": engine.transport.simulated,
+        "consultados": len(results),
+        "desde_cache": sum(1 for result in results if result.cached),
+        "por_estado": counts
+    }
+
+
+def run_generate(context: JobContext, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    payload: {"comprobantes": [...]}; al retomarse continúa desde job.procesados y omite
+    los comprobantes que ya se timbraron después del último checkpoint
+    """
+    store = get_cfdi_store()
+    snapshot = store.snapshot()
+    payloads = payload["comprobantes"]
+    start = context.job.procesados
+    previous = context.job.resultado.get("timbrados", 0)
+    generados = snapshot.collection("cfdis_generados")
+    generator = get_generator(lambda: generados)
+    stamped = {
+        record["indice"]
+        for record in map(generados.get, generados.lookup("trabajo", context.job.id))
+        if record is not None and record.get("indice", -1) >= start
+    }
+    previous += len(stamped)
+
+    def on_progress(procesados, timbrados, errores):
+        for error in errores[len(context.job.errores) - base_errors:]:
+            context.error(**error)
+        context.progress(start + procesados, total=len(payloads), checkpoint=True, timbrados=previous + timbrados)
+
+    def insert_batch(batch):
+        store.insert_records("cfdis_generados", batch)
+        context.batch([
+            {"id": record.get("id"), "uuid": record.get("uuid"), "serie": record.get("serie"), "folio": record.get("folio"), "total": record.get("total")}
+            for record in batch
+        ])
+
+    base_errors = len(context.job.errores)
+    timbrados, errores = generator.generate(
+        payloads,
+        validation_catalogs(snapshot.data.get("catalogos_sat", {})),
+        insert_batch,
+        on_progress=on_progress,
+        start=start,
+        skip=stamped,
+        trabajo=context.job.id
+    )
+    on_progress(len(payloads) - start, timbrados, errores)
+    return {"timbrados": previous + timbrados, "rechazados": len(context.job.errores)}
+
+
+def register_handlers(queue: JobQueue) -> None:
+    queue.register("download", run_download, workers=1)
+    queue.register("validate", run_validate, workers=1)
+    queue.register("generate", run_generate, workers=2)
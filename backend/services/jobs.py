@@ -0,0 +1,373 @@
+"""
+MVP CFDI - Trabajos en segundo plano
+Cola de trabajos persistida en SQLite (data/jobs.db) con un pool de hilos por
+tipo de trabajo. Los trabajos sobreviven reinicios: al iniciar se retoman los
+pendientes y los que quedaron a medias en un proceso que ya no existe.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.storage import DATA_DIR
+
+JOBS_DB_PATH = os.getenv("CFDI_JOBS_DB", os.path.join(DATA_DIR, "jobs.db"))
+DEFAULT_WORKERS = 2
+MAX_ERRORES = 1000
+# el avance se persiste a lo más cada PROGRESS_INTERVAL segundos por trabajo
+PROGRESS_INTERVAL = 0.5
+
+ESTADOS = ("pendiente", "en_proceso", "completado", "error", "cancelado")
+TERMINALES = {"completado", "error", "cancelado"}
+
+
+def now() -> str:
+    return datetime.now().isoformat()
+
+
+class JobCancelled(Exception):
+    """El trabajo se canceló mientras corría"""
+
+
+class JobInterrupted(Exception):
+    """El proceso se está deteniendo; el trabajo vuelve a pendiente y se retoma al reiniciar"""
+
+
+@dataclass
+class Job:
+    id: str
+    tipo: str
+    total: int = 0
+    estado: str = "pendiente"
+    procesados: int = 0
+    resultado: Dict[str, Any] = field(default_factory=dict)
+    errores: List[Dict[str, Any]] = field(default_factory=list)
+    cancelar: bool = False
+    proceso: Optional[str] = None
+    intentos: int = 0
+    creado: str = field(default_factory=now)
+    actualizado: str = field(default_factory=now)
+
+    def to_dict(self, max_errores: int = 100) -> Dict[str, Any]:
+        data = asdict(self)
+        data["total_errores"] = len(self.errores)
+        data["errores"] = self.errores[:max_errores]
+        data["porcentaje"] = round(self.procesados * 100 / self.total, 1) if self.total else None
+        return data
+
+
+class JobContext:
+    """Lo que recibe el handler para reportar avance, resultados parciales y errores"""
+
+    def __init__(self, queue: "JobQueue", job: Job):
+        self._queue = queue
+        self.job = job
+        self._saved = 0.0
+
+    def check_cancelled(self) -> None:
+        if self.job.cancelar:
+            raise JobCancelled()
+        if self._queue._stopping:
+            raise JobInterrupted()
+
+    def progress(self, procesados: int, total: Optional[int] = None, checkpoint: bool = False, **resultado: Any) -> None:
+        """
+        Actualiza el avance y los resultados parciales; lanza JobCancelled si se pidió cancelar.
+        Con `checkpoint` se persiste de inmediato: un trabajo retomado continúa desde job.procesados.
+        """
+        self.job.procesados = procesados
+        if total is not None:
+            self.job.total = total
+        self.job.resultado.update(resultado)
+        self.job.actualizado = now()
+        if checkpoint or time.monotonic() - self._saved >= PROGRESS_INTERVAL:
+            self._saved = time.monotonic()
+            self._queue._save(self.job)
+            # la cancelación puede venir de otro worker de uvicorn
+            self.job.cancelar = self.job.cancelar or self._queue._cancel_requested(self.job.id)
+        self._queue._notify(self.job, "progress")
+        self.check_cancelled()
+
+    def batch(self, items: List[Dict[str, Any]]) -> None:
+        """Resultados de un lote para quien siga el trabajo en vivo; no se persisten"""
+        self._queue._notify(self.job, "batch", items)
+
+    def error(self, **error: Any) -> None:
+        if len(self.job.errores) < MAX_ERRORES:
+            self.job.errores.append(error)
+
+    def errors(self, errors: List[Dict[str, Any]]) -> None:
+        for error in errors:
+            self.error(**error)
+
+
+Handler = Callable[[JobContext, Dict[str, Any]], Optional[Dict[str, Any]]]
+Listener = Callable[[Job, str, Any], None]
+
+
+def process_alive(owner: Optional[str]) -> bool:
+    """Solo se puede saber de procesos del mismo host; los de otro host se asumen vivos"""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+
+    def __init__(self, path: str = JOBS_DB_PATH, limits: Optional[Dict[str, int]] = None):
+        self.path = path
+        self.limits = limits or {}
+        self._handlers: Dict[str, Handler] = {}
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._running: Dict[str, Job] = {}
+        self._listeners: List[Listener] = []
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+        # la base se abre con el primer uso, no al importar el módulo
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connect_lock = threading.Lock()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._connection is None:
+            with self._connect_lock:
+                if self._connection is None:
+                    self._connection = self._open()
+        return self._connection
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                tipo TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                procesados INTEGER NOT NULL DEFAULT 0,
+                resultado TEXT NOT NULL DEFAULT '{}',
+                errores TEXT NOT NULL DEFAULT '[]',
+                cancelar INTEGER NOT NULL DEFAULT 0,
+                proceso TEXT,
+                intentos INTEGER NOT NULL DEFAULT 0,
+                creado TEXT NOT NULL,
+                actualizado TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_estado ON jobs (estado, creado);
+        """)
+        return conn
+
+    # ==================== REGISTRO ====================
+
+    def register(self, tipo: str, handler: Handler, workers: Optional[int] = None) -> None:
+        """`workers`: trabajos de este tipo en paralelo (CFDI_JOB_WORKERS_<TIPO> tiene prioridad)"""
+        limit = int(os.getenv(f"CFDI_JOB_WORKERS_{tipo.upper()}", "0")) or self.limits.get(tipo) or workers or DEFAULT_WORKERS
+        self.limits[tipo] = limit
+        self._handlers[tipo] = handler
+        self._executors[tipo] = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"job-{tipo}")
+
+    def tipos(self) -> List[str]:
+        return list(self._handlers)
+
+    def subscribe(self, listener: "Listener") -> Callable[[], None]:
+        """
+        `listener(job, evento, datos)` se llama en el hilo del trabajo con evento
+        estado | progress | batch | done; regresa la función para desuscribirse
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
+        return unsubscribe
+
+    def _notify(self, job: Job, evento: str, data: Any = None) -> None:
+        for listener in list(self._listeners):
+            listener(job, evento, data)
+
+    # ==================== PERSISTENCIA ====================
+
+    def _row_to_job(self, row) -> Job:
+        (job_id, tipo, estado, total, procesados, resultado, errores, cancelar, proceso, intentos, creado, actualizado) = row
+        return Job(
+            id=job_id, tipo=tipo, estado=estado, total=total, procesados=procesados,
+            resultado=json.loads(resultado), errores=json.loads(errores), cancelar=bool(cancelar),
+            proceso=proceso, intentos=intentos, creado=creado, actualizado=actualizado
+        )
+
+    def _save(self, job: Job) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET estado = ?, total = ?, procesados = ?, resultado = ?, errores = ?, "
+                "actualizado = ? WHERE id = ?",
+                (job.estado, job.total, job.procesados, json.dumps(job.resultado, ensure_ascii=False),
+                 json.dumps(job.errores, ensure_ascii=False), job.actualizado, job.id)
+            )
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT cancelar FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def _claim(self, job_id: str) -> Optional[Tuple[Job, Dict[str, Any]]]:
+        """Toma un trabajo pendiente de forma atómica (otro worker de uvicorn pudo tomarlo antes)"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET estado = 'en_proceso', proceso = ?, intentos = intentos + 1, actualizado = ? "
+                "WHERE id = ? AND estado = 'pendiente'",
+                (self._owner, now(), job_id)
+            )
+            if cursor.rowcount != 1:
+                return None
+            row = self._conn.execute(
+                "SELECT id, tipo, estado, total, procesados, resultado, errores, cancelar, proceso, intentos, "
+                "creado, actualizado, payload FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row[:-1]), json.loads(row[-1])
+
+    # ==================== API ====================
+
+    def submit(self, tipo: str, payload: Dict[str, Any], total: int = 0) -> Job:
+        if tipo not in self._handlers:
+            raise ValueError(f"Tipo de trabajo no soportado: {tipo}")
+        job = Job(id=str(uuid.uuid4()), tipo=tipo, total=total)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, tipo, estado, payload, total, creado, actualizado) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job.id, tipo, job.estado, json.dumps(payload, ensure_ascii=False), total, job.creado, job.actualizado)
+            )
+        self._executors[tipo].submit(self._run, job.id)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._running.get(job_id)
+        if job is not None:
+            return job
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, tipo, estado, total, procesados, resultado, errores, cancelar, proceso, intentos, "
+                "creado, actualizado FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list(self, tipo: Optional[str] = None, estado: Optional[str] = None, limit: int = 100) -> List[Job]:
+        query = ("SELECT id, tipo, estado, total, procesados, '{}', '[]', cancelar, proceso, intentos, creado, actualizado "
+                 "FROM jobs WHERE (? IS NULL OR tipo = ?) AND (? IS NULL OR estado = ?) ORDER BY creado DESC LIMIT ?")
+        with self._lock:
+            rows = self._conn.execute(query, (tipo, tipo, estado, estado, limit)).fetchall()
+        return [self._running.get(row[0]) or self._row_to_job(row) for row in rows]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Un trabajo pendiente se cancela de inmediato; uno en proceso al siguiente reporte de avance"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET estado = CASE WHEN estado = 'pendiente' THEN 'cancelado' ELSE estado END, "
+                "cancelar = 1, actualizado = ? WHERE id = ? AND estado IN ('pendiente', 'en_proceso')",
+                (now(), job_id)
+            )
+        job = self._running.get(job_id)
+        if job is not None:
+            job.cancelar = True
+            return job
+        job = self.get(job_id)
+        if job is not None and job.estado == "cancelado":
+            self._notify(job, "done")
+        return job
+
+    def recover(self) -> int:
+        """Reencola los pendientes y los en_proceso de procesos muertos; regresa cuántos"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, tipo, estado, proceso FROM jobs WHERE estado IN ('pendiente', 'en_proceso') ORDER BY creado"
+            ).fetchall()
+        recovered = 0
+        for job_id, tipo, estado, proceso in rows:
+            if tipo not in self._handlers:
+                continue
+            if estado == "en_proceso":
+                if process_alive(proceso):
+                    continue
+                with self._lock:
+                    self._conn.execute(
+                        "UPDATE jobs SET estado = 'pendiente', actualizado = ? WHERE id = ? AND estado = 'en_proceso'",
+                        (now(), job_id)
+                    )
+            self._executors[tipo].submit(self._run, job_id)
+            recovered += 1
+        return recovered
+
+    def _run(self, job_id: str) -> None:
+        claimed = self._claim(job_id)
+        if claimed is None:
+            return
+        job, payload = claimed
+        self._running[job.id] = job
+        self._notify(job, "estado")
+        try:
+            context = JobContext(self, job)
+            if job.cancelar:
+                raise JobCancelled()
+            result = self._handlers[job.tipo](context, payload)
+            if result:
+                job.resultado.update(result)
+            job.estado = "completado"
+        except JobCancelled:
+            job.estado = "cancelado"
+        except JobInterrupted:
+            job.estado = "pendiente"
+        except Exception as e:
+            job.estado = "error"
+            job.errores.append({"error": str(e)})
+        finally:
+            job.actualizado = now()
+            self._save(job)
+            self._running.pop(job.id, None)
+            self._notify(job, "estado" if job.estado == "pendiente" else "done")
+
+    def shutdown(self) -> None:
+        """Los trabajos en curso se interrumpen en su siguiente reporte de avance y, con los pendientes, se retoman al reiniciar"""
+        self._stopping = True
+        for executor in self._executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+        with self._connect_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def parse_limits(value: str) -> Dict[str, int]:
+    """"generate=2,validate=1" -> {"generate": 2, "validate": 1}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        tipo, _, limit = item.partition("=")
+        limits[tipo.strip()] = int(limit)
+    return limits
+
+
+job_queue = JobQueue(limits=parse_limits(os.getenv("CFDI_JOB_LIMITS", "")))
+
+
+def get_job_queue() -> JobQueue:
+    return job_queue
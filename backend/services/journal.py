@@ -0,0 +1,181 @@
+"""
+MVP CFDI - Journal de escritura diferida
+Las mutaciones se agregan a un journal NDJSON en lotes (un fsync por lote) y
+periódicamente se compactan a un snapshot escrito con temp + fsync + rename
+"""
+
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+Entry = Tuple[str, Dict[str, Any]]
+
+
+def fsync_directory(path: str) -> None:
+    """Persiste el rename en el directorio (no disponible en Windows)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path: str, data: Any) -> None:
+    """Escribe a un archivo temporal, hace fsync y lo renombra sobre `path`"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        try:
+            os.chmod(temp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(temp_path, 0o644)
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=2, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    fsync_directory(directory)
+
+
+def read_journal(path: str) -> Iterator[Entry]:
+    """Entradas (colección, registro) en orden; ignora una última línea truncada por un crash"""
+    try:
+        file = open(path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with file:
+        for line in file:
+            if not line.endswith("\n"):
+                break
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            yield entry["c"], entry["r"]
+
+
+class WriteBehindJournal:
+    """
+    Cola de mutaciones con un hilo que las escribe al journal en lotes.
+    Dentro de un lote, varias escrituras del mismo (colección, id) se reducen a la última.
+    Cada `compact_every` entradas el journal se vuelca al snapshot con
+    `snapshot_provider()` y se trunca.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        snapshot_path: str,
+        snapshot_provider: Callable[[], Dict[str, Any]],
+        flush_interval: float = 0.05,
+        compact_every: int = 1000,
+        on_write: Optional[Callable[[], None]] = None
+    ):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.snapshot_provider = snapshot_provider
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self.on_write = on_write
+        self.io_lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._condition = threading.Condition()
+        # entradas en el journal que el dueño ya tiene aplicadas (ver load())
+        self.entries = 0
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def append(self, collection: str, records: List[Dict[str, Any]]) -> None:
+        with self._condition:
+            for record in records:
+                self._pending[(collection, record["id"])] = record
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="cfdi-journal", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed and not self._pending:
+                    return
+            # deja acumular un lote antes de escribir
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed, timeout=self.flush_interval)
+            self.flush()
+
+    def _take_pending(self) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        with self._condition:
+            pending, self._pending = self._pending, {}
+            return pending
+
+    def flush(self) -> None:
+        """Escribe las mutaciones pendientes con un solo fsync y compacta si corresponde"""
+        with self.io_lock:
+            pending = self._take_pending()
+            if pending:
+                lines = "".join(
+                    json.dumps({"c": collection, "r": record}, ensure_ascii=False) + "\n"
+                    for (collection, _), record in pending.items()
+                )
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(lines)
+                    file.flush()
+                    os.fsync(file.fileno())
+                self.entries += len(pending)
+            if pending and self.entries >= self.compact_every:
+                self._compact()
+            if pending and self.on_write:
+                self.on_write()
+
+    def _compact(self) -> None:
+        atomic_write_json(self.snapshot_path, self.snapshot_provider())
+        # si hay un crash antes de truncar, el replay repite upserts idempotentes
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.flush()
+            os.fsync(file.fileno())
+        self.entries = 0
+        if self.on_write:
+            self.on_write()
+
+    def compact(self) -> None:
+        """Vuelca el estado actual al snapshot si hay algo en el journal o pendiente"""
+        with self.io_lock:
+            pending = self._take_pending()
+            if pending or self.entries:
+                self._compact()
+
+    def replace_snapshot(self, data: Dict[str, Any]) -> None:
+        """Reemplaza el snapshot completo y vacía el journal (y lo pendiente)"""
+        with self.io_lock:
+            self._take_pending()
+            atomic_write_json(self.snapshot_path, data)
+            with open(self.path, 'w', encoding='utf-8') as file:
+                file.flush()
+                os.fsync(file.fileno())
+            self.entries = 0
+            if self.on_write:
+                self.on_write()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.compact()
@@ -0,0 +1,54 @@
+"""
+MVP CFDI - Paginación por cursor y proyección de campos
+El cursor es opaco para el cliente: codifica la llave (fecha, id) del último registro entregado
+"""
+
+import base64
+import binascii
+import json
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+SortKey = Tuple[str, str]
+
+
+class CursorError(ValueError):
+    """Cursor malformado o de otra versión"""
+
+
+def sort_key(record: Dict[str, Any]) -> SortKey:
+    return (record.get("fecha") or "", record.get("id") or "")
+
+
+def encode_cursor(key: SortKey) -> str:
+    raw = json.dumps(list(key), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str) -> SortKey:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        fecha, record_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return str(fecha), str(record_id)
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise CursorError("Cursor inválido")
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Convierte 'fecha,total' en una tupla de campos; siempre incluye 'id'"""
+    if not fields:
+        return None
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    if not requested:
+        return None
+    if "id" not in requested:
+        requested.insert(0, "id")
+    return tuple(dict.fromkeys(requested))
+
+
+def project(record: Dict[str, Any], fields: Optional[Tuple[str, ...]]) -> Dict[str, Any]:
+    if fields is None:
+        return record
+    return {name: record[name] for name in fields if name in record}
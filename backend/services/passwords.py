@@ -0,0 +1,84 @@
+"""
+MVP CFDI - Hash de contraseñas
+bcrypt (passlib) cuesta ~100-300 ms por verificación, así que corre en un pool
+de hilos dedicado y acotado, fuera del event loop; bcrypt libera el GIL y las
+demás peticiones siguen atendiéndose. Si hay demasiadas verificaciones en
+espera se rechaza de inmediato (503) en lugar de encolar sin límite.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from passlib.context import CryptContext
+
+ROUNDS = int(os.getenv("CFDI_BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.getenv("CFDI_AUTH_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# verificaciones en espera además de las que están corriendo
+HASH_QUEUE = int(os.getenv("CFDI_AUTH_HASH_QUEUE", 32))
+
+pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=ROUNDS)
+
+
+class HashPoolBusy(Exception):
+    """La cola de verificaciones está llena"""
+
+
+class HashPool:
+
+    def __init__(self, workers: int = HASH_WORKERS, queue_size: int = HASH_QUEUE):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def run(self, function, *args):
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.rejected += 1
+                raise HashPoolBusy(f"{self.in_flight} verificaciones en curso")
+            self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), function, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self.run(pwd_context.verify, password, hashed)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(pwd_context.hash, password)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "capacidad": self.capacity,
+            "en_curso": self.in_flight,
+            "completadas": self.completed,
+            "rechazadas": self.rejected
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hash_pool = HashPool()
+
+
+def get_hash_pool() -> HashPool:
+    return hash_pool
@@ -0,0 +1,190 @@
+"""
+MVP CFDI - Cuotas por tenant
+Token bucket por tenant (usuario del token o IP si no hay token) con dos
+presupuestos: lecturas baratas y operaciones masivas (ingesta, validación,
+generación, exportación, trabajos). El middleware corre en el hilo del event
+loop, así que los buckets se actualizan sin candados: un dict, una resta y una
+comparación por petición. El tenant sale de TokenManager.peek(), que tampoco
+toma el candado del gestor de tokens.
+"""
+
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from services.auth_tokens import get_token_manager
+
+# clase -> "<peticiones por segundo>/<ráfaga>"
+DEFAULT_QUOTAS = {
+    "read": "20/40",
+    "bulk": "0.1/5"
+}
+DEFAULT_MAX_TENANTS = 10_000
+
+# (método, ruta) de las operaciones masivas
+BULK_ROUTES = [
+    ("POST", re.compile(r"^/api/cfdis/download/ingest$")),
+    ("POST", re.compile(r"^/api/cfdis/validate/(run|crypto)$")),
+    ("POST", re.compile(r"^/api/cfdis/generate/batch$")),
+    ("GET", re.compile(r"^/api/cfdis/[^/]+/export$")),
+    ("POST", re.compile(r"^/api/jobs$"))
+]
+# tienen su propio límite de intentos
+EXEMPT_PATHS = {"/api/auth/login"}
+
+
+def parse_quotas(raw: Optional[str] = None) -> Dict[str, Tuple[float, float]]:
+    """CFDI_QUOTAS="read=20/40,bulk=0.1/5"; una tasa 0 desactiva la clase"""
+    specs = dict(DEFAULT_QUOTAS)
+    raw = raw if raw is not None else os.getenv("CFDI_QUOTAS", "")
+    for item in raw.split(","):
+        name, _, spec = item.strip().partition("=")
+        if name and spec:
+            specs[name.strip()] = spec.strip()
+    quotas = {}
+    for name, spec in specs.items():
+        rate, _, burst = spec.partition("/")
+        quotas[name] = (float(rate), float(burst or max(float(rate), 1)))
+    return quotas
+
+
+def classify(method: str, path: str) -> str:
+    for route_method, pattern in BULK_ROUTES:
+        if method == route_method and pattern.match(path):
+            return "bulk"
+    return "read"
+
+
+class TenantUsage:
+    """Buckets y contadores de un tenant"""
+
+    __slots__ = ("tokens", "updated", "requests", "rejected", "last_seen")
+
+    def __init__(self, quotas: Dict[str, Tuple[float, float]], now: float):
+        self.tokens = {kind: burst for kind, (_, burst) in quotas.items()}
+        self.updated = {kind: now for kind in quotas}
+        self.requests = {kind: 0 for kind in quotas}
+        self.rejected = {kind: 0 for kind in quotas}
+        self.last_seen = now
+
+    def to_dict(self, quotas: Dict[str, Tuple[float, float]], now: float) -> Dict[str, Any]:
+        return {
+            kind: {
+                "peticiones": self.requests[kind],
+                "rechazadas": self.rejected[kind],
+                "disponibles": round(min(burst, self.tokens[kind] + (now - self.updated[kind]) * rate), 2),
+                "tasa_por_segundo": rate,
+                "rafaga": burst
+            }
+            for kind, (rate, burst) in quotas.items()
+        } | {"ultima_peticion_hace_s": round(now - self.last_seen, 1)}
+
+
+class TenantQuotas:
+    """Solo se usa desde el event loop; no es seguro entre hilos"""
+
+    def __init__(self, quotas: Dict[str, Tuple[float, float]], max_tenants: int = DEFAULT_MAX_TENANTS):
+        self.quotas = quotas
+        self.max_tenants = max_tenants
+        self._tenants: "OrderedDict[str, TenantUsage]" = OrderedDict()
+
+    def take(self, tenant: str, kind: str) -> Optional[float]:
+        """Consume un token; regresa None o los segundos hasta que haya uno"""
+        rate, burst = self.quotas.get(kind, (0, 0))
+        now = time.monotonic()
+        usage = self._tenants.get(tenant)
+        if usage is None:
+            usage = self._tenants[tenant] = TenantUsage(self.quotas, now)
+            if len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+        else:
+            self._tenants.move_to_end(tenant)
+        usage.last_seen = now
+        if rate <= 0:
+            usage.requests[kind] = usage.requests.get(kind, 0) + 1
+            return None
+        tokens = min(burst, usage.tokens[kind] + (now - usage.updated[kind]) * rate)
+        usage.updated[kind] = now
+        if tokens < 1:
+            usage.tokens[kind] = tokens
+            usage.rejected[kind] += 1
+            return (1 - tokens) / rate
+        usage.tokens[kind] = tokens - 1
+        usage.requests[kind] += 1
+        return None
+
+    def usage(self, tenant: Optional[str] = None) -> Dict[str, Any]:
+        now = time.monotonic()
+        if tenant is not None:
+            usage = self._tenants.get(tenant)
+            return {tenant: usage.to_dict(self.quotas, now)} if usage else {}
+        return {name: usage.to_dict(self.quotas, now) for name, usage in self._tenants.items()}
+
+
+def tenant_for(scope: Scope) -> str:
+    """
+    Usuario (o tenant) del token; sin token válido, la IP. Como get_stream_user,
+    acepta ?access_token= para que los clientes SSE se cobren a su tenant
+    """
+    authorization = Headers(scope=scope).get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        token = QueryParams(scope.get("query_string", b"")).get("access_token", "")
+    claims = get_token_manager().peek(token) if token else None
+    if claims is not None:
+        return f"user:{claims.get('tenant') or claims['sub']}"
+    client = scope.get("client")
+    return f"ip:{client[0] if client else ''}"
+
+
+class QuotaMiddleware:
+
+    def __init__(self, app: ASGIApp, quotas: Optional[TenantQuotas] = None):
+        self.app = app
+        self.quotas = quotas or get_tenant_quotas()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope.get("path", "")
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not path.startswith("/api/") or path in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        kind = classify(scope["method"], path)
+        wait = self.quotas.take(tenant_for(scope), kind)
+        if wait is None:
+            await self.app(scope, receive, send)
+            return
+        retry_after = max(1, math.ceil(wait))
+        response = JSONResponse(
+            status_code=429,
+            content={
+                "success": False,
+                "message": "Cuota de peticiones excedida" if kind == "read" else "Cuota de operaciones masivas excedida",
+                "error": "429 Too Many Requests",
+                "cuota": kind,
+                "retry_after": retry_after,
+                "timestamp": datetime.now().isoformat()
+            },
+            headers={"Retry-After": str(retry_after)}
+        )
+        await response(scope, receive, send)
+
+
+_tenant_quotas: Optional[TenantQuotas] = None
+
+
+def get_tenant_quotas() -> TenantQuotas:
+    global _tenant_quotas
+    if _tenant_quotas is None:
+        _tenant_quotas = TenantQuotas(
+            parse_quotas(),
+            int(os.getenv("CFDI_QUOTA_MAX_TENANTS", DEFAULT_MAX_TENANTS))
+        )
+    return _tenant_quotas
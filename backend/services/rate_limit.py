@@ -0,0 +1,250 @@
+"""
+MVP CFDI - Límite de intentos (ventana deslizante)
+Cada llave (ruta + alcance + identidad, p. ej. "login:ip:10.0.0.1") guarda solo
+dos contadores: la ventana fija actual y la anterior. El conteo deslizante es
+anterior * (fracción de ventana que falta) + actual, así que la memoria por llave
+es constante. El backend en memoria es un LRU acotado; el de SQLite comparte los
+contadores entre workers de uvicorn en el mismo equipo.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from services.storage import DATA_DIR
+
+RATE_LIMIT_DB_PATH = os.getenv("CFDI_RATE_LIMIT_DB", os.path.join(DATA_DIR, "rate_limit.db"))
+DEFAULT_MAX_KEYS = 100_000
+
+# "<ruta>.<alcance>" -> "<intentos>/<segundos>"
+DEFAULT_LIMITS = {
+    "login.ip": "20/60",
+    "login.user": "5/300"
+}
+
+
+class RateLimited(Exception):
+
+    def __init__(self, rule: "RateLimitRule", retry_after: float):
+        super().__init__(f"Límite {rule.name} excedido")
+        self.rule = rule
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    name: str
+    limit: int
+    window: float
+
+
+def parse_limits(raw: Optional[str] = None) -> Dict[str, RateLimitRule]:
+    """CFDI_RATE_LIMITS="login.ip=20/60,login.user=5/300"; un límite 0 desactiva la regla"""
+    specs = dict(DEFAULT_LIMITS)
+    raw = raw if raw is not None else os.getenv("CFDI_RATE_LIMITS", "")
+    for item in raw.split(","):
+        name, _, spec = item.strip().partition("=")
+        if name and spec:
+            specs[name.strip()] = spec.strip()
+    rules = {}
+    for name, spec in specs.items():
+        limit, _, window = spec.partition("/")
+        rules[name] = RateLimitRule(name, int(limit), float(window or 60))
+    return rules
+
+
+def sliding_count(previous: int, current: int, elapsed: float, window: float) -> float:
+    return previous * (1 - elapsed / window) + current
+
+
+def is_full(previous: int, current: int, elapsed: float, rule: "RateLimitRule") -> bool:
+    """Un intento más excedería el límite"""
+    return sliding_count(previous, current, elapsed, rule.window) + 1 > rule.limit
+
+
+def retry_after(previous: int, current: int, elapsed: float, window: float, limit: int) -> float:
+    """Segundos hasta que el conteo deslizante vuelva a quedar por debajo del límite"""
+    if current >= limit:
+        # la ventana actual pasa a ser la anterior y luego se desvanece
+        return (window - elapsed) + window * (1 - (limit - 1) / current)
+    # solo falta que se desvanezca la anterior: previous * (1 - t / window) <= limit - 1 - current
+    target = window * (1 - (limit - 1 - current) / previous) if previous else 0
+    return max(target - elapsed, 0)
+
+
+class RateLimitBackend(ABC):
+
+    @abstractmethod
+    def hit(self, key: str, rule: RateLimitRule, cost: int = 1) -> Optional[float]:
+        """Suma `cost` si cabe en el límite; regresa None o los segundos a esperar"""
+
+    def peek(self, key: str, rule: RateLimitRule) -> Optional[float]:
+        """Igual que hit() pero sin contar el intento"""
+        return self.hit(key, rule, cost=0)
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
+def _advance(window_start: float, previous: int, current: int, now: float, window: float) -> Tuple[float, int, int]:
+    start = now - (now % window)
+    if abs(start - window_start) < 1e-6:
+        return window_start, previous, current
+    if abs(start - window_start - window) < 1e-6:
+        return start, current, 0
+    return start, 0, 0
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+
+    def __init__(self, max_keys: int = DEFAULT_MAX_KEYS):
+        self.max_keys = max_keys
+        # llave -> [inicio de la ventana actual, conteo anterior, conteo actual]
+        self._counters: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def hit(self, key: str, rule: RateLimitRule, cost: int = 1) -> Optional[float]:
+        now = time.time()
+        with self._lock:
+            counter = self._counters.get(key)
+            window_start, previous, current = _advance(*(counter or (0.0, 0, 0)), now, rule.window)
+            elapsed = now - window_start
+            if is_full(previous, current, elapsed, rule):
+                return retry_after(previous, current, elapsed, rule.window, rule.limit)
+            if not cost:
+                return None
+            self._counters[key] = [window_start, previous, current + cost]
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+                self.evictions += 1
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {"llaves": len(self._counters), "max_llaves": self.max_keys, "desalojos": self.evictions}
+
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """Contadores compartidos entre procesos; cada intento es una transacción BEGIN IMMEDIATE"""
+
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, path: str = RATE_LIMIT_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit (
+                key TEXT PRIMARY KEY,
+                window_start REAL NOT NULL,
+                previous INTEGER NOT NULL,
+                current INTEGER NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+
+    def hit(self, key: str, rule: RateLimitRule, cost: int = 1) -> Optional[float]:
+        now = time.time()
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT window_start, previous, current FROM rate_limit WHERE key = ?", (key,)
+                ).fetchone()
+                window_start, previous, current = _advance(*(row or (0.0, 0, 0)), now, rule.window)
+                elapsed = now - window_start
+                if is_full(previous, current, elapsed, rule):
+                    conn.execute("COMMIT")
+                    return retry_after(previous, current, elapsed, rule.window, rule.limit)
+                if cost:
+                    conn.execute(
+                        "INSERT INTO rate_limit (key, window_start, previous, current, expires) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT (key) DO UPDATE SET window_start = excluded.window_start, "
+                        "previous = excluded.previous, current = excluded.current, expires = excluded.expires",
+                        (key, window_start, previous, current + cost, window_start + 2 * rule.window)
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._hits += 1
+            if self._hits % self.CLEANUP_EVERY == 0:
+                conn.execute("DELETE FROM rate_limit WHERE expires < ?", (now,))
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"llaves": self._conn.execute("SELECT COUNT(*) FROM rate_limit").fetchone()[0]}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_backend() -> RateLimitBackend:
+    """CFDI_RATE_LIMIT_BACKEND: memory (default) o sqlite para varios workers"""
+    kind = os.getenv("CFDI_RATE_LIMIT_BACKEND", "memory").lower()
+    if kind == "sqlite":
+        return SQLiteRateLimitBackend()
+    if kind != "memory":
+        raise ValueError(f"Backend de límite de intentos no soportado: {kind}")
+    return MemoryRateLimitBackend(int(os.getenv("CFDI_RATE_LIMIT_MAX_KEYS", DEFAULT_MAX_KEYS)))
+
+
+class RateLimiter:
+
+    def __init__(self, backend: RateLimitBackend, rules: Dict[str, RateLimitRule]):
+        self.backend = backend
+        self.rules = rules
+        self.rejected = 0
+
+    def _apply(self, route: str, scope: str, identity: str, cost: int) -> None:
+        rule = self.rules.get(f"{route}.{scope}")
+        if rule is None or rule.limit <= 0 or not identity:
+            return
+        wait = self.backend.hit(f"{route}:{scope}:{identity}", rule, cost)
+        if wait is not None:
+            self.rejected += 1
+            raise RateLimited(rule, wait)
+
+    def hit(self, route: str, scope: str, identity: str) -> None:
+        """Cuenta el intento; lanza RateLimited si ya no cabe"""
+        self._apply(route, scope, identity, 1)
+
+    def check(self, route: str, scope: str, identity: str) -> None:
+        """Lanza RateLimited si la llave ya agotó su límite, sin contar el intento"""
+        self._apply(route, scope, identity, 0)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "reglas": {name: f"{rule.limit}/{rule.window:g}s" for name, rule in self.rules.items()},
+            "rechazados": self.rejected,
+            **self.backend.stats()
+        }
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter(create_backend(), parse_limits())
+    return _rate_limiter
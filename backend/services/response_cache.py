@@ -0,0 +1,134 @@
+"""
+MVP CFDI - Caché de respuestas serializadas
+Guarda los bytes JSON ya codificados por ruta + query y versión del almacén;
+un acierto se entrega tal cual, sin pasar por jsonable_encoder ni json.dumps.
+Usa orjson cuando está instalado. Junto a los bytes originales ("identity") se
+guardan las variantes gzip/br ya comprimidas. LRU acotado por memoria que se
+vacía al cambiar la versión de los datos.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa json de la biblioteca estándar
+    orjson = None
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# una sola respuesta no puede ocupar más de esta fracción de la caché
+MAX_ENTRY_FRACTION = 4
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def encode_json(content: Any) -> bytes:
+    """Mismo formato que JSONResponse de Starlette (UTF-8, sin espacios)"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+
+class ResponseCache:
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # llave -> {codificación: bytes}
+        self._entries: "OrderedDict[str, Dict[str, bytes]]" = OrderedDict()
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_version(self, version: str) -> None:
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.bytes = 0
+            self._version = version
+
+    def get(self, key: str, version: str) -> Optional[Dict[str, bytes]]:
+        """Variantes guardadas de la respuesta; siempre incluye "identity" """
+        with self._lock:
+            self._check_version(version)
+            variants = self._entries.get(key)
+            if variants is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(variants)
+
+    def put(self, key: str, version: str, body: bytes, encoding: str = "identity") -> None:
+        """Una variante comprimida solo se guarda si la original sigue en la caché"""
+        if len(body) > self.max_bytes // MAX_ENTRY_FRACTION:
+            return
+        with self._lock:
+            self._check_version(version)
+            variants = self._entries.get(key)
+            if variants is None:
+                if encoding != "identity":
+                    return
+                variants = self._entries[key] = {}
+            previous = variants.get(encoding)
+            if previous is not None:
+                self.bytes -= len(previous)
+            variants[encoding] = body
+            self.bytes += len(body)
+            self._entries.move_to_end(key)
+            while self.bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= sum(len(value) for value in evicted.values())
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entradas": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "aciertos": self.hits,
+            "fallos": self.misses,
+            "tasa_aciertos": round(self.hits / total, 4) if total else None,
+            "desalojos": self.evictions,
+            "invalidaciones": self.invalidations,
+            "codificador": "orjson" if orjson is not None else "json"
+        }
+
+
+def response_cache_from_env() -> Optional[ResponseCache]:
+    """CFDI_RESPONSE_CACHE_MB=0 desactiva la caché"""
+    megabytes = float(os.getenv("CFDI_RESPONSE_CACHE_MB", DEFAULT_MAX_BYTES // (1024 * 1024)))
+    if megabytes <= 0:
+        return None
+    return ResponseCache(int(megabytes * 1024 * 1024))
+
+
+response_cache = response_cache_from_env()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return response_cache
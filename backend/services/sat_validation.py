@@ -0,0 +1,434 @@
+"""
+MVP CFDI - Motor de validación contra el servicio de estatus del SAT
+Consultas concurrentes con asyncio (concurrencia acotada, reintentos con backoff
+y límite de tasa por host) sobre un transporte intercambiable
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.amounts import parse_centavos
+
+SAT_URL = "https://consultaqr.facturaelectronica.sat.gob.mx/ConsultaCFDIService.svc"
+SOAP_ACTION = "http://tempuri.org/IConsultaCFDIService/Consulta"
+
+SOAP_TEMPLATE = (
+    '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:tem="http://tempuri.org/"><soapenv:Header/><soapenv:Body><tem:Consulta>'
+    '<tem:expresionImpresa><![CDATA[{expresion}]]></tem:expresionImpresa>'
+    '</tem:Consulta></soapenv:Body></soapenv:Envelope>'
+)
+
+
+class SATTransportError(Exception):
+    """Falla transitoria al consultar al SAT (timeout, 5xx, respuesta ilegible)"""
+
+
+@dataclass(frozen=True)
+class SATQuery:
+    uuid: str
+    emisor_rfc: str
+    receptor_rfc: str
+    total: str
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "SATQuery":
+        centavos = parse_centavos(record.get("total"))
+        return cls(
+            uuid=(record.get("uuid") or "").upper(),
+            emisor_rfc=record.get("emisor_rfc") or "",
+            receptor_rfc=record.get("receptor_rfc") or "",
+            total=f"{centavos // 100}.{centavos % 100:02d}"
+        )
+
+    def expresion_impresa(self) -> str:
+        return f"?re={self.emisor_rfc}&rr={self.receptor_rfc}&tt={self.total}&id={self.uuid}"
+
+
+@dataclass(frozen=True)
+class SATStatus:
+    codigo_estatus: str
+    estado: str
+    es_cancelable: str = ""
+    estatus_cancelacion: str = ""
+
+
+def parse_soap_response(body: bytes) -> SATStatus:
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError as e:
+        raise SATTransportError(f"Respuesta del SAT ilegible: {e}")
+    values = {element.tag.rsplit("}", 1)[-1]: (element.text or "").strip() for element in root.iter()}
+    if "Estado" not in values:
+        raise SATTransportError("Respuesta del SAT sin Estado")
+    return SATStatus(
+        codigo_estatus=values.get("CodigoEstatus", ""),
+        estado=values["Estado"],
+        es_cancelable=values.get("EsCancelable", ""),
+        estatus_cancelacion=values.get("EstatusCancelacion", "")
+    )
+
+
+# ==================== TRANSPORTES ====================
+
+class SATTransport(ABC):
+    """Interfaz de transporte; `host` identifica el límite de tasa que aplica"""
+    host = "local"
+    # estatus inventados (solo demo): se marcan en cada registro y no pasan por la caché
+    simulated = False
+
+    @abstractmethod
+    async def consulta(self, query: SATQuery) -> SATStatus:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class HTTPSATTransport(SATTransport):
+    """
+    SOAP sobre HTTP con un requests.Session compartido (pool de conexiones
+    keep-alive del mismo tamaño que la concurrencia) ejecutado en su propio pool de hilos.
+    """
+
+    def __init__(self, url: str = SAT_URL, pool_size: int = 20, timeout: float = 10.0):
+        self.url = url
+        self.host = urlparse(url).netloc
+        self.timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="sat-http")
+
+    def _post(self, query: SATQuery) -> SATStatus:
+        try:
+            response = self._session.post(
+                self.url,
+                data=SOAP_TEMPLATE.format(expresion=query.expresion_impresa()).encode("utf-8"),
+                headers={"Content-Type": "text/xml; charset=utf-8", "SOAPAction": SOAP_ACTION},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise SATTransportError(str(e))
+        if response.status_code >= 500 or response.status_code == 429:
+            raise SATTransportError(f"HTTP {response.status_code}")
+        return parse_soap_response(response.content)
+
+    async def consulta(self, query: SATQuery) -> SATStatus:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._post, query)
+
+    async def close(self) -> None:
+        self._session.close()
+        self._executor.shutdown(wait=False)
+
+
+class LocalSATTransport(SATTransport):
+    """
+    Solo para demos: responde en proceso con la misma lógica del SAT local
+    (services.fake_sat), sin consultar al SAT
+    """
+    simulated = True
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+
+    async def consulta(self, query: SATQuery) -> SATStatus:
+        from services.fake_sat import fake_status
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise SATTransportError("Error simulado del SAT local")
+        return fake_status(query.uuid)
+
+
+def create_transport(kind: Optional[str] = None) -> SATTransport:
+    """Transporte configurado con CFDI_SAT_TRANSPORT (http | local, solo demo)"""
+    kind = (kind or os.getenv("CFDI_SAT_TRANSPORT", "http")).lower()
+    if kind == "http":
+        return HTTPSATTransport(
+            os.getenv("CFDI_SAT_URL", SAT_URL),
+            pool_size=int(os.getenv("CFDI_SAT_CONCURRENCY", "20")),
+            timeout=float(os.getenv("CFDI_SAT_TIMEOUT", "10"))
+        )
+    if kind == "local":
+        return LocalSATTransport(latency=float(os.getenv("CFDI_SAT_LOCAL_LATENCY_MS", "0")) / 1000)
+    raise ValueError(f"Transporte SAT no soportado: {kind}")
+
+
+# ==================== MOTOR ====================
+
+class RateLimiter:
+    """
+    Token bucket: `rate` consultas por segundo con ráfagas de hasta `burst`.
+    Cada llamada aparta su turno (los tokens pueden quedar negativos) y duerme
+    lo que le toca; el candado es de hilos, así que un mismo límite por host
+    sirve para los event loops de las peticiones y de los trabajos en segundo plano.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            await asyncio.sleep(wait)
+
+
+@dataclass
+class ValidationResult:
+    query: SATQuery
+    status: Optional[SATStatus] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    cached: bool = False
+
+
+class SATValidationEngine:
+    """
+    Valida muchos CFDIs a la vez: a lo sumo `concurrency` consultas en vuelo,
+    `rate_per_second` por host y hasta `max_retries` reintentos con backoff
+    exponencial (con jitter) ante errores transitorios. Con `cache`
+    (services.status_cache.StatusCache) solo se consulta al SAT en un miss.
+    """
+
+    _limiters: Dict[str, RateLimiter] = {}
+
+    def __init__(
+        self,
+        transport: SATTransport,
+        concurrency: int = 20,
+        rate_per_second: float = 50.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        cache=None
+    ):
+        self.transport = transport
+        self.cache = cache
+        self.concurrency = concurrency
+        self.rate_per_second = rate_per_second
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def _limiter(self) -> RateLimiter:
+        limiter = self._limiters.get(self.transport.host)
+        if limiter is None or limiter.rate != self.rate_per_second:
+            limiter = self._limiters[self.transport.host] = RateLimiter(self.rate_per_second)
+        return limiter
+
+    async def validate_one(self, query: SATQuery) -> ValidationResult:
+        if self.cache is not None:
+            status = self.cache.get(query)
+            if status is not None:
+                return ValidationResult(query=query, status=status, cached=True)
+        limiter = self._limiter()
+        result = ValidationResult(query=query)
+        for attempt in range(self.max_retries + 1):
+            result.attempts = attempt + 1
+            await limiter.acquire()
+            try:
+                result.status = await self.transport.consulta(query)
+                result.error = None
+                if self.cache is not None:
+                    self.cache.put(query, result.status)
+                return result
+            except SATTransportError as e:
+                result.error = str(e)
+            if attempt < self.max_retries:
+                delay = self.backoff * (2 ** attempt)
+                await asyncio.sleep(delay + random.uniform(0, delay))
+        return result
+
+    async def validate(
+        self,
+        queries: Iterable[SATQuery],
+        on_result: Optional[Callable[[ValidationResult], Awaitable[None]]] = None
+    ) -> List[ValidationResult]:
+        """
+        Valida todas las consultas en orden; `on_result` recibe cada resultado al
+        terminar. Solo hay `concurrency` tareas: leen de una cola acotada que se
+        llena conforme avanzan, así que una corrida grande no crea una tarea por CFDI.
+        """
+        results: List[Optional[ValidationResult]] = []
+        queue: "asyncio.Queue[Optional[Tuple[int, SATQuery]]]" = asyncio.Queue(maxsize=self.concurrency * 2)
+        failures: List[BaseException] = []
+
+        async def worker() -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                if failures:
+                    # se sigue vaciando la cola para que el productor no se quede esperando
+                    continue
+                index, query = item
+                try:
+                    result = await self.validate_one(query)
+                    results[index] = result
+                    if on_result:
+                        await on_result(result)
+                except Exception as e:
+                    failures.append(e)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            for index, query in enumerate(queries):
+                results.append(None)
+                await queue.put((index, query))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        if failures:
+            raise failures[0]
+        return results
+
+
+def engine_from_env(transport: Optional[SATTransport] = None) -> SATValidationEngine:
+    from services.status_cache import cache_from_env
+
+    transport = transport or create_transport()
+    return SATValidationEngine(
+        transport,
+        concurrency=int(os.getenv("CFDI_SAT_CONCURRENCY", "20")),
+        rate_per_second=float(os.getenv("CFDI_SAT_RATE", "50")),
+        max_retries=int(os.getenv("CFDI_SAT_RETRIES", "3")),
+        # los estatus inventados no deben servirse después como si vinieran del SAT
+        cache=None if transport.simulated else cache_from_env()
+    )
+
+
+_engine: Optional[SATValidationEngine] = None
+
+
+def get_validation_engine() -> SATValidationEngine:
+    """Motor compartido: el pool de conexiones HTTP se reutiliza entre peticiones"""
+    global _engine
+    if _engine is None:
+        _engine = engine_from_env()
+    return _engine
+
+
+async def close_validation_engine() -> None:
+    global _engine
+    if _engine is not None:
+        await _engine.transport.close()
+        if _engine.cache is not None:
+            await asyncio.to_thread(_engine.cache.save)
+        _engine = None
+
+
+# ==================== ESCRITURA DE RESULTADOS ====================
+
+ESTADO_POR_ESTATUS = {
+    "vigente": "Válido",
+    "cancelado": "Cancelado"
+}
+
+
+def to_validation_record(record: Dict[str, Any], result: ValidationResult, simulated: bool = False) -> Dict[str, Any]:
+    """Registro de cfdis_validacion a partir del CFDI descargado y el resultado del SAT"""
+    if result.status is not None:
+        estatus_sat = result.status.estado
+        estado = ESTADO_POR_ESTATUS.get(estatus_sat.lower(), "Error")
+    else:
+        estatus_sat = "Sin respuesta"
+        estado = "Error"
+
+    validation = {
+        "id": record["id"],
+        "serie": record.get("serie", ""),
+        "folio": record.get("folio", ""),
+        "fecha": record.get("fecha", ""),
+        "emisor_rfc": record.get("emisor_rfc", ""),
+        "emisor_nombre": record.get("emisor_nombre", ""),
+        "receptor_rfc": record.get("receptor_rfc", ""),
+        "total": record.get("total", ""),
+        "uuid": record.get("uuid", ""),
+        "estado": estado,
+        "estatus_sat": estatus_sat,
+        "fecha_validacion": datetime.now().isoformat(timespec="seconds"),
+        "sello_valido": record.get("sello_valido"),
+        "certificado_valido": record.get("certificado_valido")
+    }
+    if result.status is not None:
+        validation["codigo_estatus"] = result.status.codigo_estatus
+        validation["es_cancelable"] = result.status.es_cancelable
+        validation["estatus_cancelacion"] = result.status.estatus_cancelacion
+    if result.error:
+        validation["error"] = result.error
+    if simulated:
+        validation["simulado"] = True
+    return validation
+
+
+def records_to_validate(descargados, validacion, ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    CFDIs descargados a consultar (todos o los `ids` indicados), combinados con su
+    validación previa para conservar sello_valido / certificado_valido
+    """
+    if ids:
+        selected = [record for record in map(descargados.get, ids) if record]
+    else:
+        selected = list(descargados)
+    return [{**(validacion.get(record["id"]) or {}), **record} for record in selected]
+
+
+async def validate_records(
+    records: List[Dict[str, Any]],
+    write_batch: Callable[[List[Dict[str, Any]]], Any],
+    engine: Optional[SATValidationEngine] = None,
+    batch_size: int = 200
+) -> Tuple[Dict[str, int], List[ValidationResult]]:
+    """
+    Consulta el estatus de `records` (CFDIs con UUID) y entrega los registros de
+    validación a `write_batch` por lotes conforme llegan; regresa los conteos por estado.
+    """
+    engine = engine or get_validation_engine()
+    by_uuid = {(record.get("uuid") or "").upper(): record for record in records if record.get("uuid")}
+    pending: List[Dict[str, Any]] = []
+    counts = {"Válido": 0, "Cancelado": 0, "Error": 0}
+
+    async def on_result(result: ValidationResult) -> None:
+        validation = to_validation_record(by_uuid[result.query.uuid], result, engine.transport.simulated)
+        counts[validation["estado"]] += 1
+        pending.append(validation)
+        if len(pending) >= batch_size:
+            batch = pending[:]
+            pending.clear()
+            await asyncio.to_thread(write_batch, batch)
+
+    results = await engine.validate(
+        (SATQuery.from_record(record) for record in by_uuid.values()),
+        on_result=on_result
+    )
+    if pending:
+        await asyncio.to_thread(write_batch, pending[:])
+    return counts, results
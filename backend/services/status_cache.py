@@ -0,0 +1,171 @@
+"""
+MVP CFDI - Caché de estatus del SAT
+LRU acotado por memoria con TTL por estatus: `Cancelado` es terminal y no expira,
+`No Encontrado` se guarda poco tiempo (caché negativa) y los errores no se guardan
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from services.journal import atomic_write_json
+from services.sat_validation import SATQuery, SATStatus
+
+CacheKey = Tuple[str, str, str, str]
+
+# segundos por estatus; None = no expira
+DEFAULT_TTLS: Dict[str, Optional[float]] = {
+    "cancelado": None,
+    "vigente": 24 * 3600,
+    # el SAT puede tardar en reflejar un CFDI recién timbrado
+    "no encontrado": 3600
+}
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def cache_key(query: SATQuery) -> CacheKey:
+    return (query.uuid.upper(), query.emisor_rfc.upper(), query.receptor_rfc.upper(), query.total)
+
+
+def entry_size(key: CacheKey, status: SATStatus) -> int:
+    """Tamaño aproximado en memoria de una entrada (llave, estatus y nodo del OrderedDict)"""
+    strings = key + (status.codigo_estatus, status.estado, status.es_cancelable, status.estatus_cancelacion)
+    return sum(sys.getsizeof(value) for value in strings) + 2 * sys.getsizeof(key) + 200
+
+
+class StatusCache:
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttls: Optional[Dict[str, Optional[float]]] = None,
+        default_ttl: Optional[float] = 3600,
+        path: Optional[str] = None
+    ):
+        self.max_bytes = max_bytes
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.default_ttl = default_ttl
+        self.path = path
+        # llave -> (estatus, expira en epoch o None, bytes)
+        self._entries: "OrderedDict[CacheKey, Tuple[SATStatus, Optional[float], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        if path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl_for(self, status: SATStatus) -> Optional[float]:
+        return self.ttls.get(status.estado.lower(), self.default_ttl)
+
+    def get(self, query: SATQuery) -> Optional[SATStatus]:
+        key = cache_key(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            status, expires, size = entry
+            if expires is not None and expires <= time.time():
+                del self._entries[key]
+                self.bytes -= size
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return status
+
+    def put(self, query: SATQuery, status: SATStatus) -> None:
+        ttl = self.ttl_for(status)
+        if ttl == 0:
+            return
+        self._store(cache_key(query), status, None if ttl is None else time.time() + ttl)
+
+    def _store(self, key: CacheKey, status: SATStatus, expires: Optional[float]) -> None:
+        size = entry_size(key, status)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self._entries[key] = (status, expires, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entradas": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "expirados": self.expired,
+            "desalojados": self.evictions,
+            "persistente": bool(self.path)
+        }
+
+    # ==================== PERSISTENCIA ====================
+
+    def load(self) -> None:
+        """Carga las entradas vigentes guardadas por save(); un archivo corrupto se ignora"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                rows = json.load(file)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for row in rows:
+            key, status, expires = tuple(row["key"]), SATStatus(**row["status"]), row["expires"]
+            if expires is None or expires > now:
+                self._store(key, status, expires)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            rows = [
+                {"key": list(key), "status": status.__dict__, "expires": expires}
+                for key, (status, expires, _) in self._entries.items()
+                if expires is None or expires > now
+            ]
+        atomic_write_json(self.path, rows)
+
+
+def cache_from_env() -> Optional[StatusCache]:
+    """
+    CFDI_SAT_CACHE_MB=0 desactiva la caché; CFDI_SAT_CACHE_FILE la persiste entre reinicios;
+    CFDI_SAT_CACHE_TTL_VIGENTE / CFDI_SAT_CACHE_TTL_NO_ENCONTRADO ajustan los TTL en segundos
+    """
+    max_mb = float(os.getenv("CFDI_SAT_CACHE_MB", "64"))
+    if max_mb <= 0:
+        return None
+    return StatusCache(
+        max_bytes=int(max_mb * 1024 * 1024),
+        ttls={
+            "vigente": float(os.getenv("CFDI_SAT_CACHE_TTL_VIGENTE", DEFAULT_TTLS["vigente"])),
+            "no encontrado": float(os.getenv("CFDI_SAT_CACHE_TTL_NO_ENCONTRADO", DEFAULT_TTLS["no encontrado"]))
+        },
+        path=os.getenv("CFDI_SAT_CACHE_FILE") or None
+    )
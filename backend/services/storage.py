@@ -0,0 +1,293 @@
+"""
+MVP CFDI - Backends de almacenamiento
+Persistencia detrás del CFDIStore: archivo JSON para demos o SQLite (modo WAL) para producción
+"""
+
+import json
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+from typing import Any, Dict, Hashable, Iterable, List
+
+from services.journal import WriteBehindJournal, read_journal
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "data"))
+DATA_FILE_PATH = os.path.join(DATA_DIR, "dummy_cfdis.json")
+SQLITE_PATH = os.path.join(DATA_DIR, "cfdis.db")
+
+# Columnas indexadas en SQLite; el registro completo se guarda en `data`
+SQLITE_COLUMNS = ("fecha", "uuid", "emisor_rfc", "receptor_rfc", "estado", "serie", "folio")
+
+
+class CFDIDataError(Exception):
+    """Error al leer o escribir el almacenamiento de CFDIs"""
+
+
+class StorageBackend(ABC):
+    """
+    Interfaz de persistencia.
+    load() regresa el mismo formato que dummy_cfdis.json; signature() cambia
+    cuando otro proceso modificó los datos, para que el store sepa cuándo recargar.
+    """
+
+    @abstractmethod
+    def load(self) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def signature(self) -> Hashable:
+        ...
+
+    @abstractmethod
+    def upsert_records(self, collection: str, records: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    def save_all(self, data: Dict[str, Any]) -> None:
+        ...
+
+    def flush(self) -> None:
+        """Espera a que las escrituras diferidas queden en disco"""
+
+    def close(self) -> None:
+        pass
+
+
+class JSONFileBackend(StorageBackend):
+    """
+    Snapshot JSON + journal de escritura diferida (<archivo>.journal).
+    Las escrituras se agregan al journal en lotes; el snapshot se reescribe de
+    forma atómica solo al compactar. Pensado para demos y un solo proceso.
+    """
+
+    def __init__(self, path: str = DATA_FILE_PATH, flush_interval: float = 0.05, compact_every: int = 1000):
+        self.path = path
+        self._data: Dict[str, Any] = {}
+        self._collections = set()
+        self._data_lock = threading.Lock()
+        self._loaded_signature = None
+        self._known_signature = None
+        self.journal = WriteBehindJournal(
+            path + ".journal",
+            path,
+            self._dump,
+            flush_interval=flush_interval,
+            compact_every=compact_every,
+            on_write=self._remember_files
+        )
+
+    def _files_signature(self) -> Hashable:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            raise CFDIDataError("Archivo de datos no encontrado")
+        try:
+            journal = os.stat(self.journal.path)
+            journal_signature = (journal.st_mtime_ns, journal.st_size)
+        except FileNotFoundError:
+            journal_signature = None
+        return stat.st_mtime_ns, stat.st_size, journal_signature
+
+    def _remember_files(self) -> None:
+        self._known_signature = self._files_signature()
+
+    def signature(self) -> Hashable:
+        # Las escrituras propias no cuentan como cambio: mientras los archivos
+        # coincidan con lo último que escribimos, la firma es la de la carga.
+        if not self.journal.io_lock.acquire(blocking=False):
+            return self._loaded_signature
+        try:
+            current = self._files_signature()
+        finally:
+            self.journal.io_lock.release()
+        return self._loaded_signature if current == self._known_signature else current
+
+    def load(self) -> Dict[str, Any]:
+        self.journal.flush()
+        with self.journal.io_lock:
+            signature = self._files_signature()
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    raw = json.load(file)
+            except FileNotFoundError:
+                raise CFDIDataError("Archivo de datos no encontrado")
+            except json.JSONDecodeError:
+                raise CFDIDataError("Error al leer el archivo de datos")
+
+            collections = {key for key, value in raw.items() if isinstance(value, list)}
+            data = {
+                key: {record["id"]: record for record in value} if key in collections else value
+                for key, value in raw.items()
+            }
+            replayed = 0
+            for collection, record in read_journal(self.journal.path):
+                collections.add(collection)
+                data.setdefault(collection, {})[record["id"]] = record
+                replayed += 1
+
+            with self._data_lock:
+                self._data = data
+                self._collections = collections
+            self.journal.entries = replayed
+            self._loaded_signature = self._known_signature = signature
+            return self._dump()
+
+    def _dump(self) -> Dict[str, Any]:
+        with self._data_lock:
+            return {
+                key: list(value.values()) if key in self._collections else value
+                for key, value in self._data.items()
+            }
+
+    def upsert_records(self, collection: str, records: List[Dict[str, Any]]) -> None:
+        with self._data_lock:
+            self._collections.add(collection)
+            target = self._data.setdefault(collection, {})
+            for record in records:
+                target[record["id"]] = record
+        self.journal.append(collection, records)
+
+    def save_all(self, data: Dict[str, Any]) -> None:
+        try:
+            self.journal.replace_snapshot(data)
+        except OSError as e:
+            raise CFDIDataError(f"Error al guardar el archivo de datos: {e}")
+        self.load()
+
+    def flush(self) -> None:
+        self.journal.flush()
+
+    def close(self) -> None:
+        self.journal.close()
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    SQLite en modo WAL: una fila por CFDI con índices por fecha, uuid, RFC y serie/folio.
+    Las escrituras son por registro (UPSERT) dentro de una transacción por lote.
+    Las demás llaves del JSON (p. ej. catalogos_sat) se guardan en la tabla meta.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        columns = ", ".join(f"{name} TEXT" for name in SQLITE_COLUMNS)
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS cfdis (
+                collection TEXT NOT NULL,
+                id TEXT NOT NULL,
+                {columns},
+                data TEXT NOT NULL,
+                PRIMARY KEY (collection, id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_cfdis_fecha ON cfdis (collection, fecha, id);
+            CREATE INDEX IF NOT EXISTS idx_cfdis_uuid ON cfdis (uuid);
+            CREATE INDEX IF NOT EXISTS idx_cfdis_emisor ON cfdis (collection, emisor_rfc);
+            CREATE INDEX IF NOT EXISTS idx_cfdis_receptor ON cfdis (collection, receptor_rfc);
+            CREATE INDEX IF NOT EXISTS idx_cfdis_serie_folio ON cfdis (collection, serie, folio);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+        """)
+
+    def signature(self) -> Hashable:
+        # data_version solo cambia cuando otra conexión (otro worker) hace commit
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
+        with self._lock:
+            for key, value in self._conn.execute("SELECT key, data FROM meta ORDER BY rowid"):
+                data[key] = json.loads(value)
+            for collection, value in self._conn.execute("SELECT collection, data FROM cfdis ORDER BY rowid"):
+                data.setdefault(collection, []).append(json.loads(value))
+        return data
+
+    def _rows(self, collection: str, records: Iterable[Dict[str, Any]]):
+        for record in records:
+            yield (
+                collection,
+                record["id"],
+                *(None if record.get(name) is None else str(record[name]) for name in SQLITE_COLUMNS),
+                json.dumps(record, ensure_ascii=False)
+            )
+
+    def _upsert(self, collection: str, records: Iterable[Dict[str, Any]]) -> None:
+        names = ", ".join(SQLITE_COLUMNS)
+        placeholders = ", ".join("?" for _ in range(len(SQLITE_COLUMNS) + 3))
+        updates = ", ".join(f"{name} = excluded.{name}" for name in SQLITE_COLUMNS + ("data",))
+        self._conn.executemany(
+            f"INSERT INTO cfdis (collection, id, {names}, data) VALUES ({placeholders}) "
+            f"ON CONFLICT (collection, id) DO UPDATE SET {updates}",
+            self._rows(collection, records)
+        )
+
+    def upsert_records(self, collection: str, records: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._upsert(collection, records)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise CFDIDataError(f"Error al guardar en SQLite: {e}")
+
+    def save_all(self, data: Dict[str, Any]) -> None:
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute("DELETE FROM cfdis")
+                self._conn.execute("DELETE FROM meta")
+                for key, value in data.items():
+                    if isinstance(value, list):
+                        self._upsert(key, value)
+                    else:
+                        self._conn.execute(
+                            "INSERT INTO meta (key, data) VALUES (?, ?)",
+                            (key, json.dumps(value, ensure_ascii=False))
+                        )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise CFDIDataError(f"Error al guardar en SQLite: {e}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_storage(kind: str = None) -> StorageBackend:
+    """Backend configurado con CFDI_STORAGE (json | sqlite)"""
+    kind = (kind or os.getenv("CFDI_STORAGE", "json")).lower()
+    if kind == "json":
+        return JSONFileBackend(
+            os.getenv("CFDI_DATA_FILE", DATA_FILE_PATH),
+            flush_interval=int(os.getenv("CFDI_JOURNAL_FLUSH_MS", "50")) / 1000,
+            compact_every=int(os.getenv("CFDI_JOURNAL_COMPACT_EVERY", "1000"))
+        )
+    if kind == "sqlite":
+        return SQLiteBackend(os.getenv("CFDI_SQLITE_PATH", SQLITE_PATH))
+    raise ValueError(f"Backend de almacenamiento no soportado: {kind}")
+
+
+def migrate_json_to_sqlite(json_path: str = DATA_FILE_PATH, sqlite_path: str = SQLITE_PATH) -> Dict[str, int]:
+    """Importa el archivo JSON a SQLite; regresa cuántos registros se importaron por colección"""
+    data = JSONFileBackend(json_path).load()
+    target = SQLiteBackend(sqlite_path)
+    try:
+        target.save_all(data)
+    finally:
+        target.close()
+    return {key: len(value) for key, value in data.items() if isinstance(value, list)}
@@ -0,0 +1,72 @@
+"""
+MVP CFDI - Estadísticas de validación incrementales
+Contadores válidos/cancelados/errores que se actualizan al agregar o cambiar resultados de validación
+"""
+
+import threading
+from typing import Any, Dict
+
+ESTADOS = ("validos", "cancelados", "errores")
+
+
+def classify(record: Dict[str, Any]) -> str:
+    estado = (record.get("estado") or "").lower()
+    if estado == "válido":
+        return "validos"
+    if estado == "cancelado":
+        return "cancelados"
+    # Pendiente y cualquier otro estado cuentan como errores (contrato de /validate)
+    return "errores"
+
+
+def month_of(record: Dict[str, Any]) -> str:
+    return (record.get("fecha") or "")[:7] or "sin_fecha"
+
+
+def _empty() -> Dict[str, int]:
+    return dict.fromkeys(ESTADOS, 0)
+
+
+class ValidationStats:
+    """
+    Conteos globales, por emisor_rfc y por mes (AAAA-MM de la fecha del CFDI).
+    CFDICollection llama add()/remove() desde sus rutinas de indexado; las
+    lecturas llegan desde las rutas mientras tanto, así que comparten un candado.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totales = _empty()
+        self._por_emisor: Dict[str, Dict[str, int]] = {}
+        self._por_mes: Dict[str, Dict[str, int]] = {}
+
+    def _apply(self, record: Dict[str, Any], delta: int) -> None:
+        estado = classify(record)
+        with self._lock:
+            self._totales[estado] += delta
+            for groups, key in (
+                (self._por_emisor, record.get("emisor_rfc") or "sin_rfc"),
+                (self._por_mes, month_of(record))
+            ):
+                counters = groups.setdefault(key, _empty())
+                counters[estado] += delta
+                if not any(counters.values()):
+                    del groups[key]
+
+    def add(self, record: Dict[str, Any]) -> None:
+        self._apply(record, 1)
+
+    def remove(self, record: Dict[str, Any]) -> None:
+        self._apply(record, -1)
+
+    def totales(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._totales)
+
+    def por_emisor(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {rfc: dict(counters) for rfc, counters in self._por_emisor.items()}
+
+    def por_mes(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {mes: dict(counters) for mes, counters in sorted(self._por_mes.items())}
@@ -0,0 +1,101 @@
+"""
+Pruebas de generación de CFDI: un comprobante con montos fuera de rango se
+rechaza por índice sin tumbar el lote ni quemar folios
+"""
+
+import pytest
+
+from services.cfdi_generation import CFDIGenerator, CSDSigner, validate_payload
+from services.folios import FolioAllocator
+from services.pac import LocalPAC
+
+CATALOGOS = {"formas_pago": {"01"}, "monedas": {"MXN"}, "tipos_comprobante": {"I"}}
+
+
+def comprobante(**concepto):
+    return {
+        "serie": "A",
+        "emisor_rfc": "AAA010101AAA",
+        "emisor_nombre": "Emisor",
+        "receptor_rfc": "XAXX010101000",
+        "receptor_nombre": "Receptor",
+        "forma_pago": "01",
+        "moneda": "MXN",
+        "tipo_comprobante": "I",
+        "metodo_pago": "PUE",
+        "lugar_expedicion": "01000",
+        "domicilio_fiscal_receptor": "01000",
+        "conceptos": [{"cantidad": "1", "descripcion": "Servicio", "valor_unitario": "100", **concepto}]
+    }
+
+
+@pytest.fixture(scope="module")
+def signer():
+    return CSDSigner.ephemeral()
+
+
+@pytest.fixture(scope="module")
+def pac():
+    return LocalPAC()
+
+
+@pytest.fixture
+def generator(tmp_path, signer, pac):
+    folios = FolioAllocator(path=str(tmp_path / "folios.db"))
+    yield CFDIGenerator(folios, signer, pac, xml_dir=str(tmp_path / "xml"))
+    folios.close()
+
+
+@pytest.mark.parametrize("field", ["cantidad", "valor_unitario"])
+@pytest.mark.parametrize("value", ["Infinity", "NaN", "1E+30", "0.0000001"])
+def test_validate_payload_rechaza_montos_fuera_de_rango(field, value):
+    errors = validate_payload(comprobante(**{field: value}), CATALOGOS)
+    assert any("fuera de rango" in error for error in errors)
+
+
+def test_generate_rechaza_el_indice_invalido_sin_quemar_folios(generator):
+    ok = comprobante()
+    inserted = []
+
+    timbrados, errors = generator.generate(
+        [ok, ok, comprobante(valor_unitario="Infinity"), ok], CATALOGOS, inserted.extend
+    )
+
+    assert timbrados == 3
+    assert [error["indice"] for error in errors] == [2]
+    assert sorted(int(record["folio"]) for record in inserted) == [1, 2, 3]
+    assert generator.folios.audit("AAA010101AAA", "A", [record["folio"] for record in inserted])["huecos"] == []
+
+
+def test_generate_reporta_por_indice_un_error_al_armar(generator, monkeypatch):
+    from services import cfdi_generation
+
+    render = cfdi_generation.render_cfdi
+
+    def failing_render(payload, *args):
+        if payload.get("receptor_nombre") == "Falla":
+            raise ValueError("plantilla")
+        return render(payload, *args)
+
+    monkeypatch.setattr(cfdi_generation, "render_cfdi", failing_render)
+    inserted = []
+
+    timbrados, errors = generator.generate(
+        [comprobante(), {**comprobante(), "receptor_nombre": "Falla"}, comprobante()], CATALOGOS, inserted.extend
+    )
+
+    assert timbrados == 2
+    assert [error["indice"] for error in errors] == [1]
+    assert len(inserted) == 2
+
+
+def test_generate_reporta_los_timbres_que_el_pac_no_regresa(generator, monkeypatch):
+    timbrar_lote = generator.pac.timbrar_lote
+    monkeypatch.setattr(generator.pac, "timbrar_lote", lambda comprobantes: timbrar_lote(comprobantes)[:-1])
+    inserted = []
+
+    timbrados, errors = generator.generate([comprobante(), comprobante(), comprobante()], CATALOGOS, inserted.extend)
+
+    assert timbrados == 2
+    assert [error["indice"] for error in errors] == [2]
+    assert errors[0]["errores"][0].startswith("PAC:")
@@ -0,0 +1,29 @@
+"""
+Pruebas de deduplicación de CFDICollection: la llave UUID y la de
+emisor + serie + folio coinciden en ambos sentidos
+"""
+
+from services.cfdi_index import CFDICollection
+
+SIN_UUID = {"id": "a", "emisor_rfc": "AAA010101AAA", "serie": "A", "folio": "1", "fecha": "2024-01-01"}
+
+
+def test_find_duplicate_con_uuid_encuentra_el_registro_sin_uuid():
+    collection = CFDICollection([SIN_UUID], dedupe=True)
+    timbrado = {**SIN_UUID, "id": "b", "uuid": "5A1F0000-0000-0000-0000-000000000001"}
+
+    assert collection.find_duplicate(timbrado) == "a"
+
+
+def test_find_duplicate_sin_uuid_encuentra_el_registro_timbrado():
+    timbrado = {**SIN_UUID, "uuid": "5A1F0000-0000-0000-0000-000000000001"}
+    collection = CFDICollection([timbrado], dedupe=True)
+
+    assert collection.find_duplicate({**SIN_UUID, "id": "b"}) == "a"
+
+
+def test_find_duplicate_distingue_uuid_distintos_con_el_mismo_folio():
+    timbrado = {**SIN_UUID, "uuid": "5A1F0000-0000-0000-0000-000000000001"}
+    collection = CFDICollection([timbrado], dedupe=True)
+
+    assert collection.find_duplicate({**timbrado, "id": "b", "uuid": "5A1F0000-0000-0000-0000-000000000002"}) is None
@@ -279,7 +279,7 @@ function LoginPage() {
             </button>
           </div>
           <p style={{ margin: '10px 0 0 0', fontSize: '12px', color: '#666' }}>
-            💡 También puedes usar cualquier usuario/contraseña para el MVP
+            💡 Cualquier otro usuario requiere CFDI_AUTH_DEMO_ANY_USER=1 en el backend
           </p>
         </div>
       </div>
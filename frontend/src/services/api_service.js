@@ -17,6 +17,15 @@ const api_client = axios.create({
   },
 });
 
+// Interceptor para enviar el token de sesión en cada petición
+api_client.interceptors.request.use((config) => {
+  const token = localStorage.getItem('cfdi_token');
+  if (token) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
+
 // Interceptor para manejar errores globalmente
 api_client.interceptors.response.use(
   (response) => response,
@@ -24,6 +33,11 @@ api_client.interceptors.response.use(
     console.error('Error en API:', error);
     
     if (error.response) {
+      if (error.response.status === 401) {
+        // token expirado o revocado: la sesión local ya no sirve
+        localStorage.removeItem('cfdi_token');
+        localStorage.removeItem('cfdi_user');
+      }
       const error_message = error.response.data?.message || 'Error del servidor';
       return Promise.reject({
         status: error.response.status,
@@ -113,13 +127,23 @@ export const check_session = () => {
 
 // ==================== SERVICIOS DE CFDIs ====================
 
-export const get_downloaded_cfdis = async () => {
+// Columnas que muestra la tabla de resultados por acción (proyección `fields=`)
+const TABLE_FIELDS = {
+  download: 'id,fecha,total,estado,emisor_nombre,receptor_nombre,serie,folio',
+  validate: 'id,fecha,total,estado,emisor_nombre,estatus_sat,sello_valido',
+  generate: 'id,fecha,total,estado,receptor_nombre,uuid,serie,folio'
+};
+
+export const get_downloaded_cfdis = async (cursor = null) => {
   try {
-    const response = await api_client.get('/cfdis/download');
+    const response = await api_client.get('/cfdis/download', {
+      params: { fields: TABLE_FIELDS.download, cursor }
+    });
     return {
       success: true,
       data: response.data.data,
       total: response.data.total_cfdis,
+      next_cursor: response.data.next_cursor,
       message: response.data.message
     };
   } catch (error) {
@@ -132,13 +156,16 @@ export const get_downloaded_cfdis = async () => {
   }
 };
 
-export const get_validated_cfdis = async () => {
+export const get_validated_cfdis = async (cursor = null) => {
   try {
-    const response = await api_client.get('/cfdis/validate');
+    const response = await api_client.get('/cfdis/validate', {
+      params: { fields: TABLE_FIELDS.validate, cursor }
+    });
     return {
       success: true,
       data: response.data.data,
       total: response.data.total_cfdis,
+      next_cursor: response.data.next_cursor,
       stats: response.data.estadisticas,
       message: response.data.message
     };
@@ -153,13 +180,16 @@ export const get_validated_cfdis = async () => {
   }
 };
 
-export const get_generated_cfdis = async () => {
+export const get_generated_cfdis = async (cursor = null) => {
   try {
-    const response = await api_client.get('/cfdis/generate');
+    const response = await api_client.get('/cfdis/generate', {
+      params: { fields: TABLE_FIELDS.generate, cursor }
+    });
     return {
       success: true,
       data: response.data.data,
       total: response.data.total_cfdis,
+      next_cursor: response.data.next_cursor,
       total_amount: response.data.total_amount,
       message: response.data.message
     };
@@ -191,6 +221,50 @@ export const create_cfdi = async (cfdi_data) => {
   }
 };
 
+// ==================== SERVICIOS DE TRABAJOS ====================
+
+export const create_job = async (tipo, payload = {}) => {
+  try {
+    const response = await api_client.post('/jobs', { tipo, payload });
+    return {
+      success: true,
+      data: response.data.job,
+      message: response.data.message
+    };
+  } catch (error) {
+    return {
+      success: false,
+      data: null,
+      message: error.data?.detail || error.message || 'Error al crear el trabajo'
+    };
+  }
+};
+
+// Sigue un trabajo en vivo; handlers: { on_estado, on_progress, on_batch, on_done, on_error }
+// Regresa una función para cerrar la conexión
+export const subscribe_job_events = (job_id, handlers = {}) => {
+  // EventSource no permite headers: el token va en la query
+  const token = encodeURIComponent(localStorage.getItem('cfdi_token') || '');
+  const source = new EventSource(`${API_BASE_URL}/jobs/${job_id}/events?access_token=${token}`);
+  const listen = (evento, handler) => {
+    source.addEventListener(evento, (event) => {
+      if (handler) handler(JSON.parse(event.data));
+    });
+  };
+  listen('estado', handlers.on_estado);
+  listen('progress', handlers.on_progress);
+  listen('batch', handlers.on_batch);
+  source.addEventListener('done', (event) => {
+    source.close();
+    if (handlers.on_done) handlers.on_done(JSON.parse(event.data));
+  });
+  source.onerror = (error) => {
+    // EventSource reintenta solo; se avisa por si la UI quiere mostrarlo
+    if (handlers.on_error) handlers.on_error(error);
+  };
+  return () => source.close();
+};
+
 // ==================== SERVICIOS DE UTILIDAD ====================
 
 export const check_api_health = async () => {
@@ -227,6 +301,45 @@ export const get_sat_catalogs = async () => {
   }
 };
 
+export const search_sat_catalog = async (nombre, { q, cursor, limit = 50 } = {}) => {
+  try {
+    const response = await api_client.get(`/catalogos/${encodeURIComponent(nombre)}`, {
+      params: { q: q || undefined, cursor: cursor || undefined, limit }
+    });
+    return {
+      success: true,
+      data: response.data.data,
+      next_cursor: response.data.next_cursor,
+      total: response.data.total,
+      message: response.data.message
+    };
+  } catch (error) {
+    return {
+      success: false,
+      data: [],
+      next_cursor: null,
+      message: error.data?.detail || error.message || 'Error al consultar el catálogo'
+    };
+  }
+};
+
+export const get_sat_catalog_entry = async (nombre, clave) => {
+  try {
+    const response = await api_client.get(`/catalogos/${encodeURIComponent(nombre)}/${encodeURIComponent(clave)}`);
+    return {
+      success: true,
+      data: response.data.data,
+      message: response.data.message
+    };
+  } catch (error) {
+    return {
+      success: false,
+      data: null,
+      message: error.data?.detail || error.message || 'Clave no encontrada'
+    };
+  }
+};
+
 export const get_general_stats = async () => {
   try {
     const response = await api_client.get('/stats/general');
@@ -311,8 +424,12 @@ export default {
   get_validated_cfdis,
   get_generated_cfdis,
   create_cfdi,
+  create_job,
+  subscribe_job_events,
   check_api_health,
   get_sat_catalogs,
+  search_sat_catalog,
+  get_sat_catalog_entry,
   get_general_stats,
   get_action_data,
   format_table_data